@@ -0,0 +1,97 @@
+"""Benchmark authenticating a request with and without the principal cache.
+
+Runs ``services.auth.get_current_user`` in process against the configured
+database in three modes:
+
+- ``lookup``: the previous behaviour, one users query per request
+- ``cached``: verified principals served from ``principal_cache``
+- ``stateless``: uid/active claims trusted from the token
+
+Usage:
+    python benchmarks/auth_principal.py [--requests 2000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, select
+
+from database import AsyncSessionLocal, async_engine, init_db
+from models.database_models import User
+from services import auth
+
+BENCHMARK_EMAIL = "auth-benchmark@example.com"
+
+queries = 0
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global queries
+    queries += 1
+
+
+async def benchmark_user() -> User:
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).filter(User.email == BENCHMARK_EMAIL))
+        if user is None:
+            user = User(
+                email=BENCHMARK_EMAIL,
+                username="auth-benchmark",
+                hashed_password=auth.get_password_hash("benchmark"),
+                is_active=True
+            )
+            db.add(user)
+            await db.commit()
+        return user
+
+
+async def run(mode: str, token: str, requests: int) -> dict:
+    global queries
+    auth.STATELESS_TOKENS = mode == "stateless"
+    auth.principal_cache.clear()
+    queries = 0
+    timings = []
+    for _ in range(requests):
+        if mode == "lookup":
+            auth.principal_cache.clear()
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await auth.get_current_user(token, db)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {
+        "mode": mode,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[int(len(timings) * 0.99) - 1] * 1000,
+        "per_second": requests / sum(timings),
+        "queries_per_request": queries / requests,
+    }
+
+
+async def main(requests: int) -> None:
+    init_db()
+    user = await benchmark_user()
+    token = auth.create_access_token(data=auth.token_claims(user))
+
+    print(f"{'mode':<10} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>10} {'queries/req':>12}")
+    for mode in ("lookup", "cached", "stateless"):
+        result = await run(mode, token, requests)
+        print(
+            f"{result['mode']:<10} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} "
+            f"{result['per_second']:>10.0f} {result['queries_per_request']:>12.2f}"
+        )
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
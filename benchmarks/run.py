@@ -0,0 +1,389 @@
+"""Benchmark the search, suggest, collection and history endpoints.
+
+Seeds a database with a synthetic corpus (see ``load_data.py``), then drives
+the API in process through its ASGI app, so numbers include routing,
+validation and serialization but no network. For every scenario it
+reports p50/p95/p99 latency, throughput and SQL statements per request,
+and writes the results as JSON for diffing between versions.
+
+Usage:
+    python benchmarks/run.py --studies 100000
+    python benchmarks/run.py --database postgresql://localhost/bench --studies 1000000
+    python benchmarks/run.py --compare benchmarks/results/old.json
+    python benchmarks/run.py --database postgresql://localhost/bench --backend duckdb
+
+Without ``--database``, a SQLite file per corpus size is kept under
+``benchmarks/.data`` and reused by later runs. ``--backend`` overrides
+``SEARCH_BACKEND``; for ``duckdb`` the Parquet snapshot is exported from the
+seeded database first, and the export time is reported.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, "benchmarks", ".data")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+SCENARIOS = (
+    "search", "search_cached", "search_facets", "search_date_range",
+    "suggest", "collections", "search_history",
+)
+BACKENDS = ("postgres", "memory", "duckdb")
+
+# Data of the benchmark user created on the seeded database
+BENCHMARK_USER = {
+    "email": "benchmark@example.com",
+    "username": "benchmark",
+    "password": "benchmark-password",
+}
+COLLECTIONS = 5
+ITEMS_PER_COLLECTION = 50
+HISTORY_ENTRIES = 500
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_corpus(studies: int, seed: int) -> None:
+    """Top the database up to ``studies`` synthetic studies.
+
+    Synthetic records are deterministic, so an existing benchmark database
+    only needs the records it does not have yet.
+    """
+    from sqlalchemy import func, select
+
+    from database import SessionLocal, engine, init_db
+    from load_data import Checkpoint, finish_load, load_studies, synthetic_studies
+    from models.database_models import ClinicalStudy
+
+    init_db()
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(ClinicalStudy))
+    if existing >= studies:
+        return
+    checkpoint = Checkpoint(None)
+    checkpoint.counts["synthetic"] = existing
+    load_studies(engine, synthetic_studies(studies, seed), checkpoint=checkpoint, name="synthetic")
+    finish_load(engine)
+
+
+def export_benchmark_snapshot(studies: int) -> float:
+    """Export the seeded corpus for the duckdb backend; returns the seconds taken"""
+    snapshot_dir = os.path.join(DATA_DIR, f"snapshot-{studies}")
+    # Read by services.columnar at import time
+    os.environ["SEARCH_SNAPSHOT_DIR"] = snapshot_dir
+
+    from database import engine
+    from services.columnar import export_snapshot
+
+    started = time.perf_counter()
+    export_snapshot(engine, snapshot_dir)
+    elapsed = time.perf_counter() - started
+    print(f"Parquet snapshot exported in {elapsed:.1f}s")
+    return elapsed
+
+
+class QueryCounter:
+    """Counts SQL statements sent by the async engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+RequestFactory = Callable[[random.Random], Tuple[str, str, Dict[str, Any]]]
+
+
+def search_request(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+    from load_data import CONDITIONS, INTERVENTIONS, PHASES, STATUSES
+
+    terms = rng.sample(CONDITIONS + INTERVENTIONS, rng.randint(1, 2))
+    params: Dict[str, Any] = {"q": " OR ".join(terms), "per_page": 10}
+    if rng.random() < 0.3:
+        params["status"] = rng.choice(STATUSES)
+    if rng.random() < 0.3:
+        params["phase"] = rng.choice(PHASES)
+    if rng.random() < 0.2:
+        params["page"] = rng.randint(2, 5)
+    return "GET", "/api/search", {"params": params}
+
+
+def facets_request(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+    method, url, kwargs = search_request(rng)
+    kwargs["params"]["facets"] = "true"
+    return method, url, kwargs
+
+
+def date_range_request(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+    """A filter-only search over every study started in a window of months"""
+    start = datetime(2020, 1, 1) + timedelta(days=rng.randint(0, 5 * 365))
+    end = start + timedelta(days=rng.randint(90, 2 * 365))
+    params = {"q": " ", "start_date": start.isoformat(), "end_date": end.isoformat(), "per_page": 10}
+    return "GET", "/api/search", {"params": params}
+
+
+def suggest_request(rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+    from load_data import CONDITIONS, INTERVENTIONS
+
+    word = rng.choice(CONDITIONS + INTERVENTIONS)
+    return "GET", "/api/suggest", {"params": {"q": word[:rng.randint(2, len(word))]}}
+
+
+class Benchmark:
+    def __init__(self, requests: int, concurrency: int, warmup: int, seed: int):
+        import main
+        from database import async_engine
+
+        self.app = main.app
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.seed = seed
+        self.queries = QueryCounter(async_engine)
+        self.headers: Dict[str, str] = {}
+
+    async def setup(self, client) -> None:
+        """Log the benchmark user in and give them collections and history"""
+        response = await client.post("/api/auth/login", data={
+            "username": BENCHMARK_USER["email"],
+            "password": BENCHMARK_USER["password"],
+        })
+        fresh_user = response.status_code != 200
+        if fresh_user:
+            response = await client.post("/api/auth/register", json=BENCHMARK_USER)
+            response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        if not fresh_user:
+            return
+
+        rng = random.Random(self.seed)
+        for n in range(COLLECTIONS):
+            response = await client.post("/api/collections", headers=self.headers, json={
+                "title": f"Benchmark collection {n + 1}",
+                "description": "Created by benchmarks/run.py",
+            })
+            response.raise_for_status()
+            data_product_ids = rng.sample(range(1, 2 * ITEMS_PER_COLLECTION * COLLECTIONS), ITEMS_PER_COLLECTION)
+            response = await client.post(
+                f"/api/collections/{response.json()['id']}/items",
+                headers=self.headers,
+                json={"data_product_ids": data_product_ids}
+            )
+            response.raise_for_status()
+        for n in range(HISTORY_ENTRIES):
+            _, _, search = search_request(rng)
+            response = await client.post("/api/search-history", headers=self.headers, json={
+                "query": search["params"]["q"],
+                "filters": {},
+                "results_count": rng.randint(0, 1000),
+            })
+            response.raise_for_status()
+
+    def factories(self) -> Dict[str, Tuple[RequestFactory, Optional[Callable[[], None]]]]:
+        """Request factory of each scenario, with a hook run before each request"""
+        from services.cache import search_cache
+
+        cached_searches = [search_request(random.Random(n)) for n in range(20)]
+        headers = {"headers": self.headers}
+        return {
+            # Cleared per request, so this measures the search backend itself
+            "search": (search_request, search_cache.local.clear),
+            "search_cached": (lambda rng: rng.choice(cached_searches), None),
+            "search_facets": (facets_request, search_cache.local.clear),
+            "search_date_range": (date_range_request, search_cache.local.clear),
+            "suggest": (suggest_request, None),
+            "collections": (lambda rng: ("GET", "/api/collections", headers), None),
+            "search_history": (
+                lambda rng: ("GET", "/api/search-history", dict(headers, params={"limit": 50})),
+                None
+            ),
+        }
+
+    async def run_scenario(self, client, name: str, factory: RequestFactory, before: Optional[Callable[[], None]]) -> Dict[str, Any]:
+        rng = random.Random(f"{self.seed}:{name}")
+        requests = [factory(rng) for _ in range(self.warmup + self.requests)]
+        latencies: List[float] = []
+        errors = 0
+
+        async def send(method: str, url: str, kwargs: Dict[str, Any], record: bool) -> None:
+            nonlocal errors
+            if before is not None:
+                before()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+            if record:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors += 1
+
+        for method, url, kwargs in requests[:self.warmup]:
+            await send(method, url, kwargs, record=False)
+
+        queue = iter(requests[self.warmup:])
+
+        async def worker() -> None:
+            for method, url, kwargs in queue:
+                await send(method, url, kwargs, record=True)
+
+        self.queries.count = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        wall_time = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "throughput_rps": len(latencies) / wall_time,
+            "queries_per_request": self.queries.count / max(len(latencies), 1),
+        }
+
+    async def run(self, scenarios: List[str]) -> Dict[str, Dict[str, Any]]:
+        import httpx
+
+        results = {}
+        # The ASGI transport does not send lifespan events, so run startup here
+        async with self.app.router.lifespan_context(self.app):
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                await self.setup(client)
+                factories = self.factories()
+                for name in scenarios:
+                    factory, before = factories[name]
+                    results[name] = await self.run_scenario(client, name, factory, before)
+                    print_row(name, results[name])
+        return results
+
+
+def print_header() -> None:
+    print(f"{'scenario':<18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'errors':>7}")
+
+
+def print_row(name: str, result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    line = (
+        f"{name:<18} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+        f"{result['throughput_rps']:>8.0f} {result['queries_per_request']:>8.2f} {result['errors']:>7}"
+    )
+    if baseline:
+        change = (result["p50_ms"] - baseline["p50_ms"]) / baseline["p50_ms"] * 100
+        line += f"   p50 {change:+.1f}% vs baseline"
+    print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the BioMed Search API in process")
+    parser.add_argument("--studies", type=int, default=10000, help="size of the synthetic corpus")
+    parser.add_argument("--database", help="database URL; defaults to a SQLite file per corpus size")
+    parser.add_argument("--backend", choices=BACKENDS, help="search backend; defaults to SEARCH_BACKEND or the dialect's")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file; defaults to benchmarks/results/<revision>-<studies>.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--log-level", default="WARNING", help="application log level during the run")
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.database:
+        database_url = args.database
+    else:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        database_url = f"sqlite:///{os.path.join(DATA_DIR, f'corpus-{args.studies}.db')}"
+    # The application reads its database from the environment at import time
+    os.environ["DATABASE_URL"] = database_url
+
+    if args.backend:
+        os.environ["SEARCH_BACKEND"] = args.backend
+
+    seed_corpus(args.studies, args.seed)
+    snapshot_seconds = None
+    if args.backend == "duckdb":
+        snapshot_seconds = export_benchmark_snapshot(args.studies)
+
+    benchmark = Benchmark(args.requests, args.concurrency, args.warmup, args.seed)
+    logging.getLogger().setLevel(args.log_level)
+    from services.search_backend import get_search_backend
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)["scenarios"]
+
+    print_header()
+    results = asyncio.run(benchmark.run(scenarios))
+    if baseline:
+        print("\nCompared with", args.compare)
+        for name, result in results.items():
+            print_row(name, result, baseline.get(name))
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "database": database_url.split(":", 1)[0],
+            "search_backend": get_search_backend().name,
+            "snapshot_export_seconds": snapshot_seconds,
+            "studies": args.studies,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "scenarios": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = f"-{args.backend}" if args.backend else ""
+        output = os.path.join(RESULTS_DIR, f"{revision or 'unknown'}-{args.studies}{suffix}.json")
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Profile a cold start of the API: import time per module and time to first request.
+
+Each run starts the application in fresh processes, as a new pod or worker
+would. The import profile comes from ``python -X importtime -c "import
+main"``; time to first request is measured by starting uvicorn and polling
+``/api/health`` until it answers, which happens once the startup event,
+index warm-up included, has finished. The steps of that event are reported
+from the ``startup_seconds`` of the health response.
+
+Usage:
+    python benchmarks/startup.py --database sqlite:///benchmarks/.data/corpus-10000.db
+    python benchmarks/startup.py --database postgresql://localhost/bench --runs 5 --target 5
+
+With ``--target``, the script exits with status 1 when the median time to
+first request is over the target, so it can gate deploys on cold starts.
+Results are written as JSON to ``benchmarks/results/startup-<revision>.json``.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import RESULTS_DIR, git_revision  # noqa: E402
+
+# Modules and packages listed in the import report
+TOP_MODULES = 15
+
+# (module, self seconds, cumulative seconds) as reported by -X importtime
+ImportTimes = List[Tuple[str, float, float]]
+
+
+def import_profile(env: Dict[str, str]) -> ImportTimes:
+    """Import ``main`` in a fresh interpreter and return the time of every module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing main failed:\n{result.stderr[-2000:]}")
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def total_seconds(modules: ImportTimes) -> float:
+    """Cumulative import time of ``main`` itself"""
+    return next(cumulative for name, _, cumulative in reversed(modules) if name == "main")
+
+
+def package_times(modules: ImportTimes) -> Dict[str, float]:
+    """Self time summed per top-level package, slowest first"""
+    totals: Dict[str, float] = defaultdict(float)
+    for name, self_seconds, _ in modules:
+        totals[name.split(".")[0]] += self_seconds
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def first_request(env: Dict[str, str], timeout: float) -> Tuple[float, Dict[str, Any]]:
+    """Start uvicorn; returns seconds until /api/health answered, and its response"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"The server exited with status {server.returncode} before answering")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+                    health = json.load(response)
+                return time.perf_counter() - started, health
+            except OSError:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"No response within {timeout:.0f}s")
+                time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_times(title: str, times: Dict[str, float]) -> None:
+    print(f"\n{title}")
+    for name, seconds in times.items():
+        print(f"  {name:<40} {seconds * 1000:9.1f} ms")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Profile a cold start of the BioMed Search API")
+    parser.add_argument("--database", default=os.environ.get("DATABASE_URL"), help="database URL; defaults to DATABASE_URL")
+    parser.add_argument("--runs", type=int, default=3, help="cold starts measured; medians are reported")
+    parser.add_argument("--target", type=float, help="fail when the median time to first request exceeds this many seconds")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the first response")
+    parser.add_argument("--output", help="results file; defaults to benchmarks/results/startup-<revision>.json")
+    args = parser.parse_args(argv)
+    if not args.database:
+        parser.error("pass --database or set DATABASE_URL")
+
+    env = {**os.environ, "DATABASE_URL": args.database, "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING")}
+    imports: List[ImportTimes] = []
+    requests: List[Tuple[float, Dict[str, Any]]] = []
+    for run in range(args.runs):
+        imports.append(import_profile(env))
+        requests.append(first_request(env, args.timeout))
+        print(f"run {run + 1}: import {total_seconds(imports[-1]):.2f}s, first request {requests[-1][0]:.2f}s")
+
+    import_seconds = statistics.median(total_seconds(modules) for modules in imports)
+    first_request_seconds = statistics.median(seconds for seconds, _ in requests)
+    # Module breakdown of the fastest import, the one least disturbed by noise
+    modules = min(imports, key=total_seconds)
+    slowest = sorted(modules, key=lambda module: -module[1])[:TOP_MODULES]
+    packages = dict(list(package_times(modules).items())[:TOP_MODULES])
+    steps = {
+        step: statistics.median(health.get("startup_seconds", {}).get(step, 0.0) for _, health in requests)
+        for step in requests[0][1].get("startup_seconds", {})
+    }
+
+    print_times("Import self time by package", packages)
+    print_times("Slowest modules (self time)", {name: seconds for name, seconds, _ in slowest})
+    print_times("Startup steps", steps)
+    print(f"\nimport main          {import_seconds:8.2f} s")
+    print(f"first request        {first_request_seconds:8.2f} s")
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "database": args.database.split(":", 1)[0],
+            "search_backend": os.environ.get("SEARCH_BACKEND"),
+            "runs": args.runs,
+        },
+        "import_seconds": import_seconds,
+        "first_request_seconds": first_request_seconds,
+        "startup_steps": steps,
+        "packages": packages,
+        "modules": [
+            {"module": name, "self_seconds": self_seconds, "cumulative_seconds": cumulative}
+            for name, self_seconds, cumulative in slowest
+        ],
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"startup-{revision or 'unknown'}.json")
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.target is not None and first_request_seconds > args.target:
+        print(f"Time to first request {first_request_seconds:.2f}s is over the {args.target:.2f}s target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,37 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 import logging
+from typing import Optional
 from sqlalchemy import inspect
 
 logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# Number of the last file in migrations/; every migration records its number
+# in schema_version, and the models match the schema as of this one
+SCHEMA_VERSION = 7
+
+# Async drivers used for the same database by the API routes
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_database_url(url: str) -> str:
+    """Swap the driver of a database URL for its asyncio counterpart"""
+    parsed = make_url(url)
+    backend = parsed.drivername.split("+")[0]
+    return parsed.set(drivername=ASYNC_DRIVERS.get(backend, parsed.drivername)).render_as_string(
+        hide_password=False
+    )
+
 # Create database engine with connection pooling
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
@@ -19,6 +42,20 @@ engine = create_engine(
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory for the API routes, so queries do not
+# block the event loop
+async_engine = create_async_engine(
+    get_async_database_url(SQLALCHEMY_DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=300
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Create base class for declarative models
 Base = declarative_base()
 
@@ -30,19 +67,60 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def schema_version() -> Optional[int]:
+    """Latest migration recorded in schema_version, None without the table"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT max(version) FROM schema_version")).scalar()
+    except DBAPIError:
+        return None
+
 def init_db():
-    """Initialize database tables"""
+    """Initialize database tables, unless the schema is already current.
+
+    A database at ``SCHEMA_VERSION`` costs a single query, so worker starts
+    and reloads skip DDL and introspection. Otherwise missing tables are
+    created and the version is recorded, except on an existing PostgreSQL
+    database: that is upgraded by applying migrations/, the last of which
+    records it.
+    """
     try:
+        version = schema_version()
+        if version is not None and version >= SCHEMA_VERSION:
+            logger.info("Database schema is at version %s, skipping table creation", version)
+            return
+
+        # Registers every table on Base.metadata
+        from models.database_models import SchemaVersion
+
         logger.info("Starting database initialization...")
+        table_names = set(inspect(engine).get_table_names())
         logger.info("Creating database tables...")
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully")
 
-        # Log table names for verification
-        inspector = inspect(engine)
-        table_names = inspector.get_table_names()
-        logger.info(f"Available tables: {table_names}")
+        # migrations/ is for PostgreSQL; other databases are only ever built
+        # from the models, as is a new PostgreSQL database
+        if engine.dialect.name != "postgresql" or not table_names & set(Base.metadata.tables):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(SchemaVersion.__table__.insert().values(version=SCHEMA_VERSION))
+                logger.info("Recorded schema version %s", SCHEMA_VERSION)
+            except IntegrityError:
+                # Another worker starting at the same time recorded it
+                pass
+        else:
+            logger.warning(
+                "Database schema is at version %s, not %s: "
+                "apply the pending files in migrations/ so startup can skip table creation",
+                version or "unknown", SCHEMA_VERSION
+            )
 
     except Exception as e:
-        logger.error(f"Error creating database tables: {e}", exc_info=True)
+        logger.error("Error creating database tables: %s", e, exc_info=True)
         raise
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Export the study tables to the Parquet snapshot searched by the duckdb backend.
+
+Writes ``clinical_study.parquet``, ``data_products.parquet`` and a
+``snapshot.json`` manifest to ``--directory`` (default ``SEARCH_SNAPSHOT_DIR``,
+or ``snapshot/`` in the project). Run it after loading data, then restart
+the application with ``SEARCH_BACKEND=duckdb``.
+
+Usage:
+    python export_parquet.py [--directory snapshot]
+"""
+import argparse
+import logging
+import sys
+import time
+from typing import List, Optional
+
+from database import engine
+from services.columnar import SNAPSHOT_DIR, export_snapshot
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export studies and data products to Parquet")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR, help="snapshot directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    started = time.monotonic()
+    counts = export_snapshot(engine, args.directory)
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows", file=sys.stderr)
+    print(f"Snapshot written to {args.directory} in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
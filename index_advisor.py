@@ -0,0 +1,254 @@
+"""Index advisor for the /api/search filters.
+
+Replays the filter combinations users actually searched with, taken from
+``search_history.filters``, through the same query the search backend
+builds, and reads the plan with ``EXPLAIN``. Each combination is reported
+with the indexes its plan uses. Where the plan falls back to a full scan
+of ``clinical_study``, the advisor proposes an index, with equality
+columns ordered most selective first and at most one trailing range
+column. With ``--verify``, it creates each proposal inside a transaction,
+explains the query again and rolls back, showing whether the planner
+would use the index.
+
+Usage:
+    python index_advisor.py [--top 20] [--verify] [--analyze]
+"""
+import argparse
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection
+
+from database import engine
+from models.database_models import ClinicalStudy, SearchHistory
+from services.query_parser import QueryError, parse_query
+from services.search_backend import PostgresSearchBackend, apply_filters
+
+TABLE = ClinicalStudy.__tablename__
+
+# Search filter parameter -> (column, how it is compared)
+FILTER_COLUMNS = {
+    "status": ("status", "equality"),
+    "phase": ("phase", "equality"),
+    "indication_category": ("indication_category", "equality"),
+    "procedure_category": ("procedure_category", "equality"),
+    "severity": ("severity", "equality"),
+    "risk_level": ("risk_level", "equality"),
+    "start_date": ("start_date", "range"),
+    "end_date": ("end_date", "range"),
+    "min_duration": ("duration", "range"),
+    "max_duration": ("duration", "range"),
+}
+
+
+class Pattern:
+    """A combination of filter parameters and how often it was searched"""
+
+    def __init__(self, keys: Tuple[str, ...]):
+        self.keys = keys
+        self.searches = 0
+        # A logged example, so the plan reflects real values
+        self.query: Optional[str] = None
+        self.filters: Dict[str, Any] = {}
+
+
+def parse_filters(raw: Any) -> Dict[str, Any]:
+    """Known filters from a logged search, converted to query values"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return {}
+    if not isinstance(raw, dict):
+        return {}
+    filters = {}
+    for key, value in raw.items():
+        if key not in FILTER_COLUMNS or value in (None, ""):
+            continue
+        try:
+            if key in ("start_date", "end_date"):
+                filters[key] = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+            elif key in ("min_duration", "max_duration"):
+                filters[key] = int(value)
+            else:
+                filters[key] = str(value)
+        except ValueError:
+            continue
+    return filters
+
+
+def load_patterns(connection: Connection, top: int) -> Tuple[List[Pattern], int]:
+    """Group logged searches by the set of filters they used"""
+    patterns: Dict[Tuple[str, ...], Pattern] = {}
+    total = 0
+    rows = connection.execute(
+        select(SearchHistory.query, SearchHistory.filters, SearchHistory.use_count).execution_options(
+            stream_results=True
+        )
+    )
+    for query, raw_filters, use_count in rows:
+        filters = parse_filters(raw_filters)
+        keys = tuple(sorted(filters))
+        pattern = patterns.get(keys)
+        if pattern is None:
+            pattern = patterns[keys] = Pattern(keys)
+            pattern.query = query
+            pattern.filters = filters
+        weight = max(use_count or 0, 1)
+        pattern.searches += weight
+        total += weight
+    ranked = sorted(patterns.values(), key=lambda pattern: -pattern.searches)
+    return ranked[:top], total
+
+
+def search_statement(connection: Connection, pattern: Pattern):
+    """The statement the search backend runs for a logged search"""
+    if connection.dialect.name == "postgresql":
+        try:
+            query = parse_query(pattern.query or "")
+        except QueryError:
+            # Such searches are rejected now; their filters still get planned
+            query = None
+        return PostgresSearchBackend().match_query(query, pattern.filters)
+    # Other databases only filter here; text matching happens in process
+    return apply_filters(select(ClinicalStudy.id), pattern.filters)
+
+
+def explain(connection: Connection, statement, analyze: bool = False) -> Dict[str, Any]:
+    """Plan a statement; returns the indexes used, whether it scans the table, and its cost"""
+    compiled = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "postgresql":
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        plan = connection.exec_driver_sql(f"EXPLAIN ({options}) {compiled}").scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        indexes, full_scan = [], False
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", ()))
+            if node.get("Index Name"):
+                indexes.append(node["Index Name"])
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name") == TABLE:
+                full_scan = True
+        result = {"indexes": indexes, "full_scan": full_scan, "cost": root["Total Cost"]}
+        if analyze:
+            result["time_ms"] = plan[0].get("Execution Time")
+        return result
+
+    details = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
+    indexes = [
+        detail.split(" INDEX ", 1)[1].split(" ")[0]
+        for detail in details if " INDEX " in detail
+    ]
+    full_scan = any(detail.startswith(f"SCAN {TABLE}") for detail in details)
+    return {"indexes": indexes, "full_scan": full_scan, "cost": None}
+
+
+def column_stats(connection: Connection, columns: List[str]) -> Dict[str, Tuple[float, float]]:
+    """(distinct values, fraction of NULL rows) per column"""
+    stats = {}
+    if connection.dialect.name == "postgresql":
+        rows = connection.execute(
+            text(
+                "SELECT attname, n_distinct, null_frac FROM pg_stats "
+                "WHERE tablename = :table AND attname = ANY(:columns)"
+            ),
+            {"table": TABLE, "columns": columns}
+        )
+        row_count = connection.execute(text(f"SELECT reltuples FROM pg_class WHERE relname = '{TABLE}'")).scalar() or 0
+        for name, n_distinct, null_frac in rows:
+            # Negative n_distinct is a fraction of the row count
+            distinct = -n_distinct * row_count if n_distinct < 0 else n_distinct
+            stats[name] = (distinct, null_frac)
+    else:
+        row_count = connection.execute(select(func.count()).select_from(ClinicalStudy)).scalar() or 1
+        for name in columns:
+            column = ClinicalStudy.__table__.c[name]
+            distinct, nulls = connection.execute(
+                select(func.count(column.distinct()), func.sum(column.is_(None).cast(ClinicalStudy.id.type)))
+            ).one()
+            stats[name] = (distinct, (nulls or 0) / row_count)
+    return stats
+
+
+def recommend(connection: Connection, pattern: Pattern) -> Optional[Tuple[str, str]]:
+    """(name, CREATE INDEX statement) for a pattern, or None if it has no filters"""
+    equality, ranges = [], []
+    for key in pattern.keys:
+        column, kind = FILTER_COLUMNS[key]
+        target = equality if kind == "equality" else ranges
+        if column not in target:
+            target.append(column)
+    if not equality and not ranges:
+        return None
+
+    stats = column_stats(connection, equality + ranges)
+    equality.sort(key=lambda column: -stats.get(column, (0, 0))[0])
+    ranges.sort(key=lambda column: -stats.get(column, (0, 0))[0])
+    columns = equality + ranges[:1]
+
+    name = f"idx_{TABLE}_" + "_".join(columns)
+    statement = f"CREATE INDEX {name} ON {TABLE} ({', '.join(columns)})"
+    # A leading column that is mostly NULL never matches an equality or
+    # range filter in those rows, so they can be left out of the index
+    leading = columns[0]
+    if stats.get(leading, (0, 0))[1] > 0.5:
+        statement += f" WHERE {leading} IS NOT NULL"
+    return name, statement
+
+
+def describe(plan: Dict[str, Any]) -> str:
+    used = ", ".join(dict.fromkeys(plan["indexes"])) or "no index"
+    scan = " + full scan" if plan["full_scan"] else ""
+    cost = f" (cost {plan['cost']:.0f})" if plan.get("cost") is not None else ""
+    timing = f" {plan['time_ms']:.1f} ms" if plan.get("time_ms") is not None else ""
+    return f"{used}{scan}{cost}{timing}"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Recommend and verify indexes for logged search filters")
+    parser.add_argument("--top", type=int, default=20, help="number of filter combinations to check")
+    parser.add_argument("--verify", action="store_true", help="try each proposed index in a rolled-back transaction")
+    parser.add_argument("--analyze", action="store_true", help="execute the queries with EXPLAIN ANALYZE (PostgreSQL)")
+    args = parser.parse_args(argv)
+
+    with engine.connect() as connection:
+        patterns, total = load_patterns(connection, args.top)
+        if not patterns:
+            print("search_history is empty; nothing to advise on")
+            return
+        print(f"{total} logged searches, {len(patterns)} most common filter combinations:\n")
+
+        for pattern in patterns:
+            share = pattern.searches / total * 100
+            label = ", ".join(pattern.keys) or "(no filters)"
+            statement = search_statement(connection, pattern)
+            plan = explain(connection, statement, args.analyze)
+            print(f"{share:5.1f}%  {label}")
+            print(f"        plan: {describe(plan)}")
+
+            if not plan["full_scan"]:
+                continue
+            proposal = recommend(connection, pattern)
+            if proposal is None:
+                continue
+            name, create_index = proposal
+            print(f"        suggest: {create_index};")
+
+            if args.verify:
+                transaction = connection.begin_nested() if connection.in_transaction() else connection.begin()
+                try:
+                    connection.exec_driver_sql(create_index)
+                    verified = explain(connection, statement, args.analyze)
+                finally:
+                    transaction.rollback()
+                verdict = "used" if name in verified["indexes"] else "not used"
+                print(f"        verify: {verdict} -> {describe(verified)}")
+
+
+if __name__ == "__main__":
+    main()
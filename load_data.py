@@ -0,0 +1,406 @@
+"""Bulk loader for clinical studies and their data products.
+
+Streams records from CSV or JSONL files (or generates synthetic ones) and
+writes them in batches: ``COPY`` on PostgreSQL, multi-row ``executemany``
+inserts elsewhere. Memory use is bounded by the batch size, not the input.
+
+Study records in JSONL may embed their data products under a
+``data_products`` key; data products in a separate file need a ``study_id``.
+Ids missing from the input are reserved from the database a batch at a time.
+
+With ``--checkpoint``, the number of records committed so far is saved after
+every batch and skipped when the same command is run again, so an
+interrupted load resumes where it stopped.
+
+Usage:
+    python load_data.py --studies studies.jsonl --data-products products.csv
+    python load_data.py --synthetic 1000000 --checkpoint synthetic.ckpt
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, Table, text
+from sqlalchemy.engine import Connection, Engine
+
+from database import engine, init_db
+from models.database_models import ClinicalStudy, DataProduct
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+
+STUDY_TABLE = ClinicalStudy.__table__
+DATA_PRODUCT_TABLE = DataProduct.__table__
+
+# Vocabulary of the synthetic dataset
+CONDITIONS = [
+    "Cancer", "Melanoma", "Leukemia", "Diabetes", "Hypertension", "Asthma",
+    "Alzheimer's", "Parkinson's", "COVID-19", "Influenza", "Arthritis",
+    "Depression", "Obesity", "Heart Failure", "Stroke", "Hepatitis",
+]
+INTERVENTIONS = [
+    "Immunotherapy", "Targeted Therapy", "Chemotherapy", "Radiation",
+    "Vaccine", "Gene Therapy", "Behavioral Intervention", "Monoclonal Antibody",
+    "Stem Cell Transplant", "Dietary Supplement", "Surgery", "Device",
+]
+DESIGNS = [
+    "Randomized controlled trial of", "Open-label study of",
+    "Longitudinal observational study of", "Dose-escalation trial of",
+    "Double-blind placebo-controlled trial of",
+]
+STATUSES = ["Recruiting", "Active", "Completed", "Not yet recruiting"]
+PHASES = ["Phase I", "Phase II", "Phase III", "Phase IV"]
+INDICATION_CATEGORIES = ["Cardiovascular", "Neurological", "Psychiatric", "Autoimmune", "Endocrine"]
+SEVERITIES = ["Mild", "Moderate", "Severe"]
+PROCEDURE_CATEGORIES = ["Surgical", "Diagnostic", "Therapeutic"]
+RISK_LEVELS = ["Low", "Medium", "High"]
+DATA_PRODUCT_TYPES = ["raw", "processed"]
+DATA_PRODUCT_FORMATS = ["CSV", "Parquet", "JSON"]
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream dicts from a .csv file, or from JSON lines (``-`` is stdin)"""
+    if path == "-":
+        handle = sys.stdin
+    else:
+        handle = open(path, newline="" if path.endswith(".csv") else None, encoding="utf-8")
+    try:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def synthetic_studies(count: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """Generate study records with embedded data products.
+
+    Record ``i`` depends only on ``seed`` and ``i``, so a resumed load
+    produces the same records it would have without the interruption.
+    """
+    epoch = datetime(2020, 1, 1)
+    rng = random.Random()
+    for i in range(count):
+        rng.seed(seed * 1000003 + i)
+        condition = rng.choice(CONDITIONS)
+        intervention = rng.choice(INTERVENTIONS)
+        start_date = epoch + timedelta(days=rng.randint(0, 6 * 365))
+        # Indication and procedure details are filled in for some studies only
+        has_indication = rng.random() < 0.5
+        has_procedure = rng.random() < 0.3
+        yield {
+            "title": f"{condition} Study {i + 1}: {intervention}",
+            "description": f"{rng.choice(DESIGNS)} {intervention.lower()} in {condition} patients",
+            "status": rng.choice(STATUSES),
+            "phase": rng.choice(PHASES),
+            "start_date": start_date,
+            "end_date": start_date + timedelta(days=rng.randint(180, 730)),
+            "relevance_score": round(rng.uniform(1.0, 3.5), 2),
+            "indication_category": rng.choice(INDICATION_CATEGORIES) if has_indication else None,
+            "severity": rng.choice(SEVERITIES) if has_indication else None,
+            "procedure_category": rng.choice(PROCEDURE_CATEGORIES) if has_procedure else None,
+            "risk_level": rng.choice(RISK_LEVELS) if has_procedure else None,
+            "duration": rng.randint(15, 480) if has_procedure else None,
+            "data_products": [
+                {
+                    "title": f"Study {i + 1} Data{'' if n == 0 else f' ({n + 1})'}",
+                    "description": f"Clinical data from {condition} study #{i + 1}",
+                    "type": rng.choice(DATA_PRODUCT_TYPES),
+                    "format": rng.choice(DATA_PRODUCT_FORMATS),
+                    "created_at": start_date,
+                }
+                for n in range(rng.randint(1, 3))
+            ],
+        }
+
+
+def converter(column):
+    """Function turning an input value (often a CSV string) into the column's type"""
+    if isinstance(column.type, DateTime):
+        return lambda value: value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if isinstance(column.type, Boolean):
+        return lambda value: value if isinstance(value, bool) else str(value).lower() in ("1", "true", "t", "yes")
+    if isinstance(column.type, Integer):
+        return int
+    if isinstance(column.type, Float):
+        return float
+    return None
+
+
+class RowBuilder:
+    """Turns input records into complete, typed rows of one table.
+
+    Keeps only the table's columns and applies Python-side column defaults,
+    which Core inserts and COPY would otherwise leave NULL.
+    """
+
+    def __init__(self, table: Table):
+        self.table = table
+        self.columns = []
+        for column in table.columns:
+            default = None
+            if column.default is not None and not column.primary_key:
+                default = column.default
+            self.columns.append((column.name, converter(column), default))
+
+    def __call__(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        row = {}
+        for name, convert, default in self.columns:
+            value = record.get(name)
+            if value is None or value == "":
+                value = None
+                if default is not None:
+                    value = default.arg(None) if default.is_callable else default.arg
+            elif convert is not None:
+                value = convert(value)
+            row[name] = value
+        return row
+
+
+class IdAllocator:
+    """Hands out primary keys for rows that arrive without one"""
+
+    def __init__(self, table: Table):
+        self.table = table
+        self._next_id: Optional[int] = None
+
+    def take(self, connection: Connection, count: int) -> List[int]:
+        if count == 0:
+            return []
+        if connection.dialect.name == "postgresql":
+            # Reserve the whole batch from the serial sequence in one round trip
+            result = connection.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                {"table": self.table.name, "count": count}
+            )
+            return [row[0] for row in result]
+        if self._next_id is None:
+            current = connection.execute(text(f"SELECT max(id) FROM {self.table.name}")).scalar()
+            self._next_id = (current or 0) + 1
+        ids = list(range(self._next_id, self._next_id + count))
+        self._next_id += count
+        return ids
+
+    def assign(self, connection: Connection, rows: List[Dict[str, Any]]) -> None:
+        missing = [row for row in rows if row["id"] is None]
+        for row, new_id in zip(missing, self.take(connection, len(missing))):
+            row["id"] = new_id
+
+
+def copy_rows(connection: Connection, table: Table, rows: List[Dict[str, Any]]) -> None:
+    """Write rows with PostgreSQL COPY, or executemany where COPY is unavailable"""
+    if not rows:
+        return
+    raw_cursor = connection.connection.cursor()
+    if connection.dialect.name != "postgresql" or not hasattr(raw_cursor, "copy_expert"):
+        raw_cursor.close()
+        connection.execute(table.insert(), rows)
+        return
+
+    columns = [column.name for column in table.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in (row[name] for name in columns)
+        ])
+    buffer.seek(0)
+    quote = connection.dialect.identifier_preparer.quote
+    try:
+        raw_cursor.copy_expert(
+            f"COPY {quote(table.name)} ({', '.join(quote(name) for name in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        raw_cursor.close()
+
+
+class Progress:
+    """Periodic rows-per-second report on stderr"""
+
+    def __init__(self, label: str, done: int = 0, interval: float = 2.0):
+        self.label = label
+        self.done = done
+        self.loaded = 0
+        self.interval = interval
+        self.started = self._reported = time.monotonic()
+
+    def advance(self, count: int) -> None:
+        self.done += count
+        self.loaded += count
+        now = time.monotonic()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        print(
+            f"{self.label}: {self.done} records ({self.loaded / elapsed:.0f}/s)",
+            file=sys.stderr
+        )
+
+
+class Checkpoint:
+    """Record counts committed per input, persisted after every batch"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.counts: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                self.counts = json.load(handle)
+
+    def get(self, name: str) -> int:
+        return self.counts.get(name, 0)
+
+    def save(self, name: str, count: int) -> None:
+        self.counts[name] = count
+        if self.path:
+            # Replace atomically so a crash never leaves a torn checkpoint
+            partial = f"{self.path}.tmp"
+            with open(partial, "w") as handle:
+                json.dump(self.counts, handle)
+            os.replace(partial, self.path)
+
+
+def batches(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_studies(
+    bind: Engine,
+    records: Iterable[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    checkpoint: Optional[Checkpoint] = None,
+    name: str = "studies"
+) -> int:
+    """Load study records, and any data products embedded in them.
+
+    Each batch is committed in its own transaction. Returns the number of
+    study records consumed, including any skipped from the checkpoint.
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    skip = checkpoint.get(name)
+    build_study = RowBuilder(STUDY_TABLE)
+    build_product = RowBuilder(DATA_PRODUCT_TABLE)
+    study_ids = IdAllocator(STUDY_TABLE)
+    product_ids = IdAllocator(DATA_PRODUCT_TABLE)
+    progress = Progress(name, skip)
+
+    for batch in batches(islice(records, skip, None), batch_size):
+        with bind.begin() as connection:
+            studies = [build_study(record) for record in batch]
+            study_ids.assign(connection, studies)
+            products = [
+                build_product(dict(product, study_id=study["id"]))
+                for record, study in zip(batch, studies)
+                for product in record.get("data_products") or ()
+            ]
+            product_ids.assign(connection, products)
+            copy_rows(connection, STUDY_TABLE, studies)
+            copy_rows(connection, DATA_PRODUCT_TABLE, products)
+        progress.advance(len(batch))
+        checkpoint.save(name, progress.done)
+
+    progress.report()
+    return progress.done
+
+
+def load_data_products(
+    bind: Engine,
+    records: Iterable[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    checkpoint: Optional[Checkpoint] = None,
+    name: str = "data_products"
+) -> int:
+    """Load standalone data product records, which must carry ``study_id``"""
+    checkpoint = checkpoint or Checkpoint(None)
+    skip = checkpoint.get(name)
+    build_product = RowBuilder(DATA_PRODUCT_TABLE)
+    product_ids = IdAllocator(DATA_PRODUCT_TABLE)
+    progress = Progress(name, skip)
+
+    for batch in batches(islice(records, skip, None), batch_size):
+        with bind.begin() as connection:
+            products = [build_product(record) for record in batch]
+            product_ids.assign(connection, products)
+            copy_rows(connection, DATA_PRODUCT_TABLE, products)
+        progress.advance(len(batch))
+        checkpoint.save(name, progress.done)
+
+    progress.report()
+    return progress.done
+
+
+def finish_load(bind: Engine) -> None:
+    """Bring sequences and planner statistics up to date after a load"""
+    with bind.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            for table in (STUDY_TABLE, DATA_PRODUCT_TABLE):
+                # Explicit ids from the input bypass the sequence
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"greatest((SELECT max(id) FROM {table.name}), 1))"
+                ))
+            connection.execute(text(f"ANALYZE {STUDY_TABLE.name}, {DATA_PRODUCT_TABLE.name}"))
+
+    # Core inserts skip the ORM commit hook; a shared Redis tier still needs
+    # to drop responses cached before the load
+    from services.cache import search_cache
+    search_cache.invalidate()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk load clinical studies and data products")
+    parser.add_argument("--studies", help="CSV or JSONL file of studies ('-' reads JSONL from stdin)")
+    parser.add_argument("--data-products", help="CSV or JSONL file of data products with study_id")
+    parser.add_argument("--synthetic", type=int, metavar="COUNT", help="generate COUNT synthetic studies")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic dataset")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--checkpoint", help="file recording progress, to resume an interrupted load")
+    args = parser.parse_args(argv)
+
+    if not (args.studies or args.data_products or args.synthetic):
+        parser.error("one of --studies, --data-products or --synthetic is required")
+
+    logging.basicConfig(level=logging.WARNING)
+    init_db()
+    checkpoint = Checkpoint(args.checkpoint)
+    started = time.monotonic()
+
+    if args.synthetic:
+        records = synthetic_studies(args.synthetic, args.seed)
+        load_studies(engine, records, args.batch_size, checkpoint, "synthetic")
+    if args.studies:
+        load_studies(engine, read_records(args.studies), args.batch_size, checkpoint)
+    if args.data_products:
+        load_data_products(engine, read_records(args.data_products), args.batch_size, checkpoint)
+
+    finish_load(engine)
+    print(f"Load finished in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Logging setup for the application entry points.
+
+Modules only create loggers; ``configure_logging`` is called once by the
+entry point. Records are level-gated and, below WARNING, optionally sampled
+before anything is formatted. Records that pass are put on an in-memory
+queue, and a background thread formats and writes them, so request handlers
+never wait on the log stream.
+
+Environment variables:
+    LOG_LEVEL        root level, default INFO
+    LOG_FORMAT       ``text`` (default) or ``json`` (one object per line)
+    LOG_SAMPLE_RATE  fraction of DEBUG/INFO records kept, default 1.0
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Libraries whose DEBUG output would drown the application's own
+QUIET_LOGGERS = ("aiosqlite", "asyncio", "multipart", "passlib")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING; always keep the rest"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves the Formatter step to the listener thread.
+
+    The stock handler runs the full Formatter on the calling thread before
+    enqueueing a record. Here only ``record.getMessage()`` runs there: it
+    interpolates the ``%`` arguments into the message, so later changes to
+    mutable arguments cannot alter what is logged. Timestamps, level names,
+    tracebacks and JSON encoding are formatted by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    sample_rate: Optional[float] = None
+) -> None:
+    """Route all logging through a background writer; safe to call again"""
+    global _listener
+
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    log_format = log_format or os.environ.get("LOG_FORMAT", "text")
+    if sample_rate is None:
+        sample_rate = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = BackgroundQueueHandler(records)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    if _listener is not None:
+        _listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.getLevelName(level), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(records, stream_handler)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    # Flush what is still queued before the interpreter exits
+    if _listener is not None:
+        _listener.stop()
+
+
+atexit.register(_stop_listener)
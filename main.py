@@ -1,21 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from typing import Dict
 import uvicorn
 import logging
 import os
+import time
 from starlette.middleware.sessions import SessionMiddleware
 
-from database import get_db, init_db
-from models.database_models import User, ClinicalStudy, DataProduct, Collection, CollectionItem
-from models.schemas import SearchQuery, SearchResponse, CollectionSchema
+from database import async_engine, engine, init_db
+from logging_config import configure_logging
 from routes import auth, search, collections, saved_searches, history
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from services import index_snapshots
+from services.change_feed import change_feed
+from services.metrics import MetricsMiddleware, instrument_engine, registry
+from services.search_backend import warm_up_search_backend
+from services.suggest_index import warm_up_suggestions
+
+# Logging is configured here, by the entry point, and nowhere else
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -56,8 +62,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Time every request and report it in Server-Timing and /api/metrics
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -107,7 +119,7 @@ async def home(request: Request):
     try:
         return templates.TemplateResponse("index.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering home page: {str(e)}", exc_info=True)
+        logger.error("Error rendering home page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -119,7 +131,7 @@ async def login_page(request: Request):
     try:
         return templates.TemplateResponse("auth/login.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering login page: {str(e)}", exc_info=True)
+        logger.error("Error rendering login page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -131,7 +143,7 @@ async def register_page(request: Request):
     try:
         return templates.TemplateResponse("auth/register.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering register page: {str(e)}", exc_info=True)
+        logger.error("Error rendering register page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -143,7 +155,7 @@ async def collections_page(request: Request):
     try:
         return templates.TemplateResponse("collections.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering collections page: {str(e)}", exc_info=True)
+        logger.error("Error rendering collections page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -155,7 +167,7 @@ async def saved_searches_page(request: Request):
     try:
         return templates.TemplateResponse("saved_searches.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering saved searches page: {str(e)}", exc_info=True)
+        logger.error("Error rendering saved searches page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -167,7 +179,7 @@ async def search_history_page(request: Request):
     try:
         return templates.TemplateResponse("search_history.html", {"request": request})
     except Exception as e:
-        logger.error(f"Error rendering search history page: {str(e)}", exc_info=True)
+        logger.error("Error rendering search history page: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
@@ -175,18 +187,52 @@ async def search_history_page(request: Request):
 
 @app.get("/api/health")
 async def health_check():
-    """API health check endpoint"""
-    return {"status": "healthy", "message": "BioMed Search API is running"}
+    """API health check endpoint, with how far the search indexes have caught up"""
+    return {
+        "status": "healthy",
+        "message": "BioMed Search API is running",
+        "change_feed": change_feed.status(),
+        "index_snapshots": index_snapshots.status(),
+        "startup_seconds": startup_profile,
+    }
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request metrics in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# Seconds each startup step took in this worker, see benchmarks/startup.py
+startup_profile: Dict[str, float] = {}
+
+@contextmanager
+def startup_step(name: str):
+    started = time.perf_counter()
+    yield
+    startup_profile[name] = round(time.perf_counter() - started, 3)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the database on startup"""
     try:
-        init_db()
+        with startup_step("schema"):
+            init_db()
         logger.info("Database initialized successfully")
+        # Changes made while the indexes build are applied once they are ready
+        with startup_step("search_indexes"):
+            await change_feed.mark()
+            await warm_up_search_backend()
+        with startup_step("suggestions"):
+            await warm_up_suggestions()
+        with startup_step("change_feed"):
+            await change_feed.start()
     except Exception as e:
-        logger.error(f"Error initializing database: {e}")
+        logger.error("Error initializing database: %s", e)
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop applying search index changes"""
+    await change_feed.stop()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
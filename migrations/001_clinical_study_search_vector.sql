@@ -0,0 +1,12 @@
+-- Full-text search over clinical studies.
+-- Replaces the leading-wildcard ILIKE scans in /api/search with a GIN-indexed
+-- tsvector. Title terms carry weight A and description terms weight B.
+
+ALTER TABLE clinical_study
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clinical_study_search_vector
+    ON clinical_study USING GIN (search_vector);
@@ -0,0 +1,6 @@
+-- Keyset pagination of /api/search-history.
+-- Lets "WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC,
+-- id DESC LIMIT n" seek straight to the requested page with a backward index scan.
+
+CREATE INDEX IF NOT EXISTS idx_search_history_user_created
+    ON search_history(user_id, created_at, id);
@@ -0,0 +1,32 @@
+-- Indexes for the /api/search filters.
+-- Databases created from the ORM models before this migration lack the
+-- indication, procedure and duration columns, so add them first.
+
+ALTER TABLE clinical_study ADD COLUMN IF NOT EXISTS indication_category VARCHAR(100);
+ALTER TABLE clinical_study ADD COLUMN IF NOT EXISTS procedure_category VARCHAR(100);
+ALTER TABLE clinical_study ADD COLUMN IF NOT EXISTS severity VARCHAR(50);
+ALTER TABLE clinical_study ADD COLUMN IF NOT EXISTS risk_level VARCHAR(50);
+ALTER TABLE clinical_study ADD COLUMN IF NOT EXISTS duration INTEGER;
+
+-- status is nearly always filtered together with phase; the composite index
+-- also serves status on its own, so it replaces idx_clinical_study_status
+CREATE INDEX IF NOT EXISTS idx_clinical_study_status_phase ON clinical_study(status, phase);
+DROP INDEX IF EXISTS idx_clinical_study_status;
+
+-- Date range filters
+CREATE INDEX IF NOT EXISTS idx_clinical_study_start_date ON clinical_study(start_date);
+CREATE INDEX IF NOT EXISTS idx_clinical_study_end_date ON clinical_study(end_date);
+
+-- Sparse columns: rows without a value can never match, so leave them out
+CREATE INDEX IF NOT EXISTS idx_clinical_study_indication_category
+    ON clinical_study(indication_category) WHERE indication_category IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_clinical_study_procedure_category
+    ON clinical_study(procedure_category) WHERE procedure_category IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_clinical_study_severity
+    ON clinical_study(severity) WHERE severity IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_clinical_study_risk_level
+    ON clinical_study(risk_level) WHERE risk_level IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_clinical_study_duration
+    ON clinical_study(duration) WHERE duration IS NOT NULL;
+
+ANALYZE clinical_study;
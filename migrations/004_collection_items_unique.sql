@@ -0,0 +1,16 @@
+-- Each data product appears at most once per collection, which lets bulk
+-- adds insert with ON CONFLICT DO NOTHING instead of checking every id.
+
+-- Drop duplicates the old check-then-insert code could leave behind,
+-- keeping the earliest row of each pair
+DELETE FROM collection_items duplicate
+    USING collection_items original
+    WHERE duplicate.collection_id = original.collection_id
+      AND duplicate.data_product_id = original.data_product_id
+      AND duplicate.id > original.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_collection_items_collection_product
+    ON collection_items(collection_id, data_product_id);
+
+-- Lookups by collection are served by the leading column of the new index
+DROP INDEX IF EXISTS idx_collection_items_collection_id;
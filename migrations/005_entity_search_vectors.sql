@@ -0,0 +1,21 @@
+-- Full-text search over indications and procedures.
+-- /api/search fans out to these tables next to clinical_study; they get the
+-- same weighted tsvector and GIN index (title A, description B).
+
+ALTER TABLE indication
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_indication_search_vector
+    ON indication USING GIN (search_vector);
+
+ALTER TABLE procedure
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_procedure_search_vector
+    ON procedure USING GIN (search_vector);
@@ -0,0 +1,81 @@
+-- Change log of the searchable tables, for incremental search index updates.
+-- Statement-level triggers record the ids every write touches, bulk COPY
+-- loads included, and notify listeners on the search_changes channel; see
+-- services/change_feed.py. A data product write logs its study (old and new
+-- on a move), whose search result embeds the product. Needs PostgreSQL 14+
+-- for CREATE OR REPLACE TRIGGER.
+
+CREATE TABLE IF NOT EXISTS search_changes (
+    id BIGSERIAL PRIMARY KEY,
+    -- study, indication or procedure; data product writes log their study
+    entity VARCHAR(20) NOT NULL,
+    row_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_search_changes_changed_at ON search_changes (changed_at);
+
+CREATE OR REPLACE FUNCTION log_search_changes() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV: the logged entity, then the column holding its id
+    EXECUTE format(
+        'INSERT INTO search_changes (entity, row_id) '
+        'SELECT DISTINCT %L, %I FROM changed_rows WHERE %I IS NOT NULL',
+        TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]
+    );
+    PERFORM pg_notify('search_changes', TG_ARGV[0]);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_insert
+    AFTER INSERT ON clinical_study REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_update
+    AFTER UPDATE ON clinical_study REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_delete
+    AFTER DELETE ON clinical_study REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_insert
+    AFTER INSERT ON data_products REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_update
+    AFTER UPDATE ON data_products REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_delete
+    AFTER DELETE ON data_products REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_update_old
+    AFTER UPDATE ON data_products REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_insert
+    AFTER INSERT ON indication REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_update
+    AFTER UPDATE ON indication REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_delete
+    AFTER DELETE ON indication REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_insert
+    AFTER INSERT ON procedure REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_update
+    AFTER UPDATE ON procedure REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_delete
+    AFTER DELETE ON procedure REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
@@ -0,0 +1,11 @@
+-- Migrations applied to this database. Application startup reads the latest
+-- version and skips creating tables once it is current (see database.py
+-- SCHEMA_VERSION), so every later migration ends by inserting its number.
+-- Apply 001-006 first.
+
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT now()
+);
+
+INSERT INTO schema_version (version) VALUES (7) ON CONFLICT (version) DO NOTHING;
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, ForeignKey, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, JSON, Float, ForeignKey, Boolean, DDL, Index, event, func, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -30,6 +30,11 @@ class SearchHistory(Base):
     use_count = Column(Integer, default=0)
     user = relationship("User", back_populates="search_history")
 
+    __table_args__ = (
+        # Serves keyset pagination of a user's history, newest first
+        Index("idx_search_history_user_created", "user_id", "created_at", "id"),
+    )
+
 class ClinicalStudy(Base):
     __tablename__ = "clinical_study"
 
@@ -41,7 +46,30 @@ class ClinicalStudy(Base):
     start_date = Column(DateTime)
     end_date = Column(DateTime)
     relevance_score = Column(Float, default=1.0)
-    data_product = relationship("DataProduct", back_populates="study", uselist=False)
+    indication_category = Column(String(100))
+    procedure_category = Column(String(100))
+    severity = Column(String(50))
+    risk_level = Column(String(50))
+    duration = Column(Integer)  # in minutes
+    data_products = relationship("DataProduct", back_populates="study")
+
+    __table_args__ = (
+        # Serve the /api/search filters (see migrations/003_clinical_study_filter_indexes.sql).
+        # status is nearly always set and usually combined with phase; the
+        # other filter columns are sparse, so their indexes skip NULL rows
+        Index("idx_clinical_study_status_phase", "status", "phase"),
+        Index("idx_clinical_study_start_date", "start_date"),
+        Index("idx_clinical_study_end_date", "end_date"),
+        *(
+            Index(
+                f"idx_clinical_study_{column}",
+                column,
+                postgresql_where=text(f"{column} IS NOT NULL"),
+                sqlite_where=text(f"{column} IS NOT NULL")
+            )
+            for column in ("indication_category", "procedure_category", "severity", "risk_level", "duration")
+        ),
+    )
 
 class Indication(Base):
     __tablename__ = "indication"
@@ -64,6 +92,23 @@ class Procedure(Base):
     duration = Column(Integer)  # in minutes
     relevance_score = Column(Float, default=1.0)
 
+# The full-text search vectors are generated by Postgres and deliberately left
+# unmapped; services/search_backend.py and services/multi_index.py query them
+# directly (see schema.sql)
+def _search_vector_ddl(table_name: str) -> DDL:
+    return DDL(
+        f"ALTER TABLE {table_name} ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        ") STORED; "
+        f"CREATE INDEX idx_{table_name}_search_vector "
+        f"ON {table_name} USING GIN (search_vector)"
+    ).execute_if(dialect="postgresql")
+
+for _table in (ClinicalStudy.__table__, Indication.__table__, Procedure.__table__):
+    event.listen(_table, "after_create", _search_vector_ddl(_table.name))
+
 class DataProduct(Base):
     __tablename__ = "data_products"
 
@@ -75,8 +120,8 @@ class DataProduct(Base):
     format = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    # Relationship with study (one-to-one)
-    study = relationship("ClinicalStudy", back_populates="data_product")
+    # Relationship with study (many data products per study)
+    study = relationship("ClinicalStudy", back_populates="data_products")
     # Relationship with collections through collection_items
     collections = relationship("CollectionItem", back_populates="data_product")
 
@@ -104,4 +149,78 @@ class CollectionItem(Base):
 
     # Relationships
     collection = relationship("Collection", back_populates="items")
-    data_product = relationship("DataProduct", back_populates="collections")
\ No newline at end of file
+    data_product = relationship("DataProduct", back_populates="collections")
+
+    __table_args__ = (
+        # A data product is in a collection at most once; bulk adds rely on
+        # it to skip duplicates, and it serves lookups by collection
+        Index("idx_collection_items_collection_product", "collection_id", "data_product_id", unique=True),
+    )
+
+class SearchChange(Base):
+    """Log of writes to the searchable tables, filled by Postgres triggers.
+
+    Each row names a result type and id whose search entry must be
+    reloaded; services/change_feed.py reads it past a watermark.
+    """
+    __tablename__ = "search_changes"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    # study, indication or procedure; data product writes log their study
+    entity = Column(String(20), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        # Serves pruning of old entries
+        Index("idx_search_changes_changed_at", "changed_at"),
+    )
+
+class SchemaVersion(Base):
+    """Migrations applied to the database, see database.init_db"""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, server_default=func.now())
+
+# (table, logged entity, column holding the logged id); see schema.sql
+SEARCH_CHANGE_SOURCES = (
+    ("clinical_study", "study", "id"),
+    ("data_products", "study", "study_id"),
+    ("indication", "indication", "id"),
+    ("procedure", "procedure", "id"),
+)
+
+def _search_change_triggers_ddl() -> DDL:
+    """Statement-level triggers logging every write, COPY included, to search_changes"""
+    statements = [
+        "CREATE OR REPLACE FUNCTION log_search_changes() RETURNS trigger AS $$ "
+        "BEGIN "
+        "EXECUTE format("
+        "'INSERT INTO search_changes (entity, row_id) "
+        "SELECT DISTINCT %L, %I FROM changed_rows WHERE %I IS NOT NULL', "
+        "TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]); "
+        "PERFORM pg_notify('search_changes', TG_ARGV[0]); "
+        "RETURN NULL; "
+        "END $$ LANGUAGE plpgsql"
+    ]
+    for table_name, entity, column in SEARCH_CHANGE_SOURCES:
+        events = [("insert", "INSERT", "NEW"), ("update", "UPDATE", "NEW"), ("delete", "DELETE", "OLD")]
+        if column != "id":
+            # A row moved to another parent changes the old one too
+            events.append(("update_old", "UPDATE", "OLD"))
+        for name, operation, transition in events:
+            statements.append(
+                f"CREATE OR REPLACE TRIGGER {table_name}_search_changes_{name} "
+                f"AFTER {operation} ON {table_name} "
+                f"REFERENCING {transition} TABLE AS changed_rows FOR EACH STATEMENT "
+                f"EXECUTE FUNCTION log_search_changes('{entity}', '{column}')"
+            )
+    # DDL formats its text with %, so format()'s placeholders are doubled
+    return DDL("; ".join(statements).replace("%", "%%"))
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_change_triggers(target, connection, tables=(), **kw):
+    # Once, when create_all makes the log; migrations/006 covers existing databases
+    if connection.dialect.name == "postgresql" and SearchChange.__table__ in tables:
+        connection.execute(_search_change_triggers_ddl())
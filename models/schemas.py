@@ -46,8 +46,11 @@ class SearchResult(BaseModel):
     category: Optional[str] = None
     status: Optional[str] = None
     phase: Optional[str] = None
+    indication_category: Optional[str] = None
+    procedure_category: Optional[str] = None
     severity: Optional[str] = None
     risk_level: Optional[str] = None
+    duration: Optional[int] = None
     relevance_score: float = 1.0
     data_products: Optional[List[Dict[str, Any]]] = None
 
@@ -57,8 +60,12 @@ class SearchResult(BaseModel):
 class SearchResponse(BaseModel):
     results: List[SearchResult]
     total: int
+    total_is_exact: bool = True
     page: int
     per_page: int
+    next_cursor: Optional[str] = None
+    # Filter field -> {value: matching studies}, when requested with facets=true
+    facets: Optional[Dict[str, Dict[str, int]]] = None
 
     class Config:
         from_attributes = True
@@ -109,8 +116,20 @@ class CollectionSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class CollectionSummary(BaseModel):
+    id: int
+    title: str
+    description: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    item_count: int = 0
+
 class CollectionItemCreate(BaseModel):
-    data_product_ids: List[int]
+    # Bounded so a request stays one statement within driver parameter limits
+    data_product_ids: List[int] = Field(max_length=10000)
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class CollectionItemMove(CollectionItemCreate):
+    target_collection_id: int
\ No newline at end of file
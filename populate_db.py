@@ -1,44 +1,40 @@
 from datetime import datetime, timedelta
-from database import init_db, get_db
-from models.database_models import ClinicalStudy, DataProduct
+from database import init_db, engine
+from load_data import finish_load, load_studies
 import random
 
-def populate_sample_data():
-    db = next(get_db())
-
+def sample_studies(count=30):
+    """Sample clinical studies, each with one embedded data product"""
     # Sample status and phases for clinical studies
     statuses = ['Recruiting', 'Active', 'Completed', 'Not yet recruiting']
     phases = ['Phase I', 'Phase II', 'Phase III', 'Phase IV']
 
-    # Generate clinical studies with data products
-    for i in range(1, 31):
+    for i in range(1, count + 1):
         start_date = datetime.now() - timedelta(days=random.randint(0, 365))
-        study = ClinicalStudy(
-            title=f"Cancer Study {i}: {random.choice(['Immunotherapy', 'Targeted Therapy', 'Chemotherapy', 'Radiation'])}",
-            description=f"Investigation of novel cancer treatment approach #{i}",
-            status=random.choice(statuses),
-            phase=random.choice(phases),
-            start_date=start_date,
-            end_date=start_date + timedelta(days=random.randint(180, 730)),
-            relevance_score=round(random.uniform(1.0, 3.5), 2)
-        )
-        db.add(study)
-        db.flush()  # Flush to get the study ID
+        yield {
+            'title': f"Cancer Study {i}: {random.choice(['Immunotherapy', 'Targeted Therapy', 'Chemotherapy', 'Radiation'])}",
+            'description': f"Investigation of novel cancer treatment approach #{i}",
+            'status': random.choice(statuses),
+            'phase': random.choice(phases),
+            'start_date': start_date,
+            'end_date': start_date + timedelta(days=random.randint(180, 730)),
+            'relevance_score': round(random.uniform(1.0, 3.5), 2),
+            'data_products': [{
+                'title': f"Study {i} Data",
+                'description': f"Clinical data from cancer study #{i}",
+                'type': random.choice(['raw', 'processed']),
+                'format': 'CSV',
+                'created_at': datetime.utcnow()
+            }]
+        }
 
-        # Create a data product for the study
-        data_product = DataProduct(
-            title=f"Study {i} Data",
-            description=f"Clinical data from cancer study #{i}",
-            study_id=study.id,
-            type=random.choice(['raw', 'processed']),
-            format='CSV',
-            created_at=datetime.utcnow()
-        )
-        db.add(data_product)
-
-    db.commit()
+def populate_sample_data():
+    # Studies and their data products are written in one batch; ids are
+    # reserved up front instead of flushing each study to learn its id
+    load_studies(engine, sample_studies())
+    finish_load(engine)
 
 if __name__ == "__main__":
     init_db()
     populate_sample_data()
-    print("Sample data has been populated successfully!")
\ No newline at end of file
+    print("Sample data has been populated successfully!")
@@ -1,72 +1,75 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import logging
 from datetime import datetime, timedelta
 
-from database import get_db
+from database import get_async_db
 from models.database_models import User
 from models.schemas import UserCreate, UserLogin, Token
 from services.auth import (
     create_access_token,
     get_password_hash,
     verify_password,
-    get_current_user
+    get_current_user,
+    token_claims
 )
+from services.metrics import InstrumentedRoute
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
-def get_user_by_email(db: Session, email: str):
+async def get_user_by_email(db: AsyncSession, email: str):
     try:
-        return db.query(User).filter(User.email == email).first()
+        return await db.scalar(select(User).filter(User.email == email))
     except Exception as e:
-        logger.error(f"Database error while fetching user by email: {e}")
+        logger.error("Database error while fetching user by email: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error occurred"
         )
 
 @router.post("/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """Login user and return JWT token"""
     try:
-        logger.info(f"Login attempt for user: {form_data.username}")
+        logger.info("Login attempt for user: %s", form_data.username)
 
-        user = get_user_by_email(db, form_data.username)  # username field contains email
+        user = await get_user_by_email(db, form_data.username)  # username field contains email
         if not user or not verify_password(form_data.password, user.hashed_password):
-            logger.warning(f"Failed login attempt for user: {form_data.username}")
+            logger.warning("Failed login attempt for user: %s", form_data.username)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        logger.info(f"Successful login for user: {form_data.username}")
-        access_token = create_access_token(data={"sub": user.email})
+        logger.info("Successful login for user: %s", form_data.username)
+        access_token = create_access_token(data=token_claims(user))
         return {"access_token": access_token, "token_type": "bearer"}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error during login: {str(e)}", exc_info=True)
+        logger.error("Error during login: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error occurred during login"
         )
 
 @router.post("/auth/register", response_model=Token)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
     try:
-        logger.info(f"Attempting to register new user with email: {user.email}")
+        logger.info("Attempting to register new user with email: %s", user.email)
 
-        db_user = get_user_by_email(db, user.email)
+        db_user = await get_user_by_email(db, user.email)
         if db_user:
-            logger.warning(f"Registration attempt with existing email: {user.email}")
+            logger.warning("Registration attempt with existing email: %s", user.email)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
@@ -82,18 +85,18 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
 
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
 
-        logger.info(f"Successfully registered user with email: {user.email}")
+        logger.info("Successfully registered user with email: %s", user.email)
 
-        access_token = create_access_token(data={"sub": user.email})
+        access_token = create_access_token(data=token_claims(db_user))
         return {"access_token": access_token, "token_type": "bearer"}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error during user registration: {str(e)}", exc_info=True)
+        logger.error("Error during user registration: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error occurred during registration"
@@ -1,53 +1,180 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from typing import List, Literal, Optional
 import logging
 from datetime import datetime
 
-from database import get_db
+from database import AsyncSessionLocal, get_async_db
 from models.database_models import Collection, CollectionItem, DataProduct
-from models.schemas import CollectionSchema, CollectionCreate, CollectionItemCreate
+from models.schemas import (
+    CollectionSchema, CollectionSummary, CollectionCreate, CollectionItemBase, CollectionItemCreate, CollectionItemMove
+)
 from services.auth import get_current_user
+from services.export import column_types, export_response
+from services.metrics import InstrumentedRoute
+from services.pagination import decode_cursor, encode_cursor
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
-@router.get("/collections", response_model=List[CollectionSchema])
+def _insert_items(dialect_name: str, rows):
+    """INSERT ... SELECT into collection_items that skips pairs already present.
+
+    ``rows`` selects (collection_id, data_product_id, added_at). Duplicates
+    are dropped by the unique index, in the same statement.
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    return insert(CollectionItem).from_select(
+        ["collection_id", "data_product_id", "added_at"], rows
+    ).on_conflict_do_nothing(index_elements=["collection_id", "data_product_id"])
+
+async def _owned_collection(db: AsyncSession, collection_id: int, user_id: int) -> Collection:
+    collection = await db.scalar(
+        select(Collection).filter(
+            Collection.id == collection_id,
+            Collection.user_id == user_id
+        )
+    )
+    if not collection:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Collection not found"
+        )
+    return collection
+
+@router.get("/collections", response_model=List[CollectionSummary])
 async def get_user_collections(
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all collections for the current user"""
+    """
+    Get all collections for the current user, with their item counts.
+
+    Items themselves are paged through ``/collections/{collection_id}/items``.
+    """
     try:
-        logger.debug(f"Fetching collections for user: {current_user.email}")
-        collections = db.query(Collection).filter(
-            Collection.user_id == current_user.id
-        ).all()
-
-        # Ensure relationships are loaded
-        for collection in collections:
-            # Force load items and their data products
-            for item in collection.items:
-                _ = item.data_product
-
-        logger.debug(f"Found {len(collections)} collections")
-        return collections
+        logger.debug("Fetching collections for user: %s", current_user.email)
+        # Counted from the collection_items index, without loading any item
+        rows = (await db.execute(
+            select(Collection, func.count(CollectionItem.id).label("item_count")).outerjoin(
+                CollectionItem, CollectionItem.collection_id == Collection.id
+            ).filter(
+                Collection.user_id == current_user.id
+            ).group_by(Collection.id).order_by(Collection.id)
+        )).all()
+
+        logger.debug("Found %s collections", len(rows))
+        return [
+            {
+                "id": collection.id,
+                "title": collection.title,
+                "description": collection.description,
+                "created_at": collection.created_at,
+                "updated_at": collection.updated_at,
+                "item_count": item_count,
+            }
+            for collection, item_count in rows
+        ]
     except Exception as e:
-        logger.error(f"Error fetching collections: {str(e)}", exc_info=True)
+        logger.error("Error fetching collections: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch collections"
         )
 
+@router.get("/collections/{collection_id}/items", response_model=List[CollectionItemBase])
+async def get_collection_items(
+    collection_id: int,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of items to return"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous response's X-Next-Cursor header"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get one page of a collection's items with their data products.
+
+    Items are ordered by data product id, which the unique
+    (collection_id, data_product_id) index serves directly. When more items
+    exist, the ``X-Next-Cursor`` response header holds the cursor for the
+    next page.
+    """
+    try:
+        logger.debug("Fetching items of collection %s", collection_id)
+        await _owned_collection(db, collection_id, current_user.id)
+
+        items_query = select(CollectionItem).join(CollectionItem.data_product).filter(
+            CollectionItem.collection_id == collection_id
+        ).options(contains_eager(CollectionItem.data_product))
+
+        # Seek past the last data product the client has seen
+        if cursor:
+            position = decode_cursor(cursor, 'data_product_id')
+            items_query = items_query.filter(CollectionItem.data_product_id > position['data_product_id'])
+
+        items = (await db.scalars(
+            items_query.order_by(CollectionItem.data_product_id).limit(limit + 1)
+        )).all()
+
+        if len(items) > limit:
+            items = items[:limit]
+            response.headers['X-Next-Cursor'] = encode_cursor({
+                'data_product_id': items[-1].data_product_id
+            })
+        return items
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error fetching collection items: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to fetch collection items"
+        )
+
+@router.get("/collections/{collection_id}/export")
+async def export_collection(
+    collection_id: int,
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson", description="File format"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Download every data product in a collection, ordered by data product id.
+
+    Rows are read through a server-side cursor and written out as they
+    arrive, so large collections export in constant memory.
+    """
+    collection = await _owned_collection(db, collection_id, current_user.id)
+    product_columns = list(DataProduct.__table__.columns)
+
+    async def batches():
+        # The request's session is closed before the body is sent
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(
+                select(*product_columns, CollectionItem.added_at).join(
+                    CollectionItem, CollectionItem.data_product_id == DataProduct.id
+                ).filter(
+                    CollectionItem.collection_id == collection_id
+                ).order_by(CollectionItem.data_product_id).execution_options(yield_per=1000)
+            )
+            async for partition in result.partitions():
+                yield [tuple(row) for row in partition]
+
+    columns = column_types(product_columns) + [("added_at", datetime)]
+    return export_response(format, columns, batches(), f"collection-{collection.id}")
+
 @router.post("/collections", response_model=CollectionSchema)
 async def create_collection(
     collection: CollectionCreate,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new collection"""
     try:
-        logger.debug(f"Creating collection for user {current_user.email}: {collection.dict()}")
+        logger.debug("Creating collection for user %s: %s", current_user.email, collection)
         collection_db = Collection(
             title=collection.title,
             description=collection.description,
@@ -56,13 +183,13 @@ async def create_collection(
             updated_at=datetime.utcnow()
         )
         db.add(collection_db)
-        db.commit()
-        db.refresh(collection_db)
-        logger.debug(f"Successfully created collection with ID: {collection_db.id}")
+        await db.commit()
+        await db.refresh(collection_db, ["items"])
+        logger.debug("Successfully created collection with ID: %s", collection_db.id)
         return collection_db
     except Exception as e:
-        logger.error(f"Error creating collection: {str(e)}", exc_info=True)
-        db.rollback()
+        logger.error("Error creating collection: %s", e, exc_info=True)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create collection"
@@ -73,68 +200,161 @@ async def add_to_collection(
     collection_id: int,
     items: CollectionItemCreate,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Add data products to a collection"""
+    """Add data products to a collection; products already in it are skipped"""
     try:
-        logger.debug(f"Adding data products {items.data_product_ids} to collection {collection_id}")
+        logger.debug("Adding %s data products to collection %s", len(items.data_product_ids), collection_id)
+        data_product_ids = list(dict.fromkeys(items.data_product_ids))
 
         # Verify collection belongs to user
-        collection = db.query(Collection).filter(
-            Collection.id == collection_id,
-            Collection.user_id == current_user.id
-        ).first()
-
-        if not collection:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Collection not found"
-            )
+        collection = await _owned_collection(db, collection_id, current_user.id)
 
         # Verify all data products exist
-        data_products = db.query(DataProduct).filter(
-            DataProduct.id.in_(items.data_product_ids)
-        ).all()
-
-        if len(data_products) != len(items.data_product_ids):
+        found = await db.scalar(
+            select(func.count()).select_from(DataProduct).filter(
+                DataProduct.id.in_(data_product_ids)
+            )
+        )
+        if found != len(data_product_ids):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="One or more data products not found"
             )
 
-        # Add items to collection
-        added_count = 0
-        for dp_id in items.data_product_ids:
-            # Check if item already exists in collection
-            existing = db.query(CollectionItem).filter(
-                CollectionItem.collection_id == collection_id,
-                CollectionItem.data_product_id == dp_id
-            ).first()
-
-            if not existing:
-                item = CollectionItem(
-                    collection_id=collection_id,
-                    data_product_id=dp_id,
-                    added_at=datetime.utcnow()
-                )
-                db.add(item)
-                added_count += 1
+        # Insert all of them in one statement, skipping those already present
+        now = datetime.utcnow()
+        connection = await db.connection()
+        result = await db.execute(_insert_items(
+            connection.dialect.name,
+            select(literal(collection_id), DataProduct.id, literal(now)).filter(
+                DataProduct.id.in_(data_product_ids)
+            )
+        ))
+        added_count = result.rowcount
 
         if added_count > 0:
             # Update collection's updated_at timestamp
-            collection.updated_at = datetime.utcnow()
-            db.commit()
-            logger.debug(f"Successfully added {added_count} items to collection {collection_id}")
-            return {"message": f"Added {added_count} items to collection"}
+            collection.updated_at = now
+            await db.commit()
+            logger.debug("Successfully added %s items to collection %s", added_count, collection_id)
+            return {"message": f"Added {added_count} items to collection", "added": added_count}
         else:
-            return {"message": "No new items added to collection"}
+            return {"message": "No new items added to collection", "added": 0}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error adding items to collection: {str(e)}", exc_info=True)
-        db.rollback()
+        logger.error("Error adding items to collection: %s", e, exc_info=True)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to add items to collection"
-        )
\ No newline at end of file
+        )
+
+@router.post("/collections/{collection_id}/items/remove")
+async def remove_from_collection(
+    collection_id: int,
+    items: CollectionItemCreate,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Remove data products from a collection; ids not in it are ignored"""
+    try:
+        logger.debug("Removing %s data products from collection %s", len(items.data_product_ids), collection_id)
+        collection = await _owned_collection(db, collection_id, current_user.id)
+
+        result = await db.execute(
+            delete(CollectionItem).filter(
+                CollectionItem.collection_id == collection_id,
+                CollectionItem.data_product_id.in_(items.data_product_ids)
+            ).execution_options(synchronize_session=False)
+        )
+        removed_count = result.rowcount
+
+        if removed_count > 0:
+            collection.updated_at = datetime.utcnow()
+            await db.commit()
+            logger.debug("Removed %s items from collection %s", removed_count, collection_id)
+        return {"message": f"Removed {removed_count} items from collection", "removed": removed_count}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error removing items from collection: %s", e, exc_info=True)
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to remove items from collection"
+        )
+
+@router.post("/collections/{collection_id}/items/move")
+async def move_between_collections(
+    collection_id: int,
+    items: CollectionItemMove,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Move data products to another of the user's collections.
+
+    Products the target already holds are just removed from the source.
+    Ids not in the source collection are ignored.
+    """
+    try:
+        logger.debug(
+            "Moving %s data products from collection %s to %s",
+            len(items.data_product_ids), collection_id, items.target_collection_id
+        )
+        if items.target_collection_id == collection_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Source and target collection are the same"
+            )
+
+        collections = (await db.scalars(
+            select(Collection).filter(
+                Collection.id.in_([collection_id, items.target_collection_id]),
+                Collection.user_id == current_user.id
+            )
+        )).all()
+        if len(collections) != 2:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Collection not found"
+            )
+
+        now = datetime.utcnow()
+        connection = await db.connection()
+        in_source = (
+            CollectionItem.collection_id == collection_id,
+            CollectionItem.data_product_id.in_(items.data_product_ids)
+        )
+        # Copy into the target first, since the copy reads the source rows
+        await db.execute(_insert_items(
+            connection.dialect.name,
+            select(literal(items.target_collection_id), CollectionItem.data_product_id, literal(now)).filter(
+                *in_source
+            )
+        ))
+        result = await db.execute(
+            delete(CollectionItem).filter(*in_source).execution_options(synchronize_session=False)
+        )
+        moved_count = result.rowcount
+
+        if moved_count > 0:
+            for collection in collections:
+                collection.updated_at = now
+            await db.commit()
+            logger.debug("Moved %s items from collection %s to %s", moved_count, collection_id, items.target_collection_id)
+        return {"message": f"Moved {moved_count} items", "moved": moved_count}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error moving items between collections: %s", e, exc_info=True)
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to move items between collections"
+        )
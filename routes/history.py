@@ -1,34 +1,77 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import get_async_db
 from models.schemas import SearchHistoryEntry
-from models.database_models import SearchHistory, User
-from services.auth import get_current_user
+from models.database_models import SearchHistory
+from services.auth import Principal, get_current_user
+from services.pagination import decode_cursor, encode_cursor
+from services.metrics import InstrumentedRoute
 from datetime import datetime
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 @router.get("/search-history", response_model=List[SearchHistoryEntry])
 async def get_search_history(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of entries to return"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous response's X-Next-Cursor header"),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get the search history for the current user
+    Get the search history for the current user, newest first.
+
+    When more entries exist, the ``X-Next-Cursor`` response header holds the
+    cursor for the next page.
     """
     try:
-        logger.debug(f"Fetching search history for user: {current_user.email}")
-        history = db.query(SearchHistory).filter(
+        logger.debug("Fetching search history for user: %s", current_user.email)
+        history_query = select(SearchHistory).filter(
             SearchHistory.user_id == current_user.id
-        ).order_by(SearchHistory.created_at.desc()).all()
+        )
+
+        # Seek past the last (created_at, id) the client has seen
+        if cursor:
+            position = decode_cursor(cursor, 'created_at', 'id')
+            try:
+                if not isinstance(position['id'], int) or isinstance(position['id'], bool):
+                    raise TypeError("cursor id is not an integer")
+                after_created_at = datetime.fromisoformat(position['created_at'])
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+            history_query = history_query.filter(or_(
+                SearchHistory.created_at < after_created_at,
+                and_(
+                    SearchHistory.created_at == after_created_at,
+                    SearchHistory.id < position['id']
+                )
+            ))
+
+        history = (await db.scalars(
+            history_query.order_by(
+                SearchHistory.created_at.desc(),
+                SearchHistory.id.desc()
+            ).limit(limit + 1)
+        )).all()
+
+        if len(history) > limit:
+            history = history[:limit]
+            last = history[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor({
+                'created_at': last.created_at,
+                'id': last.id
+            })
         return history
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Failed to retrieve search history: {str(e)}", exc_info=True)
+        logger.error("Failed to retrieve search history: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to retrieve search history: {str(e)}"
@@ -37,15 +80,15 @@ async def get_search_history(
 @router.post("/search-history")
 async def save_search(
     search_data: dict,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Save a search to history
     """
     try:
-        logger.debug(f"Saving search for user: {current_user.email}")
-        logger.debug(f"Search data: {search_data}")
+        logger.debug("Saving search for user: %s", current_user.email)
+        logger.debug("Search data: %s", search_data)
 
         history_entry = SearchHistory(
             user_id=current_user.id,
@@ -58,12 +101,12 @@ async def save_search(
             use_count=1
         )
         db.add(history_entry)
-        db.commit()
-        db.refresh(history_entry)
-        logger.info(f"Successfully saved search history for user: {current_user.email}")
+        await db.commit()
+        await db.refresh(history_entry)
+        logger.info("Successfully saved search history for user: %s", current_user.email)
         return {"success": True, "message": "Search saved successfully"}
     except Exception as e:
-        logger.error(f"Failed to save search: {str(e)}", exc_info=True)
+        logger.error("Failed to save search: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to save search: {str(e)}"
@@ -1,32 +1,36 @@
 import logging
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from datetime import datetime
-from database import get_db
-from models.database_models import User, SearchHistory
-from services.auth import get_current_user
+from database import get_async_db
+from models.database_models import SearchHistory
+from services.auth import Principal, get_current_user
+from services.metrics import InstrumentedRoute
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
 @router.get("/saved-searches")
 async def get_saved_searches(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all saved searches for the current user"""
     try:
-        logger.debug(f"Fetching saved searches for user: {current_user.email}")
-        saved_searches = db.query(SearchHistory).filter(
-            SearchHistory.user_id == current_user.id,
-            SearchHistory.is_saved == True
-        ).order_by(SearchHistory.last_used.desc()).all()
+        logger.debug("Fetching saved searches for user: %s", current_user.email)
+        saved_searches = (await db.scalars(
+            select(SearchHistory).filter(
+                SearchHistory.user_id == current_user.id,
+                SearchHistory.is_saved == True
+            ).order_by(SearchHistory.last_used.desc())
+        )).all()
         return saved_searches
     except Exception as e:
-        logger.error(f"Failed to retrieve saved searches: {str(e)}", exc_info=True)
+        logger.error("Failed to retrieve saved searches: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to retrieve saved searches: {str(e)}"
@@ -35,16 +39,18 @@ async def get_saved_searches(
 @router.post("/saved-searches/{search_id}/execute")
 async def execute_saved_search(
     search_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Execute a saved search"""
     try:
-        saved_search = db.query(SearchHistory).filter(
-            SearchHistory.id == search_id,
-            SearchHistory.user_id == current_user.id,
-            SearchHistory.is_saved == True
-        ).first()
+        saved_search = await db.scalar(
+            select(SearchHistory).filter(
+                SearchHistory.id == search_id,
+                SearchHistory.user_id == current_user.id,
+                SearchHistory.is_saved == True
+            )
+        )
 
         if not saved_search:
             raise HTTPException(status_code=404, detail="Saved search not found")
@@ -52,7 +58,7 @@ async def execute_saved_search(
         # Update last used time and count
         saved_search.last_used = datetime.utcnow()
         saved_search.use_count += 1
-        db.commit()
+        await db.commit()
 
         # Return all necessary search parameters
         return {
@@ -64,7 +70,7 @@ async def execute_saved_search(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to execute saved search: {str(e)}", exc_info=True)
+        logger.error("Failed to execute saved search: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to execute saved search: {str(e)}"
@@ -73,30 +79,32 @@ async def execute_saved_search(
 @router.post("/search-history/{search_id}/save")
 async def save_search(
     search_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Save a search from history"""
     try:
-        logger.debug(f"Attempting to save search {search_id} for user: {current_user.email}")
-        search = db.query(SearchHistory).filter(
-            SearchHistory.id == search_id,
-            SearchHistory.user_id == current_user.id
-        ).first()
+        logger.debug("Attempting to save search %s for user: %s", search_id, current_user.email)
+        search = await db.scalar(
+            select(SearchHistory).filter(
+                SearchHistory.id == search_id,
+                SearchHistory.user_id == current_user.id
+            )
+        )
 
         if not search:
             raise HTTPException(status_code=404, detail="Search not found")
 
         search.is_saved = True
         search.last_used = datetime.utcnow()
-        db.commit()
-        logger.info(f"Successfully saved search {search_id} for user: {current_user.email}")
+        await db.commit()
+        logger.info("Successfully saved search %s for user: %s", search_id, current_user.email)
 
         return {"success": True, "message": "Search saved successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to save search: {str(e)}", exc_info=True)
+        logger.error("Failed to save search: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to save search: {str(e)}"
@@ -105,30 +113,32 @@ async def save_search(
 @router.delete("/saved-searches/{search_id}")
 async def delete_saved_search(
     search_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a saved search"""
     try:
-        logger.debug(f"Attempting to delete saved search {search_id} for user: {current_user.email}")
-        saved_search = db.query(SearchHistory).filter(
-            SearchHistory.id == search_id,
-            SearchHistory.user_id == current_user.id,
-            SearchHistory.is_saved == True
-        ).first()
+        logger.debug("Attempting to delete saved search %s for user: %s", search_id, current_user.email)
+        saved_search = await db.scalar(
+            select(SearchHistory).filter(
+                SearchHistory.id == search_id,
+                SearchHistory.user_id == current_user.id,
+                SearchHistory.is_saved == True
+            )
+        )
 
         if not saved_search:
             raise HTTPException(status_code=404, detail="Saved search not found")
 
         saved_search.is_saved = False
-        db.commit()
-        logger.info(f"Successfully deleted saved search {search_id} for user: {current_user.email}")
+        await db.commit()
+        logger.info("Successfully deleted saved search %s for user: %s", search_id, current_user.email)
 
         return {"success": True, "message": "Saved search deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to delete saved search: {str(e)}", exc_info=True)
+        logger.error("Failed to delete saved search: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to delete saved search: {str(e)}"
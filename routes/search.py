@@ -1,197 +1,212 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
-from typing import Optional, List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, Literal, Optional
+from datetime import datetime
 import logging
-from database import get_db
+from database import AsyncSessionLocal, get_async_db
+from models.database_models import ClinicalStudy
 from models.schemas import SearchQuery, SearchResponse, SearchResult
-from models.database_models import ClinicalStudy, DataProduct
+from services.pagination import decode_cursor, encode_cursor
+from services.query_parser import QueryError, parse_query
+from services.cache import search_cache
+from services.export import column_types, export_response
+from services import multi_index
+from services.search_backend import EXPORT_COLUMNS, get_search_backend, search_cache_key
+from services.serialization import encode_result, encode_search_response
+from services.suggest_index import suggestion_index
+from services.metrics import InstrumentedRoute
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
-@router.get("/search", response_model=SearchResponse)
-async def search(
-    q: str = Query(..., description="Search query string"),
-    category: Optional[str] = Query(None, description="Filter by category"),
+def search_filters(
     status: Optional[str] = Query(None, description="Filter by status"),
     phase: Optional[str] = Query(None, description="Filter by phase"),
-    start_date: Optional[str] = Query(None, description="Filter by start date"),
-    end_date: Optional[str] = Query(None, description="Filter by end date"),
+    start_date: Optional[datetime] = Query(None, description="Filter by start date"),
+    end_date: Optional[datetime] = Query(None, description="Filter by end date"),
     indication_category: Optional[str] = Query(None, description="Filter by indication category"),
     severity: Optional[str] = Query(None, description="Filter by severity"),
     procedure_category: Optional[str] = Query(None, description="Filter by procedure category"),
     risk_level: Optional[str] = Query(None, description="Filter by risk level"),
     min_duration: Optional[int] = Query(None, description="Filter by minimum duration"),
-    max_duration: Optional[int] = Query(None, description="Filter by maximum duration"),
+    max_duration: Optional[int] = Query(None, description="Filter by maximum duration")
+) -> Dict[str, Any]:
+    """Study filters shared by search and export"""
+    return {
+        'status': status,
+        'phase': phase,
+        'indication_category': indication_category,
+        'procedure_category': procedure_category,
+        'severity': severity,
+        'risk_level': risk_level,
+        'start_date': start_date,
+        'end_date': end_date,
+        'min_duration': min_duration,
+        'max_duration': max_duration,
+    }
+
+@router.get("/search", response_model=SearchResponse)
+async def search(
+    q: str = Query(..., description="Search query: words, \"phrases\", title:/description: scopes, prefix*, AND/OR/NOT and parentheses"),
+    category: Optional[Literal["all", "studies", "indications", "procedures"]] = Query(None, description="Which indexes to search; all when unset"),
+    filters: Dict[str, Any] = Depends(search_filters),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=100, description="Items per page"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous response's next_cursor; takes precedence over page"),
+    total_mode: Literal["exact", "estimate", "cached"] = Query("exact", description="How to compute total: exact count, planner estimate, or cached count"),
+    facets: bool = Query(False, description="Include per-value counts for each filter"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Search across medical studies with filters
+    Search across medical studies, indications and procedures with filters.
+
+    ``q`` is parsed by ``services.query_parser``: adjacent words must all
+    match, ``OR`` and ``NOT`` combine them and quotes require a phrase.
+
+    The indexes of ``category`` are searched concurrently and their ranked
+    hits merged, see ``services.multi_index``. Facets count studies only.
+
+    Pages can be requested by number or, for constant-cost deep paging, by
+    passing back the ``next_cursor`` of the previous response.
     """
     try:
-        logger.debug(f"Search request received - query: {q}, status: {status}, phase: {phase}")
-        logger.debug(f"Additional filters - category: {category}, indication: {indication_category}, procedure: {procedure_category}")
-
-        # Build base query for studies
-        studies_query = db.query(ClinicalStudy).outerjoin(DataProduct)
-        logger.debug("Base query created")
-
-        # Split the query string by 'OR' and create search conditions
-        search_terms = [term.strip() for term in q.split(' OR ')]
-        logger.debug(f"Search terms: {search_terms}")
-
-        # Create search conditions for each term
-        search_conditions = []
-        for term in search_terms:
-            term_conditions = [
-                ClinicalStudy.title.ilike(f"%{term}%"),
-                ClinicalStudy.description.ilike(f"%{term}%"),
-                # Add more searchable fields as needed
-            ]
-            search_conditions.extend(term_conditions)
-
-        # Combine all conditions with OR
-        studies_query = studies_query.filter(or_(*search_conditions))
-        logger.debug("Search conditions added")
-
-        # Apply filters if provided
-        if status:
-            studies_query = studies_query.filter(ClinicalStudy.status == status)
-            logger.debug(f"Status filter applied: {status}")
-
-        if phase:
-            studies_query = studies_query.filter(ClinicalStudy.phase == phase)
-            logger.debug(f"Phase filter applied: {phase}")
-
-        if indication_category:
-            studies_query = studies_query.filter(ClinicalStudy.indication_category == indication_category)
-            logger.debug(f"Indication category filter applied: {indication_category}")
-
-        if procedure_category:
-            studies_query = studies_query.filter(ClinicalStudy.procedure_category == procedure_category)
-            logger.debug(f"Procedure category filter applied: {procedure_category}")
-
-        if severity:
-            studies_query = studies_query.filter(ClinicalStudy.severity == severity)
-            logger.debug(f"Severity filter applied: {severity}")
-
-        if risk_level:
-            studies_query = studies_query.filter(ClinicalStudy.risk_level == risk_level)
-            logger.debug(f"Risk level filter applied: {risk_level}")
-
-        if start_date:
-            studies_query = studies_query.filter(ClinicalStudy.start_date >= start_date)
-            logger.debug(f"Start date filter applied: {start_date}")
-
-        if end_date:
-            studies_query = studies_query.filter(ClinicalStudy.end_date <= end_date)
-            logger.debug(f"End date filter applied: {end_date}")
-
-        if min_duration:
-            studies_query = studies_query.filter(ClinicalStudy.duration >= min_duration)
-            logger.debug(f"Min duration filter applied: {min_duration}")
-
-        if max_duration:
-            studies_query = studies_query.filter(ClinicalStudy.duration <= max_duration)
-            logger.debug(f"Max duration filter applied: {max_duration}")
-
-        # Calculate pagination
         try:
-            total = studies_query.count()
-            logger.debug(f"Total results: {total}")
-            studies = studies_query.offset((page - 1) * per_page).limit(per_page).all()
-            logger.debug(f"Retrieved {len(studies)} studies for current page")
+            search_query = parse_query(q)
+        except QueryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        logger.debug(
+            "Search request: query=%s category=%s filters=%s page=%s cursor=%s",
+            search_query, category, filters, page, cursor
+        )
+
+        cache_key = search_cache_key(search_query, filters, page, per_page, cursor, total_mode, facets, category)
+        cached, generation = await search_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Serving search response from cache")
+            return Response(cached, media_type="application/json")
+
+        after = None
+        if cursor:
+            position = decode_cursor(cursor, 'score', 'id')
+            # Cursors from before indications and procedures were searched are studies
+            result_type = position.get('type', 'study')
+            try:
+                if result_type not in multi_index.INDEX_TYPES:
+                    raise ValueError("unknown result type")
+                after = (float(position['score']), result_type, int(position['id']))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+        # Fan out to the full-text index of each result type
+        try:
+            search_page = await multi_index.search(
+                db, search_query, filters, category, page, per_page, after, total_mode, facets
+            )
+            hits = search_page.hits
         except Exception as e:
-            logger.error(f"Database query error: {str(e)}", exc_info=True)
+            logger.error("Database query error: %s", e, exc_info=True)
             raise HTTPException(
                 status_code=500,
                 detail="Error executing database query"
             )
 
-        # Process results
-        results = []
-        for study in studies:
-            try:
-                data_products = []
-                if hasattr(study, 'data_products') and study.data_products:
-                    for dp in study.data_products:
-                        data_products.append({
-                            'id': dp.id,
-                            'title': dp.title,
-                            'description': dp.description,
-                            'type': dp.type,
-                            'format': dp.format,
-                            'study_id': dp.study_id,
-                            'created_at': dp.created_at
-                        })
-
-                result = {
-                    'id': study.id,
-                    'title': study.title,
-                    'type': "study",
-                    'description': study.description,
-                    'status': study.status,
-                    'phase': study.phase,
-                    'indication_category': getattr(study, 'indication_category', None),
-                    'procedure_category': getattr(study, 'procedure_category', None),
-                    'severity': getattr(study, 'severity', None),
-                    'risk_level': getattr(study, 'risk_level', None),
-                    'start_date': getattr(study, 'start_date', None),
-                    'end_date': getattr(study, 'end_date', None),
-                    'duration': getattr(study, 'duration', None),
-                    'data_products': data_products
-                }
-                results.append(result)
-            except Exception as e:
-                logger.error(f"Error processing study {study.id}: {str(e)}", exc_info=True)
-                continue
-
-        logger.debug(f"Successfully processed {len(results)} results")
-        return {
-            'results': results,
-            'total': total,
-            'page': page,
-            'per_page': per_page
-        }
+        # Studies are encoded once and reused across queries; only the score
+        # differs per result
+        fragments = await multi_index.fragments(db, hits)
+        results = [
+            encode_result(fragments[result_type, result_id], score)
+            for result_type, result_id, score in hits
+            if (result_type, result_id) in fragments
+        ]
+
+        next_cursor = None
+        if search_page.has_more and hits:
+            last_type, last_id, last_score = hits[-1]
+            next_cursor = encode_cursor({'score': last_score, 'type': last_type, 'id': last_id})
+
+        logger.debug(
+            "Search returned %s of %s results from %s backend",
+            len(results), search_page.total, get_search_backend().name
+        )
+        body = encode_search_response(
+            results, search_page.total, search_page.total_is_exact,
+            page, per_page, next_cursor, search_page.facets
+        )
+        await search_cache.set(cache_key, body.decode(), generation)
+        # Already shaped like SearchResponse, so it skips response_model validation
+        return Response(body, media_type="application/json")
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Search operation failed: {str(e)}", exc_info=True)
+        logger.error("Search operation failed: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Search operation failed: {str(e)}"
         )
 
+@router.get("/search/export")
+async def export_search(
+    q: str = Query(..., description="Search query string"),
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson", description="File format"),
+    filters: Dict[str, Any] = Depends(search_filters)
+):
+    """
+    Download every study matching a search, in ranking order.
+
+    The file is streamed while the results are read, so exports of any size
+    run in constant memory.
+    """
+    try:
+        search_query = parse_query(q)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    backend = get_search_backend()
+    logger.debug("Search export: query=%s filters=%s format=%s", search_query, filters, format)
+
+    async def batches():
+        # The request's session is closed before the body is sent
+        async with AsyncSessionLocal() as db:
+            async for batch in backend.stream(db, search_query, filters):
+                yield batch
+
+    types = dict(column_types(ClinicalStudy.__table__.columns))
+    columns = [(name, types[name]) for name in EXPORT_COLUMNS] + [('relevance_score', float)]
+    return export_response(format, columns, batches(), "search")
+
+@router.get("/search/cache-stats")
+async def get_search_cache_stats():
+    """
+    Hit, miss and eviction counters of the search result cache
+    """
+    return search_cache.stats()
+
 @router.get("/suggest")
 async def get_suggestions(
     q: str = Query(..., min_length=2),
-    db: Session = Depends(get_db)
+    limit: int = Query(5, ge=1, le=20, description="Maximum number of suggestions")
 ):
     """
-    Get search suggestions based on partial input
+    Get search suggestions based on partial input.
+
+    Served from the in-memory suggestion index, which matches the start of
+    any word in study, indication and procedure titles.
     """
     try:
-        logger.debug(f"Suggestion request received for query: {q}")
-        search_term = f"%{q}%"
-
-        # Get suggestions from studies
-        studies = db.query(ClinicalStudy.title).filter(
-            ClinicalStudy.title.ilike(search_term)
-        ).distinct().limit(5).all()
-
-        suggestions = [{"text": study.title, "type": "study"} for study in studies]
-        logger.debug(f"Returning {len(suggestions)} suggestions")
+        logger.debug("Suggestion request received for query: %s", q)
+        suggestions = [
+            {"text": suggestion.text, "type": suggestion.type}
+            for suggestion in suggestion_index.suggest(q, limit)
+        ]
+        logger.debug("Returning %s suggestions", len(suggestions))
 
         return {"suggestions": suggestions}
 
     except Exception as e:
-        logger.error(f"Failed to get suggestions: {str(e)}", exc_info=True)
+        logger.error("Failed to get suggestions: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get suggestions: {str(e)}"
-        )
\ No newline at end of file
+        )
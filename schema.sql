@@ -22,7 +22,12 @@ CREATE TABLE clinical_study (
     procedure_category VARCHAR(100),
     severity VARCHAR(50),
     risk_level VARCHAR(50),
-    duration INTEGER
+    duration INTEGER,
+    -- Full-text search document; title terms are weighted above description terms
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 -- Indications table
@@ -32,7 +37,12 @@ CREATE TABLE indication (
     description TEXT,
     category VARCHAR(100),
     severity VARCHAR(50),
-    relevance_score FLOAT DEFAULT 1.0
+    relevance_score FLOAT DEFAULT 1.0,
+    -- Searched next to clinical_study by /api/search
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 -- Procedures table
@@ -43,7 +53,12 @@ CREATE TABLE procedure (
     category VARCHAR(100),
     risk_level VARCHAR(50),
     duration INTEGER,
-    relevance_score FLOAT DEFAULT 1.0
+    relevance_score FLOAT DEFAULT 1.0,
+    -- Searched next to clinical_study by /api/search
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 -- Data Products table
@@ -89,9 +104,104 @@ CREATE TABLE search_history (
     use_count INTEGER DEFAULT 0
 );
 
+-- Change log of the searchable tables, filled by the triggers below
+CREATE TABLE search_changes (
+    id BIGSERIAL PRIMARY KEY,
+    -- study, indication or procedure; data product writes log their study
+    entity VARCHAR(20) NOT NULL,
+    row_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT now()
+);
+
+-- Migrations applied, read at startup; schema.sql is current as of 007
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT now()
+);
+
+INSERT INTO schema_version (version) VALUES (7);
+
 -- Add indexes for better query performance
 CREATE INDEX idx_clinical_study_title ON clinical_study(title);
-CREATE INDEX idx_clinical_study_status ON clinical_study(status);
+CREATE INDEX idx_clinical_study_status_phase ON clinical_study(status, phase);
+CREATE INDEX idx_clinical_study_start_date ON clinical_study(start_date);
+CREATE INDEX idx_clinical_study_end_date ON clinical_study(end_date);
+CREATE INDEX idx_clinical_study_indication_category ON clinical_study(indication_category) WHERE indication_category IS NOT NULL;
+CREATE INDEX idx_clinical_study_procedure_category ON clinical_study(procedure_category) WHERE procedure_category IS NOT NULL;
+CREATE INDEX idx_clinical_study_severity ON clinical_study(severity) WHERE severity IS NOT NULL;
+CREATE INDEX idx_clinical_study_risk_level ON clinical_study(risk_level) WHERE risk_level IS NOT NULL;
+CREATE INDEX idx_clinical_study_duration ON clinical_study(duration) WHERE duration IS NOT NULL;
+CREATE INDEX idx_clinical_study_search_vector ON clinical_study USING GIN (search_vector);
+CREATE INDEX idx_indication_search_vector ON indication USING GIN (search_vector);
+CREATE INDEX idx_procedure_search_vector ON procedure USING GIN (search_vector);
+CREATE INDEX idx_search_changes_changed_at ON search_changes (changed_at);
 CREATE INDEX idx_data_products_study_id ON data_products(study_id);
-CREATE INDEX idx_collection_items_collection_id ON collection_items(collection_id);
+CREATE UNIQUE INDEX idx_collection_items_collection_product ON collection_items(collection_id, data_product_id);
 CREATE INDEX idx_search_history_user_id ON search_history(user_id);
+CREATE INDEX idx_search_history_user_created ON search_history(user_id, created_at, id);
+
+-- Log writes to the searchable tables, see services/change_feed.py
+CREATE OR REPLACE FUNCTION log_search_changes() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV: the logged entity, then the column holding its id
+    EXECUTE format(
+        'INSERT INTO search_changes (entity, row_id) '
+        'SELECT DISTINCT %L, %I FROM changed_rows WHERE %I IS NOT NULL',
+        TG_ARGV[0], TG_ARGV[1], TG_ARGV[1]
+    );
+    PERFORM pg_notify('search_changes', TG_ARGV[0]);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_insert
+    AFTER INSERT ON clinical_study REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_update
+    AFTER UPDATE ON clinical_study REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER clinical_study_search_changes_delete
+    AFTER DELETE ON clinical_study REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_insert
+    AFTER INSERT ON data_products REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_update
+    AFTER UPDATE ON data_products REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_delete
+    AFTER DELETE ON data_products REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER data_products_search_changes_update_old
+    AFTER UPDATE ON data_products REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('study', 'study_id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_insert
+    AFTER INSERT ON indication REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_update
+    AFTER UPDATE ON indication REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER indication_search_changes_delete
+    AFTER DELETE ON indication REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('indication', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_insert
+    AFTER INSERT ON procedure REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_update
+    AFTER UPDATE ON procedure REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
+
+CREATE OR REPLACE TRIGGER procedure_search_changes_delete
+    AFTER DELETE ON procedure REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes('procedure', 'id');
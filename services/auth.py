@@ -1,14 +1,17 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
 import logging
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 import os
-from database import get_db
+from database import get_async_db
 from models.database_models import User
+from services.cache import LRUCache
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,6 +21,16 @@ SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# When set, tokens carrying uid/active claims are trusted without a lookup,
+# so a deactivation only takes effect once the user's token expires
+STATELESS_TOKENS = os.environ.get("AUTH_STATELESS_TOKENS", "").lower() in ("1", "true", "yes")
+
+# Verified principals keyed by token subject; a TTL of 0 disables the cache
+principal_cache = LRUCache(
+    max_size=int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("AUTH_PRINCIPAL_CACHE_TTL", "60"))
+)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
@@ -25,19 +38,39 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return pwd_context.verify(plain_password, hashed_password)
     except Exception as e:
-        logger.error(f"Error verifying password: {str(e)}")
+        logger.error("Error verifying password: %s", e)
         return False
 
 def get_password_hash(password: str) -> str:
     try:
         return pwd_context.hash(password)
     except Exception as e:
-        logger.error(f"Error hashing password: {str(e)}")
+        logger.error("Error hashing password: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error processing password"
         )
 
+class Principal(NamedTuple):
+    """The authenticated user, detached from any database session"""
+    id: int
+    email: str
+    username: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.email, user.username, bool(user.is_active))
+
+def token_claims(user: User) -> dict:
+    """Claims identifying a user, enough to authenticate in stateless mode"""
+    return {
+        "sub": user.email,
+        "uid": user.id,
+        "username": user.username,
+        "active": bool(user.is_active),
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     try:
         to_encode = data.copy()
@@ -46,46 +79,88 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         else:
             expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         to_encode.update({"exp": expire})
-        logger.debug(f"Creating access token with data: {to_encode}")
+        logger.debug("Creating access token for: %s", to_encode.get("sub"))
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     except Exception as e:
-        logger.error(f"Error creating access token: {str(e)}")
+        logger.error("Error creating access token: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error generating access token"
         )
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        logger.debug(f"Received token for verification: {token[:10]}...")
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.debug(f"Decoded token payload: {payload}")
 
         email: str = payload.get("sub")
         if email is None:
             logger.warning("Token payload missing 'sub' claim")
             raise credentials_exception
 
-        logger.debug(f"Looking up user with email: {email}")
-        user = db.query(User).filter(User.email == email).first()
-        if user is None:
-            logger.warning(f"No user found for email: {email}")
+        principal = None
+        if STATELESS_TOKENS and "uid" in payload and "active" in payload:
+            principal = Principal(payload["uid"], email, payload.get("username"), payload["active"])
+        elif principal_cache.ttl > 0:
+            principal = principal_cache.get(email)
+
+        if principal is None:
+            logger.debug("Looking up user with email: %s", email)
+            user = await db.scalar(select(User).filter(User.email == email))
+            if user is None:
+                logger.warning("No user found for email: %s", email)
+                raise credentials_exception
+            principal = Principal.from_user(user)
+            if principal_cache.ttl > 0:
+                principal_cache.set(email, principal)
+
+        if not principal.is_active:
+            logger.warning("Inactive user attempted access: %s", email)
             raise credentials_exception
 
-        logger.debug(f"Successfully authenticated user: {user.username}")
-        return user
+        logger.debug("Successfully authenticated user: %s", principal.username)
+        return principal
+    except HTTPException:
+        raise
     except JWTError as e:
-        logger.error(f"JWT decode error: {str(e)}")
+        logger.error("JWT decode error: %s", e)
         raise credentials_exception
     except Exception as e:
-        logger.error(f"Unexpected error in get_current_user: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in get_current_user: %s", e, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error validating user"
-        )
\ No newline at end of file
+        )
+
+# Session.info key of the token subjects whose principals a commit makes stale
+SESSION_STALE_PRINCIPALS = "stale_principals"
+
+def _record_stale_principal(mapper, connection, target):
+    """Remember the subjects of a user whose row changed or was deleted"""
+    session = object_session(target)
+    if session is None:
+        return
+    emails = session.info.setdefault(SESSION_STALE_PRINCIPALS, set())
+    emails.add(target.email)
+    emails.update(inspect(target).attrs.email.history.deleted or ())
+
+# Deactivation, email changes and deletes through the ORM take effect on
+# the next request instead of after the TTL. Principals are only evicted
+# once the change is committed; evicting at flush would let a request
+# cache the old row again before the commit
+event.listen(User, "after_update", _record_stale_principal)
+event.listen(User, "after_delete", _record_stale_principal)
+
+@event.listens_for(Session, "after_commit")
+def _forget_committed_principals(session):
+    for email in session.info.pop(SESSION_STALE_PRINCIPALS, ()):
+        principal_cache.discard(email)
+
+@event.listens_for(Session, "after_rollback")
+def _keep_rolled_back_principals(session):
+    session.info.pop(SESSION_STALE_PRINCIPALS, None)
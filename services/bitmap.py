@@ -0,0 +1,207 @@
+"""Compressed integer sets for facet counting.
+
+A roaring-style bitmap: ids are split into chunks of 65536 by their high
+bits, and each chunk is stored in whichever container is smaller. Sparse
+chunks (up to ``ARRAY_LIMIT`` ids) are sorted ``array('H')`` of the low
+bits. Dense chunks are a 65536-bit Python int, so intersecting two of them
+and counting the result are single C-level operations.
+
+``to_bytes`` and ``Bitmap.from_buffer`` store a bitmap container by
+container, for the index snapshots of ``services/snapshot_file.py``.
+"""
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Union
+
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+
+# Above this many ids a chunk is smaller as a bitset than as an array
+ARRAY_LIMIT = 4096
+
+# Bit positions set in each byte value, for walking dense chunks
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+Container = Union[array, int]
+
+
+def _bitset(lows: Iterable[int]) -> int:
+    bits = bytearray(CHUNK_BYTES)
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _container(lows: List[int]) -> Container:
+    """Pick the container for a chunk from its distinct, sorted low bits"""
+    if len(lows) <= ARRAY_LIMIT:
+        return array("H", lows)
+    return _bitset(lows)
+
+
+def _cardinality(container: Container) -> int:
+    return len(container) if isinstance(container, array) else container.bit_count()
+
+
+def _lows(container: Container) -> Iterator[int]:
+    if isinstance(container, array):
+        yield from container
+        return
+    for index, byte in enumerate(container.to_bytes(CHUNK_BYTES, "little")):
+        if byte:
+            base = index << 3
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+def _intersect(left: Container, right: Container) -> Container:
+    if isinstance(left, int) and isinstance(right, int):
+        result = left & right
+        if result.bit_count() <= ARRAY_LIMIT:
+            return array("H", _lows(result))
+        return result
+    if isinstance(left, int):
+        left, right = right, left
+    if isinstance(right, int):
+        dense = right.to_bytes(CHUNK_BYTES, "little")
+        return array("H", (low for low in left if dense[low >> 3] >> (low & 7) & 1))
+    return array("H", sorted(set(left).intersection(right)))
+
+
+def _intersection_cardinality(left: Container, right: Container) -> int:
+    if isinstance(left, int) and isinstance(right, int):
+        return (left & right).bit_count()
+    if isinstance(left, int):
+        left, right = right, left
+    if isinstance(right, int):
+        dense = right.to_bytes(CHUNK_BYTES, "little")
+        return sum(dense[low >> 3] >> (low & 7) & 1 for low in left)
+    if len(left) > len(right):
+        left, right = right, left
+    return len(set(left).intersection(right))
+
+
+class Bitmap:
+    """Set of non-negative ints with cheap intersections and counts"""
+
+    __slots__ = ("_containers",)
+
+    def __init__(self, ids: Iterable[int] = ()):
+        grouped: Dict[int, List[int]] = {}
+        for value in ids:
+            grouped.setdefault(value >> CHUNK_BITS, []).append(value & LOW_MASK)
+        self._containers: Dict[int, Container] = {
+            key: _container(sorted(set(lows))) for key, lows in grouped.items()
+        }
+
+    def __len__(self) -> int:
+        return sum(_cardinality(container) for container in self._containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = value & LOW_MASK
+        if isinstance(container, array):
+            position = bisect_left(container, low)
+            return position < len(container) and container[position] == low
+        return bool(container >> low & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self._containers):
+            base = key << CHUNK_BITS
+            for low in _lows(self._containers[key]):
+                yield base + low
+
+    def add(self, value: int) -> None:
+        key, low = value >> CHUNK_BITS, value & LOW_MASK
+        container = self._containers.get(key)
+        if container is None:
+            self._containers[key] = array("H", [low])
+        elif isinstance(container, array):
+            position = bisect_left(container, low)
+            if position < len(container) and container[position] == low:
+                return
+            container.insert(position, low)
+            if len(container) > ARRAY_LIMIT:
+                self._containers[key] = _bitset(container)
+        else:
+            self._containers[key] = container | (1 << low)
+
+    def discard(self, value: int) -> None:
+        key, low = value >> CHUNK_BITS, value & LOW_MASK
+        container = self._containers.get(key)
+        if container is None:
+            return
+        if isinstance(container, array):
+            position = bisect_left(container, low)
+            if position < len(container) and container[position] == low:
+                del container[position]
+        else:
+            container &= ~(1 << low)
+            if container.bit_count() <= ARRAY_LIMIT:
+                container = array("H", _lows(container))
+            self._containers[key] = container
+        if not _cardinality(self._containers[key]):
+            del self._containers[key]
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap()
+        for key, container in self._containers.items():
+            other_container = other._containers.get(key)
+            if other_container is None:
+                continue
+            intersection = _intersect(container, other_container)
+            if _cardinality(intersection):
+                result._containers[key] = intersection
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serialize as (key, size) uint32 pairs, each followed by its container.
+
+        Size is the id count of an array container, stored as its uint16
+        lows, or 0 for a bitset, stored as ``CHUNK_BYTES`` little-endian
+        bytes. Integers are in native byte order.
+        """
+        parts = []
+        for key in sorted(self._containers):
+            container = self._containers[key]
+            if isinstance(container, array):
+                parts.append(array("I", (key, len(container))).tobytes())
+                parts.append(container.tobytes())
+            else:
+                parts.append(array("I", (key, 0)).tobytes())
+                parts.append(container.to_bytes(CHUNK_BYTES, "little"))
+        return b"".join(parts)
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "Bitmap":
+        """Read a bitmap written by ``to_bytes``"""
+        data = memoryview(buffer).cast("B")
+        bitmap = cls()
+        position = 0
+        while position < len(data):
+            key, size = data[position:position + 8].cast("I")
+            position += 8
+            if size:
+                bitmap._containers[key] = array("H", data[position:position + 2 * size].cast("H"))
+                position += 2 * size
+            else:
+                bitmap._containers[key] = int.from_bytes(data[position:position + CHUNK_BYTES], "little")
+                position += CHUNK_BYTES
+        return bitmap
+
+    def intersection_cardinality(self, other: "Bitmap") -> int:
+        """``len(self & other)`` without building the intersection"""
+        if len(self._containers) > len(other._containers):
+            self, other = other, self
+        total = 0
+        for key, container in self._containers.items():
+            other_container = other._containers.get(key)
+            if other_container is not None:
+                total += _intersection_cardinality(container, other_container)
+        return total
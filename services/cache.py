@@ -0,0 +1,347 @@
+"""Caches shared by the search services.
+
+``LRUCache`` is a bounded in-process tier with per-entry TTL. ``ResultCache``
+puts it in front of an optional Redis tier (enabled by ``REDIS_URL``) and
+keys every entry on a generation counter, so bumping the counter after a
+write to the searchable tables invalidates everything cached before it.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models.database_models import ClinicalStudy, DataProduct, Indication, Procedure
+from services.change_feed import change_feed
+from services.metrics import record_cache_lookup
+
+# Imported by _load_redis when REDIS_URL is set, as it is slow to import
+redis = None
+redis_asyncio = None
+RedisError = Exception
+
+logger = logging.getLogger(__name__)
+
+# Seconds a Redis connection attempt or command may take before it fails
+REDIS_TIMEOUT = float(os.environ.get("REDIS_TIMEOUT", "1"))
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries also expire after ``ttl`` seconds"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def _load_redis() -> bool:
+    """Whether the redis client is available, importing it if needed"""
+    global redis, redis_asyncio, RedisError
+    if redis is None:
+        try:
+            import redis
+            import redis.asyncio as redis_asyncio
+            from redis.exceptions import RedisError
+        except ImportError:  # pragma: no cover - redis is an optional tier
+            return False
+    return True
+
+
+class RedisTier:
+    """Shared cache tier in Redis.
+
+    Entries are stored with the generation they were computed under, and a
+    lookup fetches the current generation in the same MGET, so a bump from
+    any worker invalidates every entry in one round trip. A value computed
+    after a miss is stored under the generation that lookup read, so one
+    that races a bump from another worker is never served.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.generation_key = f"{namespace}:generation"
+        timeouts = {"socket_timeout": REDIS_TIMEOUT, "socket_connect_timeout": REDIS_TIMEOUT}
+        self._client = redis_asyncio.Redis.from_url(url, **timeouts)
+        # Bumps from code that runs without an event loop, such as load_data.py
+        self._sync_client = redis.Redis.from_url(url, **timeouts)
+        self._bumps: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.namespace}:entry:{key}"
+
+    async def get(self, key: str) -> Tuple[Optional[Any], Optional[int]]:
+        """The cached value, if any, and the current generation; None for it when Redis failed"""
+        try:
+            generation, raw = await self._client.mget(self.generation_key, self._entry_key(key))
+        except RedisError as e:
+            self.errors += 1
+            logger.warning("Redis cache lookup failed: %s", e)
+            return None, None
+        generation = int(generation or 0)
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry["generation"] == generation:
+                self.hits += 1
+                return entry["value"], generation
+        self.misses += 1
+        return None, generation
+
+    async def set(self, key: str, value: Any, generation: int) -> None:
+        """Store a value computed while ``generation``, as read by ``get``, was current"""
+        try:
+            raw = json.dumps({"generation": generation, "value": jsonable_encoder(value)})
+            await self._client.set(self._entry_key(key), raw, ex=int(self.ttl))
+        except RedisError as e:
+            self.errors += 1
+            logger.warning("Redis cache store failed: %s", e)
+
+    def bump_generation(self) -> None:
+        """Invalidate every worker's entries; in the background on an event loop"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            try:
+                self._sync_client.incr(self.generation_key)
+            except RedisError as e:
+                self.errors += 1
+                logger.warning("Redis cache invalidation failed: %s", e)
+            return
+        # Commit hooks of async sessions run on the loop, which must not
+        # wait for a round trip to Redis
+        bump = loop.create_task(self._bump_generation())
+        self._bumps.add(bump)
+        bump.add_done_callback(self._bumps.discard)
+
+    async def _bump_generation(self) -> None:
+        try:
+            await self._client.incr(self.generation_key)
+        except RedisError as e:
+            self.errors += 1
+            logger.warning("Redis cache invalidation failed: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+class Generation(NamedTuple):
+    """Generations of both tiers when a lookup missed"""
+    local: int
+    # None without a Redis tier, or when it could not be read
+    remote: Optional[int] = None
+
+
+class ResultCache:
+    """Two-tier cache of computed responses, invalidated by generation"""
+
+    def __init__(
+        self,
+        namespace: str,
+        max_size: int,
+        ttl: float,
+        redis_url: Optional[str] = None
+    ):
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+        self.remote = None
+        if redis_url and _load_redis():
+            self.remote = RedisTier(redis_url, namespace, ttl)
+        self.generation = 0
+        self._invalidation_callbacks: List[Callable[[], None]] = []
+
+    def on_invalidate(self, callback: Callable[[], None]) -> None:
+        """Run callback whenever the cache is invalidated"""
+        self._invalidation_callbacks.append(callback)
+
+    async def get(self, key: str) -> Tuple[Optional[Any], Generation]:
+        """The cached value, if any, and the generation to pass to ``set`` after a miss"""
+        generation = Generation(self.generation)
+        value = self.local.get((generation.local, key))
+        if value is None and self.remote is not None:
+            value, remote_generation = await self.remote.get(key)
+            generation = generation._replace(remote=remote_generation)
+            if value is not None:
+                self.local.set((generation.local, key), value)
+        record_cache_lookup(value is not None)
+        return value, generation
+
+    async def set(self, key: str, value: Any, generation: Generation) -> None:
+        """Store a value computed while ``generation``, as returned by ``get``, was current.
+
+        Values computed across an invalidation in this worker are dropped.
+        In Redis they are stored under the generation they were computed
+        under, so a bump from another worker meanwhile leaves them unserved.
+        """
+        if generation.local != self.generation:
+            return
+        self.local.set((generation.local, key), value)
+        if self.remote is not None and generation.remote is not None:
+            await self.remote.set(key, value, generation.remote)
+
+    def invalidate(self) -> None:
+        """Start a new generation; older entries are never served again"""
+        self.generation += 1
+        self.local.clear()
+        if self.remote is not None:
+            self.remote.bump_generation()
+        for callback in self._invalidation_callbacks:
+            callback()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "local": self.local.stats(),
+            "redis": self.remote.stats() if self.remote is not None else None,
+        }
+
+
+# Responses of /api/search keyed by canonical query
+search_cache = ResultCache(
+    namespace="search",
+    max_size=int(os.environ.get("SEARCH_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("SEARCH_CACHE_TTL", "60")),
+    redis_url=os.environ.get("REDIS_URL")
+)
+
+
+# Encoded search results per study id, see services/serialization.py. Each
+# worker invalidates its own entries on writes; the TTL bounds how long
+# another worker's writes can go unnoticed.
+study_fragment_cache = LRUCache(
+    max_size=int(os.environ.get("SEARCH_FRAGMENT_CACHE_SIZE", "20000")),
+    ttl=float(os.environ.get("SEARCH_FRAGMENT_CACHE_TTL", "300"))
+)
+
+
+SEARCHABLE_MODELS = (ClinicalStudy, DataProduct, Indication, Procedure)
+
+
+# Session.info key of the studies a transaction's flushes changed; present
+# whenever they wrote to the searchable tables
+SESSION_STALE_STUDIES = "stale_search_results"
+
+
+@event.listens_for(Session, "after_flush")
+def _record_search_changes(session, flush_context):
+    """Remember writes to the searchable tables until the transaction ends.
+
+    Checked once per flush, so a bulk load invalidates once rather than
+    once per row.
+    """
+    changed = [
+        instance for instance in chain(session.new, session.dirty, session.deleted)
+        if isinstance(instance, SEARCHABLE_MODELS)
+    ]
+    if changed:
+        session.info.setdefault(SESSION_STALE_STUDIES, set()).update(_changed_study_ids(changed))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_search_cache(session):
+    """Any committed write to the searchable tables makes cached search responses stale.
+
+    Invalidating at flush would let a request that reads before the commit
+    cache the old rows under the new generation.
+    """
+    study_ids = session.info.pop(SESSION_STALE_STUDIES, None)
+    if study_ids is None:
+        return
+    search_cache.invalidate()
+    for study_id in study_ids:
+        study_fragment_cache.discard(study_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_changes(session):
+    session.info.pop(SESSION_STALE_STUDIES, None)
+
+
+def _changed_study_ids(instances) -> Set[int]:
+    """Studies whose encoded result a flush of instances makes stale"""
+    study_ids = set()
+    for instance in instances:
+        if isinstance(instance, ClinicalStudy):
+            study_ids.add(instance.id)
+        elif isinstance(instance, DataProduct):
+            # A data product moved between studies changes both
+            history = inspect(instance).attrs.study_id.history
+            study_ids.update(history.added or ())
+            study_ids.update(history.deleted or ())
+            study_ids.update(history.unchanged or ())
+    study_ids.discard(None)
+    return study_ids
+
+
+@change_feed.after_batch
+def _forget_applied_changes(changes):
+    """Responses cached before a change batch reached the indexes are stale.
+
+    The commit hook above already covers this worker's writes as they
+    happen; batches also carry other workers' writes and bulk loads from
+    the Postgres change log.
+    """
+    if changes:
+        search_cache.invalidate()
+    for study_id in changes.get("study", ()):
+        study_fragment_cache.discard(study_id)
@@ -0,0 +1,359 @@
+"""Change capture that keeps the in-process search structures current.
+
+The inverted indexes and the suggestion index are built from the tables, or
+mapped from a snapshot of them (``services/index_snapshots.py``), at
+startup; this feed then applies later writes to them as deltas, so nothing
+is rebuilt. Changes reach it two ways:
+
+- SQLAlchemy ``after_insert``/``after_update``/``after_delete`` hooks on
+  ClinicalStudy, DataProduct, Indication and Procedure record what a
+  session writes and publish it when the session commits.
+- On Postgres, statement-level triggers log every write, bulk COPY loads
+  and other workers' writes included, to ``search_changes`` (see
+  migrations/006_search_changes.sql). The feed reads the log past its
+  position, woken by ``LISTEN search_changes`` when the driver supports it
+  and polling every ``CHANGE_FEED_POLL_INTERVAL`` seconds regardless.
+
+A change is a result type and id: ``study``, ``indication`` or
+``procedure``. Data product writes are changes to their study, whose
+search result embeds them. Changes are applied in micro-batches, at most
+one every ``CHANGE_FEED_INTERVAL`` seconds and ``CHANGE_FEED_BATCH_SIZE``
+log entries, and a row written many times in between is reloaded once.
+Each subscriber gets the changed ids and reloads what it indexes; a row
+that is gone was deleted.
+
+``status`` reports the consistency watermark for /api/health: every
+change committed before ``watermark`` is searchable.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from database import AsyncSessionLocal, async_engine
+from models.database_models import ClinicalStudy, DataProduct, Indication, Procedure, SearchChange
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between micro-batches, so bursts of writes coalesce
+CHANGE_FEED_INTERVAL = float(os.environ.get("CHANGE_FEED_INTERVAL", "0.5"))
+
+# Seconds between reads of the change log when no notification arrives
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get("CHANGE_FEED_POLL_INTERVAL", "5"))
+
+# Log entries read per micro-batch
+CHANGE_FEED_BATCH_SIZE = int(os.environ.get("CHANGE_FEED_BATCH_SIZE", "5000"))
+
+# Seconds a gap in the log sequence is taken for a write still in flight;
+# after that it was rolled back
+CHANGE_FEED_GAP_TIMEOUT = float(os.environ.get("CHANGE_FEED_GAP_TIMEOUT", "30"))
+
+# Log entries older than this many hours are pruned
+CHANGE_LOG_RETENTION_HOURS = float(os.environ.get("CHANGE_LOG_RETENTION_HOURS", "24"))
+
+CHANNEL = "search_changes"
+
+# Key of the changes a session has flushed but not committed, in Session.info
+SESSION_CHANGES = "search_changes"
+
+# Applies changed ids of one result type to an index
+ChangeHandler = Callable[[AsyncSession, str, Set[int]], Awaitable[None]]
+
+Changes = Dict[str, Set[int]]
+
+
+class ChangeFeed:
+    """Collects changed ids and applies them to subscribers in micro-batches"""
+
+    def __init__(self):
+        self._pending: Changes = {}
+        self._lock = threading.Lock()
+        self._handlers: List[ChangeHandler] = []
+        self._batch_callbacks: List[Callable[[Changes], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[AsyncConnection] = None
+        self._pruned_at = 0.0
+        self.enabled = False
+        self.uses_log = async_engine.dialect.name == "postgresql"
+        # Last search_changes id read, when the log is read
+        self.log_position: Optional[int] = None
+        # Ids below log_position not seen yet -> when the gap was noticed
+        self._gaps: Dict[int, float] = {}
+        # Every change committed before this time has been applied
+        self.watermark: Optional[datetime] = None
+        self.batches = 0
+        self.applied = 0
+
+    def subscribe(self, handler: ChangeHandler) -> None:
+        """Call handler(db, result_type, ids) for each type in every batch"""
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def after_batch(self, callback: Callable[[Changes], None]) -> Callable[[Changes], None]:
+        """Call callback with a batch's changes once every handler has applied it"""
+        self._batch_callbacks.append(callback)
+        return callback
+
+    def publish(self, changes: Changes) -> None:
+        """Queue committed changes; safe to call from any thread"""
+        if not self.enabled or not changes:
+            return
+        with self._lock:
+            for result_type, ids in changes.items():
+                self._pending.setdefault(result_type, set()).update(ids)
+        self._notify()
+
+    def _notify(self, *args: Any) -> None:
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def mark(self) -> None:
+        """Start collecting changes and note the log position.
+
+        Called before the indexes are built, so writes made while they
+        build are applied afterwards rather than lost.
+        """
+        self.enabled = True
+        self.watermark = datetime.utcnow()
+        if self.uses_log:
+            async with AsyncSessionLocal() as db:
+                self.log_position = await self.position(db)
+
+    async def position(self, db: AsyncSession) -> int:
+        """Log position an index built from the tables now is current to.
+
+        Writes still in flight hold ids below the newest entry and commit
+        after the build has read the tables, so the position stays below
+        any gap among entries of the last ``CHANGE_FEED_GAP_TIMEOUT``
+        seconds; reading from it applies those writes once they commit.
+        """
+        rows = (await db.execute(
+            select(SearchChange.id, _recent())
+            .order_by(SearchChange.id.desc()).limit(CHANGE_FEED_BATCH_SIZE)
+        )).all()
+        if not rows:
+            return 0
+        position = rows[0][0]
+        for (newer, recent), (older, _) in zip(rows, rows[1:]):
+            if recent and newer != older + 1:
+                position = older
+        return position
+
+    def replay_from(self, position: int, built_at: datetime) -> None:
+        """Apply the log again from ``position``, for an index current as of then"""
+        if self.log_position is None or position < self.log_position:
+            self.log_position = position
+        if self.watermark is None or built_at < self.watermark:
+            self.watermark = built_at
+
+    async def start(self) -> None:
+        """Apply changes in the background from now on"""
+        if self._task is not None:
+            return
+        if not self.enabled:
+            await self.mark()
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        # Catch up right away on changes made while the indexes were loading
+        self._wake.set()
+        if self.uses_log:
+            await self._listen()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listener is not None:
+            driver_connection = (await self._listener.get_raw_connection()).driver_connection
+            await driver_connection.remove_listener(CHANNEL, self._notify)
+            await self._listener.close()
+            self._listener = None
+
+    async def _listen(self) -> None:
+        """Wake on NOTIFY from the log triggers; without it the feed polls"""
+        connection = await async_engine.connect()
+        try:
+            driver_connection = (await connection.get_raw_connection()).driver_connection
+            add_listener = getattr(driver_connection, "add_listener", None)
+            if add_listener is None:
+                await connection.close()
+                return
+            await add_listener(CHANNEL, self._notify)
+            self._listener = connection
+        except Exception as e:
+            logger.warning("Cannot listen for search changes, polling instead: %s", e)
+            await connection.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), CHANGE_FEED_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self.drain():
+                    pass
+            except Exception as e:
+                logger.error("Applying search changes failed: %s", e, exc_info=True)
+            await asyncio.sleep(CHANGE_FEED_INTERVAL)
+
+    async def drain(self) -> bool:
+        """Apply one micro-batch; True when the log has more to read right away"""
+        started = datetime.utcnow()
+        with self._lock:
+            changes, self._pending = self._pending, {}
+
+        more = False
+        async with AsyncSessionLocal() as db:
+            if self.uses_log:
+                more = await self._read_log(db, changes)
+
+            try:
+                for result_type, ids in changes.items():
+                    ids = sorted(ids)
+                    for start in range(0, len(ids), CHANGE_FEED_BATCH_SIZE):
+                        chunk = set(ids[start:start + CHANGE_FEED_BATCH_SIZE])
+                        for handler in self._handlers:
+                            await handler(db, result_type, chunk)
+            except Exception:
+                # Every change goes back in the queue; re-applying one that
+                # was applied already does no harm
+                self.publish(changes)
+                raise
+            for callback in self._batch_callbacks:
+                callback(changes)
+
+            if self.uses_log:
+                await self._prune(db)
+
+        if changes:
+            self.batches += 1
+            self.applied += sum(len(ids) for ids in changes.values())
+        if not more and not self._gaps:
+            self.watermark = started
+        return more
+
+    async def _read_log(self, db: AsyncSession, changes: Changes) -> bool:
+        """Add log entries past the position and gaps filled since to changes"""
+        columns = (SearchChange.id, SearchChange.entity, SearchChange.row_id)
+        rows = (await db.execute(
+            select(*columns, _recent()).filter(SearchChange.id > self.log_position)
+            .order_by(SearchChange.id).limit(CHANGE_FEED_BATCH_SIZE)
+        )).all()
+
+        # Ids are taken when a write runs but become visible when it commits,
+        # so a skipped id may be a write still in flight
+        now = time.monotonic()
+        self._gaps = {
+            change_id: seen for change_id, seen in self._gaps.items()
+            if now - seen < CHANGE_FEED_GAP_TIMEOUT
+        }
+        if self._gaps:
+            waiting = sorted(self._gaps)[:CHANGE_FEED_BATCH_SIZE]
+            filled = (await db.execute(select(*columns).filter(SearchChange.id.in_(waiting)))).all()
+            for change_id, result_type, row_id in filled:
+                del self._gaps[change_id]
+                changes.setdefault(result_type, set()).add(row_id)
+
+        for change_id, result_type, row_id, recent in rows:
+            # Gaps below entries older than the timeout are settled, as in
+            # position(); a snapshot replaying the log meets many of them
+            if recent:
+                for missing in range(self.log_position + 1, change_id):
+                    self._gaps[missing] = now
+            self.log_position = change_id
+            changes.setdefault(result_type, set()).add(row_id)
+        return len(rows) == CHANGE_FEED_BATCH_SIZE
+
+    async def _prune(self, db: AsyncSession) -> None:
+        """Drop log entries past retention, about once an hour"""
+        if time.monotonic() - self._pruned_at < 3600:
+            return
+        self._pruned_at = time.monotonic()
+        await db.execute(delete(SearchChange).filter(
+            SearchChange.changed_at < func.now() - func.make_interval(
+                0, 0, 0, 0, 0, 0, CHANGE_LOG_RETENTION_HOURS * 3600
+            )
+        ))
+        await db.commit()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(len(ids) for ids in self._pending.values())
+        return {
+            "running": self._task is not None,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "lag_seconds": (
+                round((datetime.utcnow() - self.watermark).total_seconds(), 3)
+                if self.watermark else None
+            ),
+            "log_position": self.log_position,
+            "listening": self._listener is not None,
+            "gaps": len(self._gaps),
+            "pending": pending,
+            "batches": self.batches,
+            "applied": self.applied,
+        }
+
+
+change_feed = ChangeFeed()
+
+
+def _recent():
+    """Whether a log entry was written within the last ``CHANGE_FEED_GAP_TIMEOUT`` seconds"""
+    return SearchChange.changed_at >= func.now() - func.make_interval(
+        0, 0, 0, 0, 0, 0, CHANGE_FEED_GAP_TIMEOUT
+    )
+
+
+def _record(session: Optional[Session], result_type: str, ids) -> None:
+    if session is None:
+        return
+    changes = session.info.setdefault(SESSION_CHANGES, {})
+    changes.setdefault(result_type, set()).update(ids)
+
+
+def _row_listener(result_type: str):
+    def listener(mapper, connection, target):
+        _record(object_session(target), result_type, (target.id,))
+    return listener
+
+
+def _data_product_listener(mapper, connection, target):
+    # A data product moved between studies changes both
+    history = inspect(target).attrs.study_id.history
+    study_ids = {*(history.added or ()), *(history.deleted or ()), *(history.unchanged or ())}
+    study_ids.discard(None)
+    _record(object_session(target), "study", study_ids)
+
+
+for _model, _result_type in ((ClinicalStudy, "study"), (Indication, "indication"), (Procedure, "procedure")):
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _row_listener(_result_type))
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(DataProduct, _event, _data_product_listener)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    change_feed.publish(session.info.pop(SESSION_CHANGES, None))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop(SESSION_CHANGES, None)
@@ -0,0 +1,526 @@
+"""Columnar snapshot of the study tables for analytical search.
+
+``export_snapshot`` writes ``clinical_study`` and ``data_products`` to
+Parquet files. ``ColumnarStore`` loads them into an embedded DuckDB
+database, where /api/search matching, filtering, BM25F ranking (the
+formula of ``services/ranking.py``) and facet counts run as vectorized
+scans over the columns. It backs ``SEARCH_BACKEND=duckdb``, see
+``services/search_backend.py``.
+
+A snapshot is a point in time. Writes made after it are not searched
+until it is exported again (``python export_parquet.py``) and the
+application restarted.
+"""
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, select
+from sqlalchemy.engine import Connection, Engine
+
+from models.database_models import ClinicalStudy, DataProduct
+from services import ranking
+from services.query_parser import Node, Not, Or, Term, positive_terms, scoring_tokens
+from services.search_index import EQUALITY_FILTERS
+
+# Imported by _require_duckdb, so other backends do not pay for it at startup
+duckdb = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get(
+    "SEARCH_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "snapshot")
+)
+SNAPSHOT_TABLES: Tuple[Table, ...] = (ClinicalStudy.__table__, DataProduct.__table__)
+MANIFEST = "snapshot.json"
+
+# NULL marker in the intermediate CSV, so NULL and '' stay distinct
+CSV_NULL = "\\N"
+
+# Word tokens as ``services.query_parser.tokenize`` finds them (Python's \w)
+WORD_CHARACTER = r"[\pL\pN_]"
+SEPARATOR = r"[^\pL\pN_]"
+TOKEN_PATTERN = WORD_CHARACTER + "+"
+
+DUCKDB_TYPES = {
+    bool: "BOOLEAN",
+    int: "BIGINT",
+    float: "DOUBLE",
+    str: "VARCHAR",
+    datetime: "TIMESTAMP",
+    date: "DATE",
+}
+
+# Range filter parameter -> (column, comparison), as in ``apply_filters``
+RANGE_FILTERS = {
+    "start_date": ("start_date", ">="),
+    "end_date": ("end_date", "<="),
+    "min_duration": ("duration", ">="),
+    "max_duration": ("duration", "<="),
+}
+
+
+def _require_duckdb() -> None:
+    global duckdb
+    if duckdb is not None:
+        return
+    try:
+        import duckdb
+    except ImportError:  # pragma: no cover - duckdb is only needed for this backend
+        raise RuntimeError("The duckdb search backend needs the duckdb package: pip install duckdb") from None
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def duckdb_type(column) -> str:
+    try:
+        return DUCKDB_TYPES.get(column.type.python_type, "VARCHAR")
+    except NotImplementedError:
+        return "VARCHAR"
+
+
+def snapshot_path(directory: str, table_name: str) -> str:
+    return os.path.join(directory, f"{table_name}.parquet")
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """Creation time and row counts of the snapshot in ``directory``, if any"""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def dump_csv(connection: Connection, table: Table, path: str) -> None:
+    """Write a table to a headerless CSV file, with COPY on PostgreSQL"""
+    raw_cursor = connection.connection.cursor()
+    with open(path, "w", newline="") as handle:
+        if connection.dialect.name == "postgresql" and hasattr(raw_cursor, "copy_expert"):
+            quote = connection.dialect.identifier_preparer.quote
+            columns = ", ".join(quote(column.name) for column in table.columns)
+            try:
+                raw_cursor.copy_expert(
+                    f"COPY (SELECT {columns} FROM {quote(table.name)}) "
+                    f"TO STDOUT WITH (FORMAT csv, NULL '{CSV_NULL}')",
+                    handle
+                )
+            finally:
+                raw_cursor.close()
+            return
+
+        raw_cursor.close()
+        writer = csv.writer(handle)
+        rows = connection.execute(select(table).execution_options(stream_results=True, yield_per=10000))
+        for row in rows:
+            writer.writerow([
+                CSV_NULL if value is None else value.isoformat() if isinstance(value, datetime) else value
+                for value in row
+            ])
+
+
+def export_snapshot(bind: Engine, directory: str = SNAPSHOT_DIR) -> Dict[str, int]:
+    """Write the study tables to Parquet files in ``directory``.
+
+    Each table goes through a temporary CSV file (COPY on PostgreSQL),
+    which DuckDB converts to Parquet with the column types of the model.
+    Files are swapped in when complete, so a reader never sees half a
+    snapshot of a table. Returns the row count per table.
+    """
+    _require_duckdb()
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    counts = {}
+    converter = duckdb.connect()
+    try:
+        with bind.connect() as connection, tempfile.TemporaryDirectory(dir=directory) as scratch:
+            for table in SNAPSHOT_TABLES:
+                csv_path = os.path.join(scratch, f"{table.name}.csv")
+                parquet_path = os.path.join(scratch, f"{table.name}.parquet")
+                dump_csv(connection, table, csv_path)
+                columns = ", ".join(
+                    f"{_literal(column.name)}: {_literal(duckdb_type(column))}" for column in table.columns
+                )
+                converter.execute(
+                    f"COPY (SELECT * FROM read_csv({_literal(csv_path)}, header = false, "
+                    f"delim = ',', quote = '\"', escape = '\"', columns = {{{columns}}}, "
+                    f"nullstr = {_literal(CSV_NULL)}, allow_quoted_nulls = false) ORDER BY id) "
+                    f"TO {_literal(parquet_path)} (FORMAT parquet, COMPRESSION zstd)"
+                )
+                counts[table.name] = converter.execute(
+                    f"SELECT count(*) FROM read_parquet({_literal(parquet_path)})"
+                ).fetchone()[0]
+                os.replace(parquet_path, snapshot_path(directory, table.name))
+    finally:
+        converter.close()
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    with open(manifest_path + ".tmp", "w") as handle:
+        json.dump({"created_at": datetime.utcnow().isoformat(), "rows": counts}, handle)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    logger.info("Exported search snapshot %s to %s in %.1fs", counts, directory, time.perf_counter() - started)
+    return counts
+
+
+class ColumnarStore:
+    """A snapshot loaded into an in-memory DuckDB database.
+
+    Tables:
+        studies        the clinical_study columns, plus token counts of the
+                       title and description and the relevance prior
+        postings       one row per (token, study) with per-field frequencies,
+                       sorted by token so lookups skip most row groups
+        data_products  the data_products columns
+    """
+
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        _require_duckdb()
+        self.directory = directory
+        self.manifest: Optional[Dict[str, Any]] = None
+        self.document_count = 0
+        self.average_title_length = 1.0
+        self.average_description_length = 1.0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._connection is not None
+
+    def open(self, bind: Engine) -> None:
+        """Load the snapshot, exporting one from ``bind`` first if there is none"""
+        with self._lock:
+            if self._connection is not None:
+                return
+            if read_manifest(self.directory) is None:
+                export_snapshot(bind, self.directory)
+            self._load()
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        connection = duckdb.connect()
+        pattern = _literal(TOKEN_PATTERN)
+        prior = (
+            f"{ranking.PRIOR_WEIGHT} * ln(1 + greatest(coalesce(relevance_score, 0), 0))"
+        )
+        connection.execute(
+            f"CREATE TABLE studies AS SELECT *, "
+            f"len(regexp_extract_all(lower(coalesce(title, '')), {pattern})) AS title_length, "
+            f"len(regexp_extract_all(lower(coalesce(description, '')), {pattern})) AS description_length, "
+            f"{prior} AS prior "
+            f"FROM read_parquet({_literal(snapshot_path(self.directory, ClinicalStudy.__tablename__))})"
+        )
+        connection.execute(
+            f"CREATE TABLE data_products AS SELECT * "
+            f"FROM read_parquet({_literal(snapshot_path(self.directory, DataProduct.__tablename__))})"
+        )
+        connection.execute(f"""
+            CREATE TABLE postings AS
+            SELECT
+                token,
+                id,
+                count(*) FILTER (WHERE field = 0) AS title_tf,
+                count(*) FILTER (WHERE field = 1) AS description_tf
+            FROM (
+                SELECT id, 0 AS field, unnest(regexp_extract_all(lower(title), {pattern})) AS token FROM studies
+                UNION ALL
+                SELECT id, 1, unnest(regexp_extract_all(lower(description), {pattern})) FROM studies
+            )
+            GROUP BY token, id
+            ORDER BY token, id
+        """)
+        count, title_total, description_total = connection.execute(
+            "SELECT count(*), coalesce(sum(title_length), 0), coalesce(sum(description_length), 0) FROM studies"
+        ).fetchone()
+        # Same guards as InvertedIndex.average_lengths
+        self.document_count = count
+        self.average_title_length = max(title_total / (count or 1), 1.0)
+        self.average_description_length = max(description_total / (count or 1), 1.0)
+        self.manifest = read_manifest(self.directory)
+        self._connection = connection
+        logger.info(
+            "Loaded search snapshot from %s (%s studies, created %s) in %.1fs",
+            self.directory, count, (self.manifest or {}).get("created_at"), time.perf_counter() - started
+        )
+
+    def _cursor(self):
+        # DuckDB connections are not safe to share between threads; a
+        # cursor is a separate connection to the same database
+        return self._connection.cursor()
+
+    def _term_sql(self, term: Term) -> Tuple[str, List[Any]]:
+        """Ids containing every token of a term, adjacent when it is a phrase"""
+        field = f" AND {term.field}_tf > 0" if term.field else ""
+        last = len(term.tokens) - 1
+        selects, params = [], []
+        for position, token in enumerate(term.tokens):
+            comparison = "starts_with(token, ?)" if term.prefix and position == last else "token = ?"
+            selects.append(f"SELECT id FROM postings WHERE {comparison}{field}")
+            params.append(token)
+        sql = " INTERSECT ".join(selects)
+        if term.phrase:
+            # Tokens are runs of word characters, so they need no escaping
+            pattern = f"(^|{SEPARATOR})" + f"{SEPARATOR}+".join(term.tokens)
+            pattern += f"{WORD_CHARACTER}*" if term.prefix else f"($|{SEPARATOR})"
+            fields = (term.field,) if term.field else ("title", "description")
+            sql = (
+                f"SELECT id FROM studies WHERE id IN ({sql}) AND ("
+                + " OR ".join(f"regexp_matches(lower({name}), ?)" for name in fields)
+                + ")"
+            )
+            params += [pattern] * len(fields)
+        return sql, params
+
+    def _node_sql(self, node: Node) -> Tuple[str, List[Any]]:
+        """SQL selecting the ids that match a query node, and its parameters"""
+        if isinstance(node, Term):
+            return self._term_sql(node)
+        if isinstance(node, Not):
+            sql, params = self._node_sql(node.child)
+            return f"SELECT id FROM studies EXCEPT SELECT id FROM ({sql})", params
+        if isinstance(node, Or):
+            operands, negatives = node.children, []
+        else:
+            # Exclusions are subtracted from the intersection of the rest
+            operands = [child for child in node.children if not isinstance(child, Not)]
+            negatives = [child.child for child in node.children if isinstance(child, Not)]
+        parts, params = [], []
+        for child in operands:
+            sql, child_params = self._node_sql(child)
+            parts.append(f"SELECT id FROM ({sql})")
+            params += child_params
+        sql = (" UNION " if isinstance(node, Or) else " INTERSECT ").join(parts) or "SELECT id FROM studies"
+        for child in negatives:
+            child_sql, child_params = self._node_sql(child)
+            sql = f"SELECT id FROM ({sql}) EXCEPT SELECT id FROM ({child_sql})"
+            params += child_params
+        return sql, params
+
+    def _match(self, query: Optional[Node]) -> Tuple[Optional[str], List[Any], List[str]]:
+        """SQL selecting the ids that match a parsed query, its parameters and the tokens to score by.
+
+        Matching follows ``InvertedIndex.match`` and the tokens
+        ``InvertedIndex.query_tokens``. Without a query the SQL is None and
+        every study matches.
+        """
+        if query is None:
+            return None, [], []
+        sql, params = self._node_sql(query)
+        tokens = scoring_tokens(query)
+        prefixes = [term.tokens[-1] for term in positive_terms(query) if term.prefix]
+        if prefixes:
+            cursor = self._cursor()
+            try:
+                for prefix in prefixes:
+                    tokens.update(row[0] for row in cursor.execute(
+                        "SELECT DISTINCT token FROM postings WHERE starts_with(token, ?)", [prefix]
+                    ).fetchall())
+            finally:
+                cursor.close()
+        return sql, params, sorted(tokens)
+
+    @staticmethod
+    def _filters(filters: Dict[str, Any], equality: bool = True) -> Tuple[List[str], List[Any]]:
+        """WHERE conditions and parameters for the /api/search filters"""
+        conditions, params = [], []
+        if equality:
+            for field in EQUALITY_FILTERS:
+                if filters.get(field):
+                    conditions.append(f"{field} = ?")
+                    params.append(filters[field])
+        for name, (column, comparison) in RANGE_FILTERS.items():
+            if filters.get(name):
+                conditions.append(f"{column} {comparison} ?")
+                params.append(filters[name])
+        return conditions, params
+
+    def _ranked(self, query: Optional[Node], filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """CTEs ending in ``ranked`` (id, score, total) over every matching study, and their parameters"""
+        match_sql, params, tokens = self._match(query)
+        conditions, filter_params = self._filters(filters)
+        if match_sql is not None:
+            conditions.insert(0, "id IN (SELECT id FROM matched)")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params = params + filter_params
+
+        sql = f"WITH {'matched AS (' + match_sql + '), ' if match_sql else ''}"
+        sql += f"candidates AS (SELECT id, prior, title_length, description_length FROM studies {where})"
+        if tokens:
+            placeholders = ", ".join("?" * len(tokens))
+            sql += f""",
+            frequencies AS (
+                SELECT token, count(*) AS df FROM postings WHERE token IN ({placeholders}) GROUP BY token
+            ),
+            weighted AS (
+                SELECT
+                    p.id,
+                    p.token,
+                    {ranking.TITLE_BOOST} * p.title_tf
+                        / (1 - {ranking.B} + {ranking.B} * c.title_length / ?)
+                    + {ranking.DESCRIPTION_BOOST} * p.description_tf
+                        / (1 - {ranking.B} + {ranking.B} * c.description_length / ?) AS tf
+                FROM postings p JOIN candidates c ON c.id = p.id
+                WHERE p.token IN ({placeholders})
+            ),
+            text_scores AS (
+                SELECT
+                    w.id,
+                    sum(
+                        ln(1 + (? - f.df + 0.5) / (f.df + 0.5))
+                        * w.tf * ({ranking.K1} + 1) / (w.tf + {ranking.K1})
+                    ) AS score
+                FROM weighted w JOIN frequencies f ON f.token = w.token
+                GROUP BY w.id
+            )"""
+            params += tokens + [self.average_title_length, self.average_description_length]
+            params += tokens + [self.document_count]
+            score = "c.prior + coalesce(t.score, 0)"
+            scored_from = "candidates c LEFT JOIN text_scores t ON t.id = c.id"
+        else:
+            score = "c.prior"
+            scored_from = "candidates c"
+        # Rounded so a score read back from a cursor compares equal, whatever
+        # order the parallel sum added its terms in
+        sql += f""",
+            ranked AS (
+                SELECT c.id, round({score}, 9) AS score, count(*) OVER () AS total FROM {scored_from}
+            )
+        """
+        return sql, params
+
+    def search(
+        self,
+        query: Optional[Node],
+        filters: Dict[str, Any],
+        page: int,
+        per_page: int,
+        after: Optional[Tuple[float, int]] = None
+    ) -> Tuple[List[Tuple[int, float]], int, bool]:
+        """Rank matching studies; returns the page's (id, score) pairs, the total and has_more"""
+        sql, params = self._ranked(query, filters)
+        page_sql, page_params = sql + "SELECT id, score, total FROM ranked ", list(params)
+        if after is not None:
+            page_sql += "WHERE score < ? OR (score = ? AND id > ?) "
+            page_params += [after[0], after[0], after[1]]
+        page_sql += "ORDER BY score DESC, id LIMIT ?"
+        page_params.append(per_page + 1)
+        if after is None:
+            page_sql += " OFFSET ?"
+            page_params.append((page - 1) * per_page)
+
+        cursor = self._cursor()
+        try:
+            rows = cursor.execute(page_sql, page_params).fetchall()
+            if rows:
+                total = rows[0][2]
+            elif after is None and page == 1:
+                total = 0
+            else:
+                # Past the last page there is no row to carry the window count
+                total = cursor.execute(sql + "SELECT count(*) FROM ranked", params).fetchone()[0]
+        finally:
+            cursor.close()
+        hits = [(row[0], float(row[1])) for row in rows[:per_page]]
+        return hits, total, len(rows) > per_page
+
+    def stream(
+        self,
+        query: Optional[Node],
+        filters: Dict[str, Any],
+        columns: Sequence[str],
+        batch_size: int = 1000
+    ) -> Iterator[List[Tuple]]:
+        """Yield every matching study as (columns..., score) tuples in ranking order, a batch at a time"""
+        sql, params = self._ranked(query, filters)
+        sql += (
+            f"SELECT {', '.join(f's.{column}' for column in columns)}, r.score "
+            f"FROM ranked r JOIN studies s ON s.id = r.id ORDER BY r.score DESC, r.id"
+        )
+        cursor = self._cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def facet_rows(self, query: Optional[Node], filters: Dict[str, Any]) -> List[Tuple]:
+        """Facet counts as rows of (values..., groupings..., counts...) per filter field.
+
+        Rows have the layout of ``PostgresSearchBackend.facet_query``: the
+        match and range filters narrow the rows, GROUPING SETS groups them by
+        each field, and a field's count applies the other fields' selections.
+        """
+        match_sql, params, _ = self._match(query)
+        conditions, filter_params = self._filters(filters, equality=False)
+        if match_sql is not None:
+            conditions.insert(0, "id IN (SELECT id FROM matched)")
+
+        counts, count_params = [], []
+        for field in EQUALITY_FILTERS:
+            others = [other for other in EQUALITY_FILTERS if other != field and filters.get(other)]
+            if others:
+                counts.append(f"count(*) FILTER (WHERE {' AND '.join(f'{other} = ?' for other in others)})")
+                count_params.extend(filters[other] for other in others)
+            else:
+                counts.append("count(*)")
+
+        sql = f"WITH matched AS ({match_sql}) " if match_sql else ""
+        sql += (
+            f"SELECT {', '.join(EQUALITY_FILTERS)}, "
+            f"{', '.join(f'GROUPING({field})' for field in EQUALITY_FILTERS)}, "
+            f"{', '.join(counts)} FROM studies"
+        )
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += f" GROUP BY GROUPING SETS ({', '.join(f'({field})' for field in EQUALITY_FILTERS)})"
+
+        cursor = self._cursor()
+        try:
+            # Placeholders appear as: matched, then the counts, then WHERE
+            return cursor.execute(sql, params + count_params + filter_params).fetchall()
+        finally:
+            cursor.close()
+
+    def result_rows(
+        self,
+        ids: Sequence[int],
+        study_columns: Sequence[str],
+        product_columns: Sequence[str]
+    ) -> Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Columns of each study in ids, with its data products' columns ordered by id"""
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" * len(ids))
+        cursor = self._cursor()
+        try:
+            study_rows = cursor.execute(
+                f"SELECT {', '.join(study_columns)} FROM studies WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+            product_rows = cursor.execute(
+                f"SELECT study_id, {', '.join(product_columns)} FROM data_products "
+                f"WHERE study_id IN ({placeholders}) ORDER BY id", list(ids)
+            ).fetchall()
+        finally:
+            cursor.close()
+
+        products: Dict[int, List[Dict[str, Any]]] = {}
+        for row in product_rows:
+            products.setdefault(row[0], []).append(dict(zip(product_columns, row[1:])))
+        results = {}
+        for row in study_rows:
+            study = dict(zip(study_columns, row))
+            results[study["id"]] = (study, products.get(study["id"], []))
+        return results
@@ -0,0 +1,204 @@
+"""Streaming exports in NDJSON, CSV and Parquet.
+
+An encoder turns batches of row tuples into bytes as they arrive, so an
+export is sent while it is read from the database and the worker holds
+one batch (for Parquet, one row group) at a time. ``export_response``
+wraps a batch iterator in a ``StreamingResponse``. Starlette awaits each
+chunk's send before asking for the next batch, so a slow client slows
+the database cursor instead of filling the worker's memory.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+# Imported by _load_pyarrow on the first Parquet export, as it is slow to import
+pyarrow = None
+
+# (name, Python type) of each exported column
+Columns = Sequence[Tuple[str, type]]
+
+
+def _text(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+class NDJSONEncoder:
+    """One JSON object per line"""
+
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, columns: Columns):
+        self.names = [name for name, _ in columns]
+
+    def begin(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(self.names, map(_text, row))), separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode()
+
+    def end(self) -> bytes:
+        return b""
+
+
+class CSVEncoder:
+    """Comma-separated values with a header row; NULL is an empty field"""
+
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, columns: Columns):
+        self.names = [name for name, _ in columns]
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def begin(self) -> bytes:
+        self._writer.writerow(self.names)
+        return self._drain()
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        self._writer.writerows([_text(value) for value in row] for row in rows)
+        return self._drain()
+
+    def end(self) -> bytes:
+        return b""
+
+
+class ParquetEncoder:
+    """Parquet file written one row group at a time.
+
+    Rows are buffered until a row group is full; the file footer, with the
+    metadata of every row group, comes last.
+    """
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+    row_group_size = 10000
+
+    ARROW_TYPES = {
+        bool: "bool_",
+        int: "int64",
+        float: "float64",
+        str: "string",
+        datetime: "timestamp",
+        date: "date32",
+    }
+
+    def __init__(self, columns: Columns):
+        fields = []
+        for name, python_type in columns:
+            factory = getattr(pyarrow, self.ARROW_TYPES.get(python_type, "string"))
+            fields.append(pyarrow.field(name, factory("us") if python_type is datetime else factory()))
+        self.schema = pyarrow.schema(fields)
+        self._sink = io.BytesIO()
+        self._writer = None
+        self._rows: List[Tuple] = []
+
+    def _drain(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def _write_row_group(self) -> None:
+        columns = list(zip(*self._rows))
+        self._writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+        self._rows = []
+
+    def begin(self) -> bytes:
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self.schema, compression="zstd")
+        return self._drain()
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        self._rows.extend(rows)
+        if len(self._rows) < self.row_group_size:
+            return b""
+        self._write_row_group()
+        return self._drain()
+
+    def end(self) -> bytes:
+        if self._rows:
+            self._write_row_group()
+        self._writer.close()
+        return self._drain()
+
+
+ENCODERS: Dict[str, Type] = {
+    "ndjson": NDJSONEncoder,
+    "csv": CSVEncoder,
+    "parquet": ParquetEncoder,
+}
+
+
+def column_types(table_columns) -> List[Tuple[str, type]]:
+    """(name, Python type) pairs for SQLAlchemy columns"""
+    types = []
+    for column in table_columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = str
+        types.append((column.name, python_type))
+    return types
+
+
+async def _encode(encoder, batches: AsyncIterator[List[Tuple]]) -> AsyncIterator[bytes]:
+    yield encoder.begin()
+    async for batch in batches:
+        chunk = encoder.encode(batch)
+        if chunk:
+            yield chunk
+    yield encoder.end()
+
+
+def _load_pyarrow() -> bool:
+    """Whether pyarrow is available, importing it if needed"""
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # pragma: no cover - pyarrow is only needed for Parquet exports
+            return False
+    return True
+
+
+def export_response(
+    export_format: str,
+    columns: Columns,
+    batches: AsyncIterator[List[Tuple]],
+    filename: str,
+    headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """Stream row batches as a file download in the requested format"""
+    if export_format == "parquet" and not _load_pyarrow():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export needs the pyarrow package"
+        )
+    encoder = ENCODERS[export_format](columns)
+    return StreamingResponse(
+        _encode(encoder, batches),
+        media_type=encoder.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{encoder.extension}"',
+            **(headers or {}),
+        }
+    )
@@ -0,0 +1,163 @@
+"""Worker startup from memory-mapped index snapshots.
+
+Building an in-process index reads and tokenizes every row it covers, so
+startup time grows with the corpus and every worker holds its own copy.
+With ``INDEX_SNAPSHOT_DIR`` set, each index is written once to a snapshot
+file there (see ``services/snapshot_file.py``) and workers serve it
+memory-mapped read-only. Opening a snapshot costs the same at any corpus
+size, and its pages are shared by every worker on the host.
+
+A snapshot records the change log position it was built at, and a worker
+that opens it replays the log from there through
+``services/change_feed.py``. Snapshots are therefore only used on Postgres,
+with the change log of ``migrations/006_search_changes.sql``. An index is
+rebuilt from the tables, and its snapshot replaced, when the file is
+missing or unreadable, was built from another database, or the log no
+longer covers it: it is older than the log retention, or more than
+``INDEX_SNAPSHOT_MAX_REPLAY`` changes were logged since. Workers starting
+together build a snapshot once; the others wait for the file.
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SQLALCHEMY_DATABASE_URL
+from models.database_models import SearchChange
+from services.change_feed import CHANGE_LOG_RETENTION_HOURS, change_feed
+from services.snapshot_file import SnapshotError, read_header
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no file locks on Windows; workers may build concurrently
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Where snapshots are kept; unset disables them
+INDEX_SNAPSHOT_DIR = os.environ.get("INDEX_SNAPSHOT_DIR")
+
+# Logged changes a snapshot may be behind before it is rebuilt instead of replayed
+INDEX_SNAPSHOT_MAX_REPLAY = int(os.environ.get("INDEX_SNAPSHOT_MAX_REPLAY", "100000"))
+
+
+# Index name -> where this worker's copy came from, for /api/health
+_warmed: Dict[str, Dict[str, Any]] = {}
+
+
+def snapshots_enabled() -> bool:
+    return INDEX_SNAPSHOT_DIR is not None and change_feed.uses_log
+
+
+def snapshot_path(name: str) -> str:
+    return os.path.join(INDEX_SNAPSHOT_DIR, f"{name}.idx")
+
+
+def database_identity() -> str:
+    """The database URL without its password, recorded in every snapshot"""
+    return make_url(SQLALCHEMY_DATABASE_URL).render_as_string(hide_password=True)
+
+
+@asynccontextmanager
+async def _exclusive(path: str) -> AsyncIterator[None]:
+    """Hold the lock file of a snapshot, so one worker at a time builds it"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as handle:
+        # Waiting for another worker's build must not block the event loop
+        await asyncio.to_thread(fcntl.flock, handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+async def _stale(db: AsyncSession, metadata: Dict[str, Any]) -> Optional[str]:
+    """Why a snapshot cannot be brought up to date from the log, None if it can"""
+    if metadata.get("database") != database_identity():
+        return "it was built from another database"
+    built_at = datetime.fromisoformat(metadata["built_at"])
+    if datetime.utcnow() - built_at > timedelta(hours=CHANGE_LOG_RETENTION_HOURS):
+        return "the change log has been pruned since it was built"
+    position = metadata["log_position"]
+    oldest, behind = (await db.execute(
+        select(func.min(SearchChange.id), func.count(SearchChange.id).filter(SearchChange.id > position))
+    )).one()
+    if oldest is not None and oldest > position + 1:
+        return "the change log has been pruned since it was built"
+    if behind > INDEX_SNAPSHOT_MAX_REPLAY:
+        return f"{behind} changes were logged since it was built"
+    return None
+
+
+async def _load(db: AsyncSession, name: str, index: Any, path: str) -> bool:
+    """Serve index from its snapshot and replay the log since; False if it cannot be used"""
+    try:
+        metadata = read_header(path)["metadata"]
+    except SnapshotError as e:
+        if os.path.exists(path):
+            logger.warning("Ignoring %s index snapshot: %s", name, e)
+        return False
+    reason = await _stale(db, metadata)
+    if reason is not None:
+        logger.info("Rebuilding the %s index snapshot, %s", name, reason)
+        return False
+    try:
+        metadata = await asyncio.to_thread(index.load_snapshot, path)
+    except (SnapshotError, KeyError) as e:
+        logger.warning("Ignoring %s index snapshot: %s", name, e)
+        return False
+    built_at = datetime.fromisoformat(metadata["built_at"])
+    change_feed.replay_from(metadata["log_position"], built_at)
+    _warmed[name] = {"source": "snapshot", "built_at": metadata["built_at"]}
+    return True
+
+
+async def warm_start(
+    db: AsyncSession,
+    name: str,
+    index: Any,
+    rebuild: Callable[[], Awaitable[None]]
+) -> None:
+    """Serve ``index`` from its snapshot, building and writing the snapshot when needed.
+
+    ``index`` has ``write_snapshot`` and ``load_snapshot`` methods, like
+    ``InvertedIndex`` and ``SuggestionIndex``. ``rebuild`` fills it from the
+    tables; without snapshots that is all this does.
+    """
+    if not snapshots_enabled():
+        await rebuild()
+        _warmed[name] = {"source": "tables", "built_at": datetime.utcnow().isoformat()}
+        return
+
+    path = snapshot_path(name)
+    async with _exclusive(path):
+        if await _load(db, name, index, path):
+            return
+        position = await change_feed.position(db)
+        built_at = datetime.utcnow().isoformat()
+        await rebuild()
+        await asyncio.to_thread(index.write_snapshot, path, {
+            "database": database_identity(),
+            "log_position": position,
+            "built_at": built_at,
+        })
+        # Serve from the file like the other workers, which frees the built copy
+        if not await _load(db, name, index, path):
+            _warmed[name] = {"source": "tables", "built_at": built_at}
+
+
+def status() -> Dict[str, Any]:
+    """Snapshot directory and where each index of this worker came from"""
+    return {
+        "directory": INDEX_SNAPSHOT_DIR if snapshots_enabled() else None,
+        "indexes": dict(_warmed),
+    }
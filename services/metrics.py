@@ -0,0 +1,335 @@
+"""Per-request performance metrics.
+
+``MetricsMiddleware`` opens a ``RequestMetrics`` for every HTTP request and
+keeps it in a context variable. Engine cursor events add database time
+and statement counts to it, rows are counted as they are fetched, ``InstrumentedRoute`` marks where the
+endpoint returned so serialization can be timed separately, and the caches
+report hits and misses. When the response starts the totals are sent as a
+``Server-Timing`` header; when it ends they are folded into the histograms
+served in Prometheus text format at ``/api/metrics``.
+"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    """Counters collected while serving one request"""
+
+    __slots__ = (
+        "started", "endpoint_finished", "db_time", "queries", "rows",
+        "cache_hits", "cache_misses",
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint_finished: Optional[float] = None
+        self.db_time = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def current_metrics() -> Optional[RequestMetrics]:
+    """Metrics of the request being served, if any"""
+    return _current.get()
+
+
+def record_cache_lookup(hit: bool) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._metrics_started = time.perf_counter()
+
+
+class _CountingCursor:
+    """DBAPI cursor that adds the rows fetched through it to a request's metrics"""
+
+    __slots__ = ("_cursor", "_metrics")
+
+    def __init__(self, cursor, metrics: RequestMetrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._metrics.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._metrics.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._metrics.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current.get()
+    started = getattr(context, "_metrics_started", None)
+    if metrics is None or started is None:
+        return
+    metrics.db_time += time.perf_counter() - started
+    metrics.queries += 1
+    # Drivers report no row count for SELECT (sqlite3 and asyncpg give -1),
+    # so the result reads its rows through a cursor that counts them
+    if cursor.description is not None:
+        context.cursor = _CountingCursor(cursor, metrics)
+
+
+def instrument_engine(engine) -> None:
+    """Attribute the statements an engine runs to the current request"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class InstrumentedRoute(APIRoute):
+    """Route that records when its endpoint returns.
+
+    Whatever happens between that and the response starting is response
+    validation and serialization.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = _mark_finish(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _mark_finish(endpoint):
+    @functools.wraps(endpoint)
+    async def timed_endpoint(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            metrics = _current.get()
+            if metrics is not None:
+                metrics.endpoint_finished = time.perf_counter()
+    return timed_endpoint
+
+
+class Histogram:
+    """Cumulative histogram with one series per label set"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        # Per label set: bucket counts (last one is +Inf), sum, count
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted(self._series.items())
+        for labels, (bucket_counts, total, count) in series_items:
+            label_text = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels)
+            )
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with one series per label set"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            label_text = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels)
+            )
+            lines.append(f"{self.name}{{{label_text}}} {value:g}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Request metrics aggregated per route"""
+
+    def __init__(self):
+        labels = ("method", "route")
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Time from request to end of response", LATENCY_BUCKETS, labels
+        )
+        self.db_duration = Histogram(
+            "http_request_db_seconds", "Database time spent per request", LATENCY_BUCKETS, labels
+        )
+        self.serialize_duration = Histogram(
+            "http_request_serialize_seconds", "Response validation and serialization time per request",
+            LATENCY_BUCKETS, labels
+        )
+        self.queries = Histogram(
+            "http_request_db_queries", "SQL statements executed per request", COUNT_BUCKETS, labels
+        )
+        self.requests = Counter("http_requests_total", "Requests served", labels + ("status",))
+        self.rows = Counter("http_request_db_rows_total", "Rows fetched from the database", labels)
+        self.cache_lookups = Counter("http_request_cache_lookups_total", "Result cache lookups", labels + ("result",))
+
+    def observe(self, method: str, route: str, status: int, metrics: RequestMetrics, finished: float,
+                serialize_time: Optional[float]) -> None:
+        labels = (method, route)
+        self.request_duration.observe(labels, finished - metrics.started)
+        self.db_duration.observe(labels, metrics.db_time)
+        self.queries.observe(labels, metrics.queries)
+        if serialize_time is not None:
+            self.serialize_duration.observe(labels, serialize_time)
+        self.requests.inc(labels + (str(status),))
+        if metrics.rows:
+            self.rows.inc(labels, metrics.rows)
+        if metrics.cache_hits:
+            self.cache_lookups.inc(labels + ("hit",), metrics.cache_hits)
+        if metrics.cache_misses:
+            self.cache_lookups.inc(labels + ("miss",), metrics.cache_misses)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (
+            self.request_duration, self.db_duration, self.serialize_duration,
+            self.queries, self.requests, self.rows, self.cache_lookups,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def server_timing(metrics: RequestMetrics, now: float) -> str:
+    """Server-Timing header value for the request so far"""
+    total = now - metrics.started
+    entries = [
+        f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries, {metrics.rows} rows"'
+    ]
+    if metrics.endpoint_finished is not None:
+        entries.append(f"app;dur={(metrics.endpoint_finished - metrics.started - metrics.db_time) * 1000:.2f}")
+        entries.append(f"serialize;dur={(now - metrics.endpoint_finished) * 1000:.2f}")
+    if metrics.cache_hits or metrics.cache_misses:
+        entries.append(f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"')
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def route_label(scope) -> str:
+    """Path template of the matched route, e.g. ``/api/collections/{collection_id}/items``.
+
+    Labelling by template keeps ids in paths from multiplying series.
+    Included routers only know their path without the prefix, so the
+    template is rebuilt from the request path and its path parameters.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    if not isinstance(route, APIRoute):
+        return getattr(route, "path", None) or "unmatched"
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{names[segment]}}}" if segment in names else segment
+        for segment in scope["path"].split("/")
+    )
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times requests and reports them"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        response_started: Dict[str, float] = {}
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                response_started["at"] = now
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(metrics, now).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            serialize_time = None
+            if metrics.endpoint_finished is not None and "at" in response_started:
+                serialize_time = response_started["at"] - metrics.endpoint_finished
+            registry.observe(
+                scope["method"],
+                route_label(scope),
+                status_code,
+                metrics,
+                time.perf_counter(),
+                serialize_time
+            )
@@ -0,0 +1,181 @@
+"""Search across studies, indications and procedures at once.
+
+/api/search fans a query out to one index per result type: studies go
+through the configured ``SearchBackend``, indications and procedures
+through ``get_entity_backend`` (see ``services/search_backend.py``). The
+indexes picked by ``category`` run concurrently, each on its own session,
+so a search takes about as long as its slowest index rather than the sum
+of them. An index is skipped when a filter is set that its table has no
+column for; ``status`` only narrows studies, for example.
+
+Each index returns its hits already ranked, and the lists are combined
+with a k-way heap merge ordered by score, then ``INDEX_TYPES`` order, then
+id. Cursors carry the type of the last hit so each index can resume at
+the same position in that order.
+"""
+import asyncio
+import heapq
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from services.query_parser import Node
+from services.search_backend import (
+    ENTITIES, SearchBackend, SearchPage, get_entity_backend, get_search_backend
+)
+from services.serialization import StudyFragment
+
+# Result types in tie-breaking order
+INDEX_TYPES = ("study", "indication", "procedure")
+
+# SearchQuery.category -> result types searched
+CATEGORY_INDEXES = {
+    "all": INDEX_TYPES,
+    "studies": ("study",),
+    "indications": ("indication",),
+    "procedures": ("procedure",),
+}
+
+# Largest Integer primary key; resuming after it skips every row of a score
+MAX_ID = 2 ** 31 - 1
+
+
+class MultiPage(NamedTuple):
+    """One page of hits merged across indexes"""
+    total: int
+    # (type, id, score) in ranking order
+    hits: List[Tuple[str, int, float]]
+    has_more: bool
+    total_is_exact: bool = True
+    # Study facets, when studies were searched and facets asked for
+    facets: Optional[Dict[str, Dict[str, int]]] = None
+
+
+def index_backend(index_type: str) -> SearchBackend:
+    if index_type == "study":
+        return get_search_backend()
+    return get_entity_backend(index_type)
+
+
+def searched_types(category: Optional[str], filters: Dict[str, Any]) -> List[str]:
+    """Result types a search hits: those of the category whose tables support the filters"""
+    return [
+        index_type for index_type in CATEGORY_INDEXES[category or "all"]
+        if index_type == "study" or ENTITIES[index_type].supports(filters)
+    ]
+
+
+def resume_after(index_type: str, after: Tuple[float, str, int]) -> Tuple[float, int]:
+    """The (score, id) an index resumes after for a merged (score, type, id) position"""
+    score, after_type, after_id = after
+    rank, after_rank = INDEX_TYPES.index(index_type), INDEX_TYPES.index(after_type)
+    if rank < after_rank:
+        # Ties at the cursor's score were all returned already
+        return score, MAX_ID
+    if rank > after_rank:
+        # None of the ties at the cursor's score were returned yet
+        return score, -1
+    return score, after_id
+
+
+async def _search_index(
+    db: AsyncSession,
+    index_type: str,
+    *args: Any,
+    **kwargs: Any
+) -> SearchPage:
+    if index_type == "study":
+        return await index_backend(index_type).search(db, *args, **kwargs)
+    # Sessions cannot run statements concurrently, so each index gets its own
+    async with AsyncSessionLocal() as session:
+        return await index_backend(index_type).search(session, *args, **kwargs)
+
+
+async def search(
+    db: AsyncSession,
+    query: Optional[Node],
+    filters: Dict[str, Any],
+    category: Optional[str],
+    page: int,
+    per_page: int,
+    after: Optional[Tuple[float, str, int]] = None,
+    total_mode: str = "exact",
+    facets: bool = False
+) -> MultiPage:
+    """Search every index of ``category`` and merge their ranked hits.
+
+    Arguments are those of ``SearchBackend.search``, except that ``after``
+    holds the (score, type, id) of the last hit seen. Every index is asked
+    for enough hits to fill the page on its own, then the merge keeps the
+    best of them. A single index is searched with the page as given.
+    """
+    index_types = searched_types(category, filters)
+    if not index_types:
+        return MultiPage(0, [], False)
+
+    if len(index_types) == 1:
+        index_type = index_types[0]
+        index_after = resume_after(index_type, after) if after is not None else None
+        result = await _search_index(
+            db, index_type, query, filters, page, per_page, index_after, total_mode, facets
+        )
+        hits = [(index_type, doc_id, score) for doc_id, score in result.hits]
+        return MultiPage(result.total, hits, result.has_more, result.total_is_exact, result.facets)
+
+    # Hits before the requested page still take part in the merge
+    limit = per_page if after is not None else page * per_page
+    results = await asyncio.gather(*(
+        _search_index(
+            db, index_type, query, filters, 1, limit,
+            resume_after(index_type, after) if after is not None else None,
+            total_mode, facets and index_type == "study"
+        )
+        for index_type in index_types
+    ))
+
+    ranked = heapq.merge(
+        *(
+            [(-score, INDEX_TYPES.index(index_type), doc_id) for doc_id, score in result.hits]
+            for index_type, result in zip(index_types, results)
+        )
+    )
+    start = 0 if after is not None else (page - 1) * per_page
+    merged = list(ranked)
+    hits = [
+        (INDEX_TYPES[rank], doc_id, -negative_score)
+        for negative_score, rank, doc_id in merged[start:start + per_page]
+    ]
+    has_more = len(merged) > start + per_page or any(result.has_more for result in results)
+    return MultiPage(
+        sum(result.total for result in results),
+        hits,
+        has_more,
+        all(result.total_is_exact for result in results),
+        next((result.facets for result in results if result.facets is not None), None)
+    )
+
+
+async def _index_fragments(db: AsyncSession, index_type: str, ids: List[int]) -> Dict[int, StudyFragment]:
+    if index_type == "study":
+        return await index_backend(index_type).fragments(db, ids)
+    async with AsyncSessionLocal() as session:
+        return await index_backend(index_type).fragments(session, ids)
+
+
+async def fragments(
+    db: AsyncSession,
+    hits: List[Tuple[str, int, float]]
+) -> Dict[Tuple[str, int], StudyFragment]:
+    """Encoded results for hits keyed by (type, id), loaded per index concurrently"""
+    ids: Dict[str, List[int]] = {}
+    for index_type, doc_id, _ in hits:
+        ids.setdefault(index_type, []).append(doc_id)
+    loaded = await asyncio.gather(*(
+        _index_fragments(db, index_type, type_ids) for index_type, type_ids in ids.items()
+    ))
+    return {
+        (index_type, doc_id): fragment
+        for index_type, type_fragments in zip(ids, loaded)
+        for doc_id, fragment in type_fragments.items()
+    }
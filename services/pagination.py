@@ -0,0 +1,37 @@
+"""Opaque keyset pagination cursors.
+
+A cursor records the sort key of the last row a client has seen, so the
+next page is fetched with a seek predicate instead of an OFFSET that makes
+the database walk every earlier row again.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Encode a sort-key position as a URL-safe token"""
+    payload = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in position.items()
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, *keys: str) -> Dict[str, Any]:
+    """Decode a cursor token, requiring the given keys to be present"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(position, dict) or any(key not in position for key in keys):
+            raise ValueError("cursor is missing sort keys")
+        return position
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
@@ -0,0 +1,242 @@
+"""Boolean query language for /api/search.
+
+Grammar, loosest binding first::
+
+    query   := and_expr ("OR" and_expr)*
+    and_expr:= unary (["AND"] unary)*          adjacent terms are ANDed
+    unary   := "NOT" unary | primary
+    primary := "(" query ")" | field ":" primary | '"' words ["*"] '"' ["*"] | word ["*"]
+    field   := "title" | "description"
+
+Operators are only recognized in upper case, so ``and``/``or``/``not`` are
+ordinary words. A word is split into tokens the way indexed text is
+(``tokenize``) and matches a study containing all of them; a quoted phrase
+needs them adjacent and in order. A trailing ``*`` makes the last token a
+prefix. The parser is lenient: unbalanced
+parentheses and quotes are closed for the user and dangling operators are
+dropped.
+
+``parse_query`` returns a tree of ``Term``, ``And``, ``Or`` and ``Not``
+nodes, or None for blank input (match everything). Input that is not
+blank but has no searchable tokens, such as ``(((`` or ``AND OR NOT``,
+raises ``QueryError`` rather than matching everything.
+Backends compile the tree to their own plan, see ``services/search_index.py``,
+``services/columnar.py`` and ``services/search_backend.py``.
+"""
+import re
+from typing import List, NamedTuple, Optional, Set, Tuple, Union
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Searchable fields, numbered as in the index postings
+FIELDS = ("title", "description")
+
+_LEXER = re.compile(
+    r"""
+    (?P<lparen>\()
+    | (?P<rparen>\))
+    | (?P<field>title|description):(?=[("\w])
+    | "(?P<phrase>[^"]*)"?(?P<phrase_prefix>\*)?
+    | (?P<word>[^\s()"]+)
+    """,
+    re.VERBOSE | re.IGNORECASE
+)
+
+OPERATORS = ("AND", "OR", "NOT")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase word tokens, as indexed and as queried"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class QueryError(ValueError):
+    """A query with text but nothing to search for"""
+
+
+class Term(NamedTuple):
+    """Tokens that must all occur in a study, in ``field`` if set"""
+    tokens: Tuple[str, ...]
+    field: Optional[str] = None
+    # Tokens must be adjacent and in order
+    phrase: bool = False
+    # The last token matches any token starting with it
+    prefix: bool = False
+
+    def __str__(self) -> str:
+        text = " ".join(self.tokens)
+        text = f'"{text}"' if self.phrase else text
+        text += "*" if self.prefix else ""
+        return f"{self.field}:{text}" if self.field else text
+
+
+class And(NamedTuple):
+    children: Tuple["Node", ...]
+
+    def __str__(self) -> str:
+        return "(" + " AND ".join(sorted(map(str, self.children))) + ")"
+
+
+class Or(NamedTuple):
+    children: Tuple["Node", ...]
+
+    def __str__(self) -> str:
+        return "(" + " OR ".join(sorted(map(str, self.children))) + ")"
+
+
+class Not(NamedTuple):
+    child: "Node"
+
+    def __str__(self) -> str:
+        return f"NOT {self.child}"
+
+
+Node = Union[Term, And, Or, Not]
+
+
+def _lex(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    for match in _LEXER.finditer(text):
+        kind = match.lastgroup
+        if kind == "phrase_prefix":
+            kind = "phrase"
+        if kind == "word" and match.group("word") in OPERATORS:
+            tokens.append((match.group("word"), ""))
+        elif kind == "phrase":
+            tokens.append(("phrase", match.group(0)))
+        elif kind == "field":
+            tokens.append(("field", match.group("field").lower()))
+        else:
+            tokens.append((kind, match.group(0)))
+    return tokens
+
+
+def _term(text: str, field: Optional[str]) -> Optional[Term]:
+    quoted = text.startswith('"')
+    # "heart fail"* and "heart fail*" both make a prefix of the last token
+    prefix = text.rstrip('"').endswith("*")
+    tokens = tuple(tokenize(text))
+    if not tokens:
+        return None
+    return Term(tokens, field, quoted and len(tokens) > 1, prefix)
+
+
+def _combine(kind, children: List[Optional[Node]]) -> Optional[Node]:
+    """Build an And/Or, dropping empty children and flattening nested ones"""
+    flat: List[Node] = []
+    for child in children:
+        if child is None:
+            continue
+        if isinstance(child, kind):
+            flat.extend(child.children)
+        elif child not in flat:
+            flat.append(child)
+    if not flat:
+        return None
+    if len(flat) == 1:
+        return flat[0]
+    return kind(tuple(flat))
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _lex(text)
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self) -> Tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def query(self, nested: bool = False) -> Optional[Node]:
+        alternatives = [self.and_expr()]
+        while self.peek() is not None:
+            kind = self.peek()
+            if kind == "rparen" and nested:
+                break
+            # A stray closing parenthesis at the top level is ignored
+            self.take()
+            if kind == "OR":
+                alternatives.append(self.and_expr())
+            elif kind == "rparen":
+                alternatives[-1] = _combine(And, [alternatives[-1], self.and_expr()])
+        return _combine(Or, alternatives)
+
+    def and_expr(self) -> Optional[Node]:
+        operands = []
+        while self.peek() not in (None, "OR", "rparen"):
+            if self.peek() == "AND":
+                self.take()
+                continue
+            operands.append(self.unary())
+        return _combine(And, operands)
+
+    def unary(self) -> Optional[Node]:
+        if self.peek() == "NOT":
+            self.take()
+            if self.peek() in (None, "OR", "AND", "rparen"):
+                return None
+            child = self.unary()
+            if child is None:
+                return None
+            return child.child if isinstance(child, Not) else Not(child)
+        return self.primary(None)
+
+    def primary(self, field: Optional[str]) -> Optional[Node]:
+        kind, text = self.take()
+        if kind == "field":
+            if self.peek() in (None, "OR", "AND", "NOT", "rparen"):
+                return None
+            # The innermost field wins
+            return self.primary(text)
+        if kind == "lparen":
+            node = self.query(nested=True)
+            if self.peek() == "rparen":
+                self.take()
+            return _scope(node, field) if field else node
+        return _term(text, field)
+
+
+def _scope(node: Optional[Node], field: str) -> Optional[Node]:
+    """Restrict every unscoped term under node to field"""
+    if node is None:
+        return None
+    if isinstance(node, Term):
+        return node if node.field else node._replace(field=field)
+    if isinstance(node, Not):
+        return Not(_scope(node.child, field))
+    return type(node)(tuple(_scope(child, field) for child in node.children))
+
+
+def parse_query(text: str) -> Optional[Node]:
+    """Parse a search box query; None when it is blank.
+
+    Raises ``QueryError`` when the text has no searchable tokens.
+    """
+    node = _Parser(text).query()
+    if node is None and text.strip():
+        raise QueryError("The query has no searchable terms")
+    return node
+
+
+def positive_terms(node: Optional[Node]) -> List[Term]:
+    """Terms a study can match by, i.e. all terms not under a NOT; used for scoring"""
+    if node is None or isinstance(node, Not):
+        return []
+    if isinstance(node, Term):
+        return [node]
+    return [term for child in node.children for term in positive_terms(child)]
+
+
+def scoring_tokens(node: Optional[Node]) -> Set[str]:
+    """Tokens of ``positive_terms``, prefixes excluded"""
+    return {
+        token
+        for term in positive_terms(node)
+        for token in (term.tokens[:-1] if term.prefix else term.tokens)
+    }
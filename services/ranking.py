@@ -0,0 +1,73 @@
+"""Relevance ranking for study search results.
+
+Matches are scored with BM25F over the title and description fields, then
+blended with the stored ``ClinicalStudy.relevance_score`` as a prior.
+"""
+import heapq
+import math
+from typing import Dict, Iterable, List, Tuple
+
+from services.search_index import InvertedIndex
+
+# BM25 saturation and length normalization parameters
+K1 = 1.2
+B = 0.75
+
+# Per-field weights; these also set the Postgres ts_rank weights
+TITLE_BOOST = 2.0
+DESCRIPTION_BOOST = 1.0
+
+# Weight of log(1 + relevance_score) added to the text score
+PRIOR_WEIGHT = 0.5
+
+# Field boosts as a ts_rank weight array in {D, C, B, A} order; title terms
+# are weighted A and description terms B in the search_vector column
+TS_RANK_WEIGHTS = "{0, 0, %g, 1}" % (DESCRIPTION_BOOST / TITLE_BOOST)
+
+
+def prior(relevance_score: float) -> float:
+    """Contribution of the stored relevance score to the final score"""
+    return PRIOR_WEIGHT * math.log1p(max(relevance_score or 0.0, 0.0))
+
+
+def idf(document_count: int, document_frequency: int) -> float:
+    """BM25 inverse document frequency, kept positive for common terms"""
+    return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def score_documents(index: InvertedIndex, tokens: Iterable[str], doc_ids: Iterable[int]) -> Dict[int, float]:
+    """Score the given documents against each token, see ``InvertedIndex.query_tokens``"""
+    document_count = len(index)
+    average_title, average_description = index.average_lengths()
+
+    # Read once per document; a snapshot-backed index reads them from the file
+    fields = index.ranking_fields(doc_ids)
+    scores = {doc_id: prior(relevance_score) for doc_id, (_, _, relevance_score) in fields.items()}
+    for token in tokens:
+        postings = index.postings(token)
+        if not postings:
+            continue
+        token_idf = idf(document_count, len(postings))
+        # Walk whichever side is smaller: the candidates or the posting list
+        if len(scores) < len(postings):
+            pairs = ((doc_id, postings.get(doc_id)) for doc_id in scores)
+        else:
+            pairs = ((doc_id, tf) for doc_id, tf in postings.items() if doc_id in scores)
+        for doc_id, frequencies in pairs:
+            if frequencies is None:
+                continue
+            title_tf, description_tf = frequencies
+            title_length, description_length, _ = fields[doc_id]
+            weighted_tf = (
+                TITLE_BOOST * title_tf
+                / (1 - B + B * title_length / average_title)
+                + DESCRIPTION_BOOST * description_tf
+                / (1 - B + B * description_length / average_description)
+            )
+            scores[doc_id] += token_idf * weighted_tf * (K1 + 1) / (weighted_tf + K1)
+    return scores
+
+
+def top_k(scores: Dict[int, float], k: int) -> List[Tuple[int, float]]:
+    """Return the k best (doc_id, score) pairs, ties broken by ascending id"""
+    return heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
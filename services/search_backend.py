@@ -0,0 +1,737 @@
+"""Pluggable full-text search backends for /api/search.
+
+``PostgresSearchBackend`` matches against the ``clinical_study.search_vector``
+tsvector column (GIN indexed, see schema.sql). ``InMemorySearchBackend`` keeps
+an ``InvertedIndex`` in process for databases without native text search.
+Both return hits already ranked, see ``services/ranking.py``, as study ids
+and scores; ``SearchBackend.fragments`` then supplies each study's encoded
+result, from cache or from one projected query for the whole page.
+``DuckDBSearchBackend`` searches a columnar Parquet snapshot of the tables.
+The backend is picked from the ``SEARCH_BACKEND`` environment variable
+(``postgres``, ``memory`` or ``duckdb``) and otherwise from the engine dialect.
+
+Indications and procedures are searched by ``PostgresEntityBackend`` or
+``InMemoryEntityBackend``, the same engines pointed at another table; see
+``services/multi_index.py`` for how /api/search combines them.
+"""
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, engine
+from models.database_models import ClinicalStudy, DataProduct, Indication, Procedure
+from services import ranking
+from services.cache import LRUCache, search_cache, study_fragment_cache
+from services.change_feed import change_feed
+from services.columnar import RANGE_FILTERS, ColumnarStore
+from services.index_snapshots import warm_start
+from services.query_parser import And, Node, Not, Term
+from services.search_index import EQUALITY_FILTERS, InvertedIndex, rank_facet_counts
+from services.serialization import (
+    PRODUCT_COLUMNS, RESULT_COLUMNS, StudyFragment, encode_entity, encode_study
+)
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration used by the generated search_vector column
+TS_CONFIG = "english"
+
+SEARCH_VECTOR = literal_column("clinical_study.search_vector")
+
+# Weight labels of each field in search_vector, for field-scoped terms
+TS_FIELD_WEIGHTS = {"title": "A", "description": "B"}
+
+
+def apply_filters(query, filters: Dict[str, Any]):
+    """Apply the /api/search filter parameters to a ClinicalStudy select"""
+    if filters.get("status"):
+        query = query.filter(ClinicalStudy.status == filters["status"])
+    if filters.get("phase"):
+        query = query.filter(ClinicalStudy.phase == filters["phase"])
+    if filters.get("indication_category"):
+        query = query.filter(ClinicalStudy.indication_category == filters["indication_category"])
+    if filters.get("procedure_category"):
+        query = query.filter(ClinicalStudy.procedure_category == filters["procedure_category"])
+    if filters.get("severity"):
+        query = query.filter(ClinicalStudy.severity == filters["severity"])
+    if filters.get("risk_level"):
+        query = query.filter(ClinicalStudy.risk_level == filters["risk_level"])
+    if filters.get("start_date"):
+        query = query.filter(ClinicalStudy.start_date >= filters["start_date"])
+    if filters.get("end_date"):
+        query = query.filter(ClinicalStudy.end_date <= filters["end_date"])
+    if filters.get("min_duration"):
+        query = query.filter(ClinicalStudy.duration >= filters["min_duration"])
+    if filters.get("max_duration"):
+        query = query.filter(ClinicalStudy.duration <= filters["max_duration"])
+    return query
+
+
+class Entity(NamedTuple):
+    """A table searched next to clinical_study"""
+    # Reported as the result type
+    type: str
+    model: Any
+    # Study filter column -> the column of this table it applies to
+    filter_columns: Dict[str, Any]
+
+    def columns(self) -> Tuple[Any, ...]:
+        """Columns indexed and returned, labeled with the study filter they answer"""
+        return (
+            self.model.id,
+            self.model.title,
+            self.model.description,
+            self.model.relevance_score,
+            *(column.label(name) for name, column in self.filter_columns.items()),
+        )
+
+    def supports(self, filters: Dict[str, Any]) -> bool:
+        """Whether every filter set applies to this table; otherwise nothing in it matches"""
+        return all(
+            RANGE_FILTERS.get(name, (name,))[0] in self.filter_columns
+            for name, value in filters.items() if value
+        )
+
+    def apply_filters(self, query, filters: Dict[str, Any]):
+        """Apply the filters, which must be ``supports``-ed, to a select over the table"""
+        for name, value in filters.items():
+            if not value:
+                continue
+            if name in RANGE_FILTERS:
+                column, comparison = RANGE_FILTERS[name]
+                query = query.filter(self.filter_columns[column].op(comparison)(value))
+            else:
+                query = query.filter(self.filter_columns[name] == value)
+        return query
+
+
+ENTITIES = {
+    "indication": Entity("indication", Indication, {
+        "indication_category": Indication.category,
+        "severity": Indication.severity,
+    }),
+    "procedure": Entity("procedure", Procedure, {
+        "procedure_category": Procedure.category,
+        "risk_level": Procedure.risk_level,
+        "duration": Procedure.duration,
+    }),
+}
+
+
+# Study attributes written by exports, in order; the score follows them
+EXPORT_COLUMNS = (
+    "id",
+    "title",
+    "description",
+    "status",
+    "phase",
+    "indication_category",
+    "procedure_category",
+    "severity",
+    "risk_level",
+    "start_date",
+    "end_date",
+    "duration",
+)
+
+
+class SearchPage(NamedTuple):
+    """One page of ranked search hits"""
+    total: int
+    # (study id, score) in ranking order
+    hits: List[Tuple[int, float]]
+    has_more: bool
+    total_is_exact: bool = True
+    # Filter field -> {value: count}, only when the search asked for facets
+    facets: Optional[Dict[str, Dict[str, int]]] = None
+
+
+def query_key(query: Optional[Node], filters: Dict[str, Any]) -> Tuple:
+    """Canonical form of a search, independent of operand order and casing"""
+    return (
+        str(query) if query is not None else "",
+        tuple(sorted(
+            (name, str(value)) for name, value in filters.items() if value is not None
+        )),
+    )
+
+
+def search_cache_key(
+    query: Optional[Node],
+    filters: Dict[str, Any],
+    page: int,
+    per_page: int,
+    cursor: Optional[str],
+    total_mode: str,
+    facets: bool = False,
+    category: Optional[str] = None
+) -> str:
+    """Canonical cache key for one /api/search response"""
+    return json.dumps([query_key(query, filters), page, per_page, cursor, total_mode, facets, category])
+
+
+async def planner_row_estimate(db: AsyncSession, statement) -> int:
+    """Ask the Postgres planner how many rows a statement would return.
+
+    Only plans the statement, so it costs about as much as a cache lookup.
+    Values are rendered inline by the dialect because driver parameter
+    styles differ between psycopg2 and asyncpg.
+    """
+    connection = await db.connection()
+    compiled = statement.compile(
+        dialect=connection.dialect,
+        compile_kwargs={"literal_binds": True}
+    )
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+# Exact totals memoized per canonical query for total_mode=cached
+count_cache = LRUCache(
+    max_size=int(os.environ.get("SEARCH_COUNT_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("SEARCH_COUNT_CACHE_TTL", "300"))
+)
+search_cache.on_invalidate(count_cache.clear)
+
+
+def facet_counts_from_rows(rows) -> Dict[str, Dict[str, int]]:
+    """Arrange GROUPING SETS facet rows as field -> {value: count}.
+
+    Rows hold the filter values, then GROUPING() of each, then the counts,
+    all in ``EQUALITY_FILTERS`` order.
+    """
+    width = len(EQUALITY_FILTERS)
+    counts: Dict[str, Dict[str, int]] = {field: {} for field in EQUALITY_FILTERS}
+    for row in rows:
+        for position, field in enumerate(EQUALITY_FILTERS):
+            # Each row belongs to the grouping set of the one column
+            # whose GROUPING() is 0; NULL values are not offered
+            value = row[position]
+            if row[width + position] == 0 and value is not None:
+                count = row[2 * width + position]
+                if count:
+                    counts[field][value] = count
+    return {field: rank_facet_counts(values) for field, values in counts.items()}
+
+
+class SearchBackend(ABC):
+    """Interface shared by the search backends"""
+
+    name = "base"
+
+    async def warm_up(self, db: AsyncSession) -> None:
+        """Prepare any in-process state before the first request"""
+
+    async def apply_changes(self, db: AsyncSession, result_type: str, ids: Set[int]) -> None:
+        """Bring in-process state up to date with rows written since warm_up.
+
+        Called by ``services.change_feed`` with the ids of changed rows of
+        one result type; rows no longer in the table were deleted. Backends
+        that read the tables on every search have nothing to do.
+        """
+
+    @abstractmethod
+    async def search(
+        self,
+        db: AsyncSession,
+        query: Optional[Node],
+        filters: Dict[str, Any],
+        page: int,
+        per_page: int,
+        after: Optional[Tuple[float, int]] = None,
+        total_mode: str = "exact",
+        facets: bool = False
+    ) -> SearchPage:
+        """Return the ranked (study id, score) hits on the requested page.
+
+        ``query`` comes from ``services.query_parser.parse_query``; None
+        matches every study.
+
+        Hits are ordered by score descending, then id ascending. When
+        ``after`` holds the (score, id) of the last hit already seen, the
+        page starts right after it and ``page`` is ignored.
+
+        ``total_mode`` is ``exact``, ``estimate`` (cheap approximate total)
+        or ``cached`` (exact total memoized per query for a short TTL).
+
+        With ``facets``, the page also carries per-value counts for each
+        equality filter. The counts for a field ignore that field's own
+        selection, so they show what choosing another value would return.
+        """
+
+    @abstractmethod
+    def stream(
+        self,
+        db: AsyncSession,
+        query: Optional[Node],
+        filters: Dict[str, Any],
+        batch_size: int = 1000
+    ) -> AsyncIterator[List[Tuple]]:
+        """Yield every hit in ranking order as (``EXPORT_COLUMNS``..., score) tuples.
+
+        Rows come a batch at a time and are not tracked by the session, so
+        memory stays bounded however many studies match.
+        """
+
+    async def result_rows(
+        self,
+        db: AsyncSession,
+        ids: List[int]
+    ) -> Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """``RESULT_COLUMNS`` of each study in ids with its data products' ``PRODUCT_COLUMNS``.
+
+        Plain columns from one outer join, so no ORM objects are built and
+        the session's identity map stays empty.
+        """
+        width = len(RESULT_COLUMNS)
+        rows = await db.execute(
+            select(
+                *(getattr(ClinicalStudy, name) for name in RESULT_COLUMNS),
+                *(getattr(DataProduct, name).label(f"data_product_{name}") for name in PRODUCT_COLUMNS)
+            ).outerjoin(
+                DataProduct, DataProduct.study_id == ClinicalStudy.id
+            ).filter(ClinicalStudy.id.in_(ids)).order_by(ClinicalStudy.id, DataProduct.id)
+        )
+        results: Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        for row in rows:
+            if row[0] not in results:
+                results[row[0]] = (dict(zip(RESULT_COLUMNS, row[:width])), [])
+            if row[width] is not None:
+                results[row[0]][1].append(dict(zip(PRODUCT_COLUMNS, row[width:])))
+        return results
+
+    async def fragments(self, db: AsyncSession, ids: List[int]) -> Dict[int, StudyFragment]:
+        """Encoded search results for ids, reusing ``study_fragment_cache`` entries.
+
+        Missing studies are loaded with one ``result_rows`` call, encoded and
+        cached. Ids of studies that no longer exist are left out.
+        """
+        fragments = {}
+        missing = []
+        for study_id in ids:
+            fragment = study_fragment_cache.get(study_id)
+            if fragment is None:
+                missing.append(study_id)
+            else:
+                fragments[study_id] = fragment
+        if missing:
+            generation = search_cache.generation
+            for study_id, (study, products) in (await self.result_rows(db, missing)).items():
+                fragments[study_id] = encode_study(study, products)
+                # Rows read while a write was committed may predate it
+                if generation == search_cache.generation:
+                    study_fragment_cache.set(study_id, fragments[study_id])
+        return fragments
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Full-text search through the GIN-indexed tsvector column"""
+
+    name = "postgres"
+    model = ClinicalStudy
+    search_vector = SEARCH_VECTOR
+
+    @staticmethod
+    def tsquery_text(node: Node) -> str:
+        """A parsed query in ``to_tsquery`` syntax.
+
+        Lexemes are quoted word tokens, so no user text reaches the tsquery
+        parser. Field scopes become the weight labels of search_vector
+        (A for title, B for description) and phrases use ``<->``.
+        """
+        if isinstance(node, Term):
+            weight = TS_FIELD_WEIGHTS.get(node.field, "")
+            last = len(node.tokens) - 1
+            lexemes = [
+                f"'{token}':{'*' if node.prefix and position == last else ''}{weight}".rstrip(":")
+                for position, token in enumerate(node.tokens)
+            ]
+            return "(" + (" <-> " if node.phrase else " & ").join(lexemes) + ")"
+        if isinstance(node, Not):
+            return "!" + PostgresSearchBackend.tsquery_text(node.child)
+        operator = " & " if isinstance(node, And) else " | "
+        return "(" + operator.join(map(PostgresSearchBackend.tsquery_text, node.children)) + ")"
+
+    @classmethod
+    def build_tsquery(cls, query: Node):
+        """to_tsquery over the parsed query, with the text bound as a parameter"""
+        config = literal_column(f"'{TS_CONFIG}'::regconfig")
+        return func.to_tsquery(config, cls.tsquery_text(query))
+
+    @staticmethod
+    def score_expression(
+        tsquery,
+        relevance_score=ClinicalStudy.relevance_score,
+        search_vector=SEARCH_VECTOR
+    ):
+        """ts_rank_cd with the BM25 field boosts, plus the stored prior"""
+        prior = ranking.PRIOR_WEIGHT * func.ln(1 + func.greatest(
+            func.coalesce(relevance_score, 0.0), 0.0
+        ))
+        if tsquery is None:
+            return prior
+        text_score = func.ts_rank_cd(
+            literal_column(f"'{ranking.TS_RANK_WEIGHTS}'::float4[]"),
+            search_vector,
+            tsquery,
+            # Normalize by 1 + log(document length)
+            1
+        )
+        return text_score + prior
+
+    def apply_filters(self, query, filters: Dict[str, Any]):
+        return apply_filters(query, filters)
+
+    def match_query(self, query: Optional[Node], filters: Dict[str, Any]):
+        """Select the id and score of every row of ``model`` matching a search"""
+        tsquery = self.build_tsquery(query) if query is not None else None
+        score = self.score_expression(
+            tsquery, self.model.relevance_score, self.search_vector
+        ).label("score")
+
+        match_query = select(self.model.id, score)
+        if tsquery is not None:
+            match_query = match_query.filter(self.search_vector.op("@@")(tsquery))
+        return self.apply_filters(match_query, filters)
+
+    def facet_query(self, query: Optional[Node], filters: Dict[str, Any]):
+        """Count studies per value of every equality filter in one scan.
+
+        The text match and range filters narrow the rows; GROUPING SETS
+        then groups them by each filter column separately. A column's count
+        applies the other selected equality filters through FILTER, so its
+        own selection does not hide the alternatives.
+        """
+        columns = [getattr(ClinicalStudy, field) for field in EQUALITY_FILTERS]
+        conditions = {
+            field: column == filters[field]
+            for field, column in zip(EQUALITY_FILTERS, columns) if filters.get(field)
+        }
+        counts = []
+        for field in EQUALITY_FILTERS:
+            others = [condition for other, condition in conditions.items() if other != field]
+            count = func.count().filter(and_(*others)) if others else func.count()
+            counts.append(count.label(f"{field}_count"))
+
+        statement = select(
+            *columns,
+            *(func.grouping(column).label(f"{column.key}_grouping") for column in columns),
+            *counts
+        )
+        if query is not None:
+            statement = statement.filter(SEARCH_VECTOR.op("@@")(self.build_tsquery(query)))
+        statement = apply_filters(statement, {
+            name: value for name, value in filters.items() if name not in EQUALITY_FILTERS
+        })
+        return statement.group_by(func.grouping_sets(*columns))
+
+    async def facet_counts(
+        self,
+        db: AsyncSession,
+        query: Optional[Node],
+        filters: Dict[str, Any]
+    ) -> Dict[str, Dict[str, int]]:
+        """Run ``facet_query`` and arrange its rows as field -> {value: count}"""
+        rows = (await db.execute(self.facet_query(query, filters))).all()
+        return facet_counts_from_rows(rows)
+
+    async def stream(self, db, query, filters, batch_size=1000):
+        ranked = self.match_query(query, filters).subquery()
+        columns = [getattr(ClinicalStudy, name) for name in EXPORT_COLUMNS]
+        # Plain columns rather than entities keep the identity map empty;
+        # yield_per fetches through a server-side cursor
+        statement = select(*columns, ranked.c.score).join(
+            ranked, ClinicalStudy.id == ranked.c.id
+        ).order_by(ranked.c.score.desc(), ranked.c.id).execution_options(yield_per=batch_size)
+        result = await db.stream(statement)
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+    async def search(self, db, query, filters, page, per_page, after=None, total_mode="exact", facets=False):
+        match_query = self.match_query(query, filters)
+
+        total = None
+        total_is_exact = True
+        if total_mode == "estimate":
+            total = await planner_row_estimate(db, match_query)
+            total_is_exact = False
+        elif total_mode == "cached":
+            total = count_cache.get((self.name, query_key(query, filters)))
+
+        # When a count is still needed it rides along with the page as a
+        # window over the whole match set, computed before the seek/offset
+        if total is None:
+            match_query = match_query.add_columns(func.count().over().label("total"))
+        ranked = match_query.subquery()
+
+        # Ranking and top-k selection happen in the database
+        page_query = select(ranked.c.id, ranked.c.score, *(
+            [ranked.c.total] if total is None else []
+        )).order_by(ranked.c.score.desc(), ranked.c.id)
+        if after is not None:
+            after_score, after_id = after
+            page_query = page_query.filter(or_(
+                ranked.c.score < after_score,
+                and_(ranked.c.score == after_score, ranked.c.id > after_id)
+            ))
+        else:
+            page_query = page_query.offset((page - 1) * per_page)
+        rows = (await db.execute(page_query.limit(per_page + 1))).all()
+
+        if total is None:
+            if rows:
+                total = rows[0].total
+            elif after is None and page == 1:
+                total = 0
+            else:
+                # Past the last page there is no row to carry the window count
+                total = await db.scalar(
+                    select(func.count()).select_from(match_query.subquery())
+                )
+            if total_mode == "cached":
+                count_cache.set((self.name, query_key(query, filters)), total)
+
+        hits = [(row[0], float(row[1])) for row in rows[:per_page]]
+        facet_counts = await self.facet_counts(db, query, filters) if facets else None
+        return SearchPage(total, hits, len(rows) > per_page, total_is_exact, facet_counts)
+
+
+class InMemorySearchBackend(SearchBackend):
+    """Full-text search through an in-process inverted index"""
+
+    name = "memory"
+    result_type = "study"
+    model = ClinicalStudy
+
+    def __init__(self, index: Optional[InvertedIndex] = None):
+        self.index = index or InvertedIndex()
+
+    async def warm_up(self, db):
+        if not self.index.ready:
+            await warm_start(db, self.result_type, self.index, lambda: self.rebuild(db))
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        """Rebuild the index from the clinical_study table"""
+        await db.run_sync(
+            lambda session: self.index.rebuild(session.query(ClinicalStudy).yield_per(1000))
+        )
+
+    def index_rows(self):
+        """Select the indexed columns; rows look like ``ClinicalStudy`` to the index"""
+        return select(*ClinicalStudy.__table__.columns)
+
+    async def apply_changes(self, db, result_type, ids):
+        if result_type != self.result_type or not self.index.ready:
+            return
+        rows = (await db.execute(self.index_rows().filter(self.model.id.in_(ids)))).all()
+        for row in rows:
+            self.index.add(row)
+        for doc_id in ids - {row.id for row in rows}:
+            self.index.remove(doc_id)
+
+    async def search(self, db, query, filters, page, per_page, after=None, total_mode="exact", facets=False):
+        await self.warm_up(db)
+        # Matching and ranking are CPU-bound, so they run in a worker thread,
+        # like DuckDB scans, and the other indexes of a search overlap them
+        return await asyncio.to_thread(self.search_page, query, filters, page, per_page, after, facets)
+
+    def search_page(self, query, filters, page, per_page, after=None, facets=False) -> SearchPage:
+        """``search`` against the index; holds its lock so writes wait until ranking is done"""
+        with self.index.read_lock():
+            # The match set is materialized anyway, so every total_mode is exact
+            facet_counts = None
+            if facets:
+                matched_ids, facet_counts = self.index.search_with_facets(query, filters)
+            else:
+                matched_ids = self.index.search(query, filters)
+            total = len(matched_ids)
+
+            # Score ids only and keep the best candidates in a heap, so no rows
+            # are loaded for studies that do not make the page
+            scores = ranking.score_documents(self.index, self.index.query_tokens(query), matched_ids)
+        if after is not None:
+            after_score, after_id = after
+            scores = {
+                doc_id: score for doc_id, score in scores.items()
+                if score < after_score or (score == after_score and doc_id > after_id)
+            }
+            ranked = ranking.top_k(scores, per_page + 1)
+        else:
+            ranked = ranking.top_k(scores, page * per_page + 1)[(page - 1) * per_page:]
+        return SearchPage(total, ranked[:per_page], len(ranked) > per_page, True, facet_counts)
+
+    def ranked_matches(self, query, filters) -> List[Tuple[int, float]]:
+        """Every match of a query as (id, score), best first"""
+        with self.index.read_lock():
+            scores = ranking.score_documents(
+                self.index, self.index.query_tokens(query), self.index.search(query, filters)
+            )
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    async def stream(self, db, query, filters, batch_size=1000):
+        await self.warm_up(db)
+        ranked = await asyncio.to_thread(self.ranked_matches, query, filters)
+        columns = [getattr(ClinicalStudy, name) for name in EXPORT_COLUMNS]
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start:start + batch_size]
+            rows = {
+                row.id: tuple(row)
+                for row in await db.execute(
+                    select(*columns).filter(ClinicalStudy.id.in_([doc_id for doc_id, _ in batch]))
+                )
+            }
+            yield [rows[doc_id] + (score,) for doc_id, score in batch if doc_id in rows]
+
+
+class DuckDBSearchBackend(SearchBackend):
+    """Search over a columnar Parquet snapshot in embedded DuckDB.
+
+    Matching and ranking follow the in-memory backend, but run as
+    vectorized scans, which pays off for wide scans, date ranges and facet
+    counts over large exports. Results come from the snapshot, including
+    the studies and data products on the page, so they lag writes until
+    the snapshot is exported again; see ``services/columnar.py``.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, store: Optional[ColumnarStore] = None):
+        self.store = store or ColumnarStore()
+
+    async def warm_up(self, db):
+        if not self.store.ready:
+            await asyncio.to_thread(self.store.open, engine)
+
+    async def search(self, db, query, filters, page, per_page, after=None, total_mode="exact", facets=False):
+        await self.warm_up(db)
+        # Counting rides along with ranking as a window, so every total_mode is exact
+        ranked, total, has_more = await asyncio.to_thread(
+            self.store.search, query, filters, page, per_page, after
+        )
+        facet_counts = None
+        if facets:
+            facet_counts = facet_counts_from_rows(
+                await asyncio.to_thread(self.store.facet_rows, query, filters)
+            )
+        return SearchPage(total, ranked, has_more, True, facet_counts)
+
+    async def result_rows(self, db, ids):
+        # Results come from the snapshot, like the ranking
+        await self.warm_up(db)
+        return await asyncio.to_thread(self.store.result_rows, ids, RESULT_COLUMNS, PRODUCT_COLUMNS)
+
+    async def stream(self, db, query, filters, batch_size=1000):
+        await self.warm_up(db)
+        batches = self.store.stream(query, filters, EXPORT_COLUMNS, batch_size)
+        try:
+            # Each batch is fetched off the event loop
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            batches.close()
+
+
+async def entity_fragments(db: AsyncSession, entity: Entity, ids: List[int]) -> Dict[int, StudyFragment]:
+    """Encoded search results of the entity rows in ids, read in one select"""
+    rows = await db.execute(select(*entity.columns()).filter(entity.model.id.in_(ids)))
+    return {row.id: encode_entity(entity.type, row._mapping) for row in rows}
+
+
+class PostgresEntityBackend(PostgresSearchBackend):
+    """Full-text search of an entity table through its own search_vector column"""
+
+    def __init__(self, entity: Entity):
+        self.entity = entity
+        self.name = f"postgres:{entity.type}"
+        self.model = entity.model
+        self.search_vector = literal_column(f"{entity.model.__tablename__}.search_vector")
+
+    def apply_filters(self, query, filters):
+        return self.entity.apply_filters(query, filters)
+
+    async def fragments(self, db, ids):
+        return await entity_fragments(db, self.entity, ids)
+
+
+class InMemoryEntityBackend(InMemorySearchBackend):
+    """Full-text search of an entity table through an in-process inverted index"""
+
+    def __init__(self, entity: Entity, index: Optional[InvertedIndex] = None):
+        super().__init__(index)
+        self.entity = entity
+        self.name = f"memory:{entity.type}"
+        self.result_type = entity.type
+        self.model = entity.model
+
+    def index_rows(self):
+        # Labeled columns look like study rows to the index and its filters
+        return select(*self.entity.columns())
+
+    async def rebuild(self, db):
+        self.index.rebuild((await db.execute(self.index_rows())).all())
+
+    async def fragments(self, db, ids):
+        return await entity_fragments(db, self.entity, ids)
+
+
+_backend: Optional[SearchBackend] = None
+_entity_backends: Dict[str, SearchBackend] = {}
+
+
+def get_search_backend() -> SearchBackend:
+    """Return the process-wide search backend"""
+    global _backend
+    if _backend is None:
+        configured = os.environ.get("SEARCH_BACKEND")
+        if configured is None:
+            configured = "postgres" if engine.dialect.name == "postgresql" else "memory"
+
+        if configured == "postgres":
+            _backend = PostgresSearchBackend()
+        elif configured == "memory":
+            _backend = InMemorySearchBackend()
+        elif configured == "duckdb":
+            _backend = DuckDBSearchBackend()
+        else:
+            raise ValueError(f"Unknown SEARCH_BACKEND: {configured}")
+        logger.info("Using %s search backend", _backend.name)
+    return _backend
+
+
+def get_entity_backend(entity_type: str) -> SearchBackend:
+    """Return the process-wide backend searching one of ``ENTITIES``.
+
+    Entity tables are searched in Postgres next to the studies when the
+    study backend is ``postgres``. Otherwise they are small enough to
+    index in process, including next to a DuckDB snapshot, which only
+    holds studies and data products.
+    """
+    backend = _entity_backends.get(entity_type)
+    if backend is None:
+        entity = ENTITIES[entity_type]
+        if isinstance(get_search_backend(), PostgresSearchBackend):
+            backend = PostgresEntityBackend(entity)
+        else:
+            backend = InMemoryEntityBackend(entity)
+        backend = _entity_backends.setdefault(entity_type, backend)
+    return backend
+
+
+async def warm_up_search_backend() -> None:
+    """Build in-process search state at application startup and keep it current"""
+    async with AsyncSessionLocal() as db:
+        for backend in (get_search_backend(), *map(get_entity_backend, ENTITIES)):
+            await backend.warm_up(db)
+            change_feed.subscribe(backend.apply_changes)
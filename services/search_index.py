@@ -0,0 +1,1009 @@
+"""In-process inverted index over clinical studies.
+
+This is the full-text engine used when the database has no native text
+search (SQLite, local test runs). Postgres deployments search the
+``clinical_study.search_vector`` GIN index instead, see
+``services/search_backend.py``.
+
+An index can also be written to a snapshot file and served from it
+memory-mapped (``write_snapshot`` and ``load_snapshot``), so workers start
+without reading the tables and share the index pages; see
+``services/index_snapshots.py``.
+"""
+import bisect
+import logging
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from services.bitmap import Bitmap
+from services.query_parser import FIELDS, And, Node, Not, Or, Term, positive_terms, scoring_tokens, tokenize
+from services.snapshot_file import MappedFile, SnapshotWriter, unsigned_typecode
+
+logger = logging.getLogger(__name__)
+
+# Versioned, so snapshots storing documents differently are rebuilt
+SNAPSHOT_KIND = "inverted-index/2"
+
+# Decoded posting entries kept per snapshot-backed index, across terms
+SNAPSHOT_POSTINGS_CACHE = int(os.environ.get("INDEX_SNAPSHOT_POSTINGS_CACHE", "1000000"))
+
+# Snapshot encoding of missing integers and datetimes
+NULL_INTEGER = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+
+# Dense id -> row maps are written unless ids are sparser than this
+MAX_ROW_MAP_SPARSITY = 4
+
+# Byte width of a delta -> typecode
+WIDTH_TYPECODES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+# Equality filters accepted by /api/search, in the order the route lists them
+EQUALITY_FILTERS = (
+    "status",
+    "phase",
+    "indication_category",
+    "procedure_category",
+    "severity",
+    "risk_level",
+)
+
+
+def rank_facet_counts(counts: Dict[Any, int]) -> Dict[Any, int]:
+    """Order facet values by count, most studies first"""
+    return dict(sorted(counts.items(), key=lambda item: (-item[1], str(item[0]))))
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class StudyDocument:
+    """Per-study metadata kept next to the postings for filtering"""
+
+    __slots__ = (
+        "id",
+        "title_length",
+        "description_length",
+        "status",
+        "phase",
+        "indication_category",
+        "procedure_category",
+        "severity",
+        "risk_level",
+        "start_date",
+        "end_date",
+        "duration",
+        "relevance_score",
+    )
+
+    def __init__(self, row: Any):
+        self.id = row.id
+        self.title_length = len(tokenize(row.title))
+        self.description_length = len(tokenize(row.description))
+        for field in EQUALITY_FILTERS:
+            setattr(self, field, getattr(row, field, None))
+        self.start_date = _parse_datetime(getattr(row, "start_date", None))
+        self.end_date = _parse_datetime(getattr(row, "end_date", None))
+        self.duration = getattr(row, "duration", None)
+        # A missing score adds nothing, as in ranking.prior and the other backends
+        self.relevance_score = getattr(row, "relevance_score", None) or 0.0
+
+    def matches(self, filters: Dict[str, Any]) -> bool:
+        """Check the document against the /api/search filter parameters"""
+        for field in EQUALITY_FILTERS:
+            value = filters.get(field)
+            if value and getattr(self, field) != value:
+                return False
+
+        start_date = _parse_datetime(filters.get("start_date"))
+        if start_date and (self.start_date is None or self.start_date < start_date):
+            return False
+
+        end_date = _parse_datetime(filters.get("end_date"))
+        if end_date and (self.end_date is None or self.end_date > end_date):
+            return False
+
+        min_duration = filters.get("min_duration")
+        if min_duration and (self.duration is None or self.duration < min_duration):
+            return False
+
+        max_duration = filters.get("max_duration")
+        if max_duration and (self.duration is None or self.duration > max_duration):
+            return False
+
+        return True
+
+
+class InvertedIndex:
+    """Term -> postings map over study titles and descriptions.
+
+    Postings store per-field term frequencies so callers can rank matches
+    without going back to the database. Each value of an equality filter
+    also keeps a bitmap of the studies that have it, for facet counts. The
+    token sequence of each field is kept per study to check phrases, and a
+    sorted term list, built on demand, expands prefixes.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, List[int]]] = {}
+        self._documents: Dict[int, StudyDocument] = {}
+        self._all = Bitmap()
+        self._facets: Dict[str, Dict[Any, Bitmap]] = {field: {} for field in EQUALITY_FILTERS}
+        self._document_tokens: Dict[int, Tuple[Tuple[str, ...], ...]] = {}
+        self._sorted_terms: Optional[List[str]] = None
+        self._total_title_length = 0
+        self._total_description_length = 0
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def rebuild(self, rows: Iterable[Any]) -> None:
+        """Replace the index contents with the given study rows"""
+        postings: Dict[str, Dict[int, List[int]]] = {}
+        documents: Dict[int, StudyDocument] = {}
+        document_tokens: Dict[int, Tuple[Tuple[str, ...], ...]] = {}
+        facet_ids: Dict[str, Dict[Any, List[int]]] = {field: {} for field in EQUALITY_FILTERS}
+        for row in rows:
+            document = documents[row.id] = StudyDocument(row)
+            document_tokens[row.id] = self._index_fields(postings, row)
+            for field in EQUALITY_FILTERS:
+                value = getattr(document, field)
+                if value is not None:
+                    facet_ids[field].setdefault(value, []).append(row.id)
+        facets = {
+            field: {value: Bitmap(ids) for value, ids in values.items()}
+            for field, values in facet_ids.items()
+        }
+
+        with self._lock:
+            self._postings = postings
+            self._documents = documents
+            self._all = Bitmap(documents)
+            self._facets = facets
+            self._document_tokens = document_tokens
+            self._sorted_terms = None
+            self._total_title_length = sum(doc.title_length for doc in documents.values())
+            self._total_description_length = sum(doc.description_length for doc in documents.values())
+            self.ready = True
+        logger.info("Search index built with %s studies and %s terms", len(documents), len(postings))
+
+    def write_snapshot(self, path: str, metadata: Dict[str, Any]) -> None:
+        """Write the index to a snapshot file that ``load_snapshot`` maps.
+
+        Terms are stored sorted. Each posting list holds its ids
+        delta-encoded in the narrowest integer width that fits, plus
+        per-field term frequencies. Documents are one array per attribute,
+        in id order, with their token sequences as term numbers. Only a
+        rebuilt index can be written, not one served from a snapshot.
+        """
+        with self._lock:
+            if isinstance(self._postings, SnapshotPostings):
+                raise ValueError("An index served from a snapshot cannot be written to one")
+            terms = sorted(self._postings)
+            doc_ids = sorted(self._documents)
+            writer = SnapshotWriter(path, SNAPSHOT_KIND)
+            try:
+                writer.add_strings("terms", terms)
+                self._write_postings(writer, terms)
+                values = self._write_documents(writer, doc_ids)
+                term_numbers = {term: number for number, term in enumerate(terms)}
+                token_index = array("Q", [0])
+                token_terms = array(unsigned_typecode(len(terms)))
+                for doc_id in doc_ids:
+                    for tokens in self._document_tokens[doc_id]:
+                        token_terms.extend(term_numbers[token] for token in tokens)
+                        token_index.append(len(token_terms))
+                writer.add_array("tokens.index", token_index)
+                writer.add_array("tokens.terms", token_terms)
+
+                writer.add_bytes("all", self._all.to_bytes())
+                for field in EQUALITY_FILTERS:
+                    for code, value in enumerate(values[field], 1):
+                        writer.add_bytes(f"facets.{field}.{code}", self._facets[field][value].to_bytes())
+                writer.close({
+                    **metadata,
+                    "documents": len(doc_ids),
+                    "terms": len(terms),
+                    "title_length": self._total_title_length,
+                    "description_length": self._total_description_length,
+                    "values": values,
+                })
+            except BaseException:
+                writer.abort()
+                raise
+        logger.info("Search index snapshot written to %s", path)
+
+    def _write_postings(self, writer: SnapshotWriter, terms: List[str]) -> None:
+        counts = array("Q", [0])
+        firsts = array("I")
+        starts = array("Q")
+        widths = array("B")
+        deltas = bytearray()
+        title_frequencies = array("I")
+        description_frequencies = array("I")
+        for term in terms:
+            postings = self._postings[term]
+            ids = sorted(postings)
+            gaps = array("I", [following - previous for previous, following in zip(ids, ids[1:])])
+            encoded = array(unsigned_typecode(max(gaps, default=0)), gaps)
+            # Aligned, so the list is viewed in place at its width
+            deltas.extend(bytes(-len(deltas) % encoded.itemsize))
+            starts.append(len(deltas))
+            widths.append(encoded.itemsize)
+            deltas.extend(encoded.tobytes())
+            firsts.append(ids[0])
+            counts.append(counts[-1] + len(ids))
+            for doc_id in ids:
+                title_frequency, description_frequency = postings[doc_id]
+                title_frequencies.append(title_frequency)
+                description_frequencies.append(description_frequency)
+        writer.add_array("postings.counts", counts)
+        writer.add_array("postings.first", firsts)
+        writer.add_array("postings.start", starts)
+        writer.add_array("postings.width", widths)
+        writer.add_bytes("postings.deltas", bytes(deltas))
+        for name, frequencies in (("title", title_frequencies), ("description", description_frequencies)):
+            writer.add_values(
+                f"postings.{name}_frequency", unsigned_typecode(max(frequencies, default=0)), frequencies
+            )
+
+    def _write_documents(self, writer: SnapshotWriter, doc_ids: List[int]) -> Dict[str, List[Any]]:
+        """Write per-document arrays; returns the values behind each equality filter's codes"""
+        documents = [self._documents[doc_id] for doc_id in doc_ids]
+        writer.add_values("documents.id", "I", doc_ids)
+        largest = doc_ids[-1] if doc_ids else -1
+        if largest < MAX_ROW_MAP_SPARSITY * len(doc_ids) + 1024:
+            rows = array("i", [-1]) * (largest + 1)
+            for row, doc_id in enumerate(doc_ids):
+                rows[doc_id] = row
+            writer.add_array("documents.row", rows)
+        else:
+            writer.add_values("documents.row", "i", ())
+        writer.add_values("documents.title_length", "I", (doc.title_length for doc in documents))
+        writer.add_values("documents.description_length", "I", (doc.description_length for doc in documents))
+        writer.add_values("documents.relevance_score", "d", (doc.relevance_score for doc in documents))
+        writer.add_values("documents.duration", "q", (
+            NULL_INTEGER if doc.duration is None else int(doc.duration) for doc in documents
+        ))
+        for field in ("start_date", "end_date"):
+            writer.add_values(f"documents.{field}", "q", (
+                NULL_INTEGER if getattr(doc, field) is None
+                else (getattr(doc, field) - EPOCH) // timedelta(microseconds=1)
+                for doc in documents
+            ))
+
+        values: Dict[str, List[Any]] = {}
+        for field in EQUALITY_FILTERS:
+            values[field] = list(self._facets[field])
+            codes = {value: code for code, value in enumerate(values[field], 1)}
+            writer.add_values(f"documents.{field}", unsigned_typecode(len(codes)), (
+                codes.get(getattr(doc, field), 0) for doc in documents
+            ))
+        return values
+
+    def load_snapshot(self, path: str) -> Dict[str, Any]:
+        """Serve the index from a file written by ``write_snapshot``; returns its metadata.
+
+        The file is memory-mapped and read in place: posting lists and
+        documents are decoded as queries touch them. Later ``add`` and
+        ``remove`` calls are kept in memory on top of the file.
+        """
+        snapshot = IndexSnapshot(MappedFile(path, SNAPSHOT_KIND))
+        metadata = snapshot.metadata
+        facets = {
+            field: {
+                value: Bitmap.from_buffer(snapshot.file.bytes(f"facets.{field}.{code}"))
+                for code, value in enumerate(metadata["values"][field], 1)
+            }
+            for field in EQUALITY_FILTERS
+        }
+        with self._lock:
+            self._postings = SnapshotPostings(snapshot)
+            self._documents = SnapshotDocuments(snapshot)
+            self._document_tokens = SnapshotDocumentTokens(snapshot)
+            self._all = Bitmap.from_buffer(snapshot.file.bytes("all"))
+            self._facets = facets
+            self._sorted_terms = None
+            self._total_title_length = metadata["title_length"]
+            self._total_description_length = metadata["description_length"]
+            self.ready = True
+        logger.info(
+            "Search index mapped from %s with %s studies and %s terms",
+            path, metadata["documents"], metadata["terms"]
+        )
+        return metadata
+
+    def add(self, row: Any) -> None:
+        """Index a single study, replacing any previous version of it"""
+        with self._lock:
+            self._remove(row.id)
+            document = StudyDocument(row)
+            self._documents[row.id] = document
+            self._all.add(row.id)
+            for field in EQUALITY_FILTERS:
+                value = getattr(document, field)
+                if value is not None:
+                    self._facets[field].setdefault(value, Bitmap()).add(row.id)
+            self._total_title_length += document.title_length
+            self._total_description_length += document.description_length
+            self._document_tokens[row.id] = self._index_fields(self._postings, row)
+            self._sorted_terms = None
+
+    def remove(self, doc_id: int) -> None:
+        """Drop a study from the index"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: int) -> None:
+        document = self._documents.pop(doc_id, None)
+        if document is not None:
+            self._total_title_length -= document.title_length
+            self._total_description_length -= document.description_length
+            self._all.discard(doc_id)
+            for field in EQUALITY_FILTERS:
+                values = self._facets[field]
+                bitmap = values.get(getattr(document, field))
+                if bitmap is not None:
+                    bitmap.discard(doc_id)
+                    if not bitmap:
+                        del values[getattr(document, field)]
+        for term in {token for tokens in self._document_tokens.pop(doc_id, ()) for token in tokens}:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    @staticmethod
+    def _index_fields(postings: Dict[str, Dict[int, List[int]]], row: Any) -> Tuple[Tuple[str, ...], ...]:
+        """Add a row's tokens to postings; returns its token sequence per field"""
+        fields = []
+        for field_number, text in enumerate((row.title, row.description)):
+            # Interned, so the sequences share strings with the postings keys
+            tokens = tuple(sys.intern(token) for token in tokenize(text))
+            for token in tokens:
+                frequencies = postings.setdefault(token, {}).setdefault(row.id, [0, 0])
+                frequencies[field_number] += 1
+            fields.append(tokens)
+        return tuple(fields)
+
+    def document(self, doc_id: int) -> StudyDocument:
+        return self._documents[doc_id]
+
+    def read_lock(self) -> threading.RLock:
+        """The lock writers hold; readers outside the event loop take it to see one version"""
+        return self._lock
+
+    def ranking_fields(self, doc_ids: Iterable[int]) -> Dict[int, Tuple[int, int, float]]:
+        """Doc id -> (title length, description length, relevance score) for ranking"""
+        if isinstance(self._documents, SnapshotDocuments):
+            return self._documents.ranking_fields(doc_ids)
+        fields = {}
+        for doc_id in doc_ids:
+            document = self._documents[doc_id]
+            fields[doc_id] = (document.title_length, document.description_length, document.relevance_score)
+        return fields
+
+    def postings(self, token: str) -> Dict[int, List[int]]:
+        """Return {doc_id: [title_tf, description_tf]} for a token"""
+        return self._postings.get(token, {})
+
+    def average_lengths(self) -> Tuple[float, float]:
+        """Average title and description lengths in tokens, never zero"""
+        count = len(self._documents) or 1
+        return (
+            max(self._total_title_length / count, 1.0),
+            max(self._total_description_length / count, 1.0),
+        )
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        """Indexed terms starting with prefix, in sorted order"""
+        with self._lock:
+            if isinstance(self._postings, SnapshotPostings):
+                return self._postings.expand_prefix(prefix)
+            if self._sorted_terms is None:
+                self._sorted_terms = sorted(self._postings)
+            start = bisect.bisect_left(self._sorted_terms, prefix)
+            end = bisect.bisect_left(self._sorted_terms, prefix + "\uffff", start)
+            return self._sorted_terms[start:end]
+
+    def query_tokens(self, query: Optional[Node]) -> Set[str]:
+        """Tokens to score a query's matches by: its positive terms, prefixes expanded"""
+        tokens = scoring_tokens(query)
+        for term in positive_terms(query):
+            if term.prefix:
+                tokens.update(self.expand_prefix(term.tokens[-1]))
+        return tokens
+
+    def _token_ids(self, token: str, prefix: bool, field: Optional[str]):
+        """Ids of studies containing token (or a term it prefixes), in field if set"""
+        field_number = FIELDS.index(field) if field else None
+        sources = [self._postings.get(token, {})] if not prefix else [
+            self._postings.get(term, {}) for term in self.expand_prefix(token)
+        ]
+        if field_number is None and len(sources) == 1:
+            # The postings dict serves as a set of ids without copying it
+            return sources[0].keys()
+        return {
+            doc_id
+            for postings in sources
+            for doc_id, frequencies in postings.items()
+            if field_number is None or frequencies[field_number]
+        }
+
+    def _estimate(self, node: Node) -> int:
+        """Upper bound on the ids a node matches, from posting list sizes"""
+        if isinstance(node, Term):
+            sizes = []
+            for position, token in enumerate(node.tokens):
+                if node.prefix and position == len(node.tokens) - 1:
+                    sizes.append(sum(len(self._postings.get(term, ())) for term in self.expand_prefix(token)))
+                else:
+                    sizes.append(len(self._postings.get(token, ())))
+            return min(sizes)
+        if isinstance(node, And):
+            return min(self._estimate(child) for child in node.children)
+        if isinstance(node, Or):
+            return sum(self._estimate(child) for child in node.children)
+        return len(self._documents)
+
+    def _phrase_in(self, doc_id: int, term: Term) -> bool:
+        fields = self._document_tokens[doc_id]
+        if term.field:
+            fields = (fields[FIELDS.index(term.field)],)
+        width = len(term.tokens)
+        last = width - 1
+        for tokens in fields:
+            for start in range(len(tokens) - last):
+                if all(
+                    tokens[start + offset].startswith(token) if term.prefix and offset == last
+                    else tokens[start + offset] == token
+                    for offset, token in enumerate(term.tokens)
+                ):
+                    return True
+        return False
+
+    def _evaluate(self, node: Node, scope: Optional[Set[int]]) -> Set[int]:
+        """Ids matching node among scope (every study when None)"""
+        if scope is not None and not scope:
+            return set()
+        if isinstance(node, Term):
+            last = len(node.tokens) - 1
+            id_sets = sorted(
+                (
+                    self._token_ids(token, node.prefix and position == last, node.field)
+                    for position, token in enumerate(node.tokens)
+                ),
+                key=len
+            )
+            # Walk the smaller of the scope and the rarest posting list, then
+            # probe the others from rarest to most common
+            if scope is not None and len(scope) < len(id_sets[0]):
+                matched = set(scope)
+            else:
+                matched = set(id_sets.pop(0))
+                if scope is not None:
+                    matched &= scope
+            for ids in id_sets:
+                if not matched:
+                    break
+                matched = {doc_id for doc_id in matched if doc_id in ids}
+            if node.phrase:
+                matched = {doc_id for doc_id in matched if self._phrase_in(doc_id, node)}
+            return matched
+        if isinstance(node, Or):
+            matched = set()
+            for child in node.children:
+                matched |= self._evaluate(child, scope)
+            return matched
+        if isinstance(node, Not):
+            universe = set(self._documents) if scope is None else scope
+            return universe - self._evaluate(node.child, scope)
+
+        # And: narrow the scope child by child, most selective first, and
+        # apply exclusions last, to what is left
+        positives = sorted(
+            (child for child in node.children if not isinstance(child, Not)),
+            key=self._estimate
+        )
+        matched = scope
+        for child in positives:
+            matched = self._evaluate(child, matched)
+            if not matched:
+                return set()
+        if matched is None:
+            matched = set(self._documents)
+        for child in node.children:
+            if isinstance(child, Not):
+                matched = matched - self._evaluate(child.child, matched)
+        return matched
+
+    def match(self, query: Node, scope: Optional[Set[int]] = None) -> Set[int]:
+        """Return ids of studies matching a parsed query, among scope if given.
+
+        A term matches when every one of its tokens occurs in the title or
+        description (or in its field), a phrase when they occur in order.
+        """
+        with self._lock:
+            return self._evaluate(query, scope)
+
+    def filtered(self, filters: Optional[Dict[str, Any]]) -> Optional[Collection[int]]:
+        """Ids of studies passing the filters, or None when nothing is filtered.
+
+        Equality filters intersect the facet bitmaps, smallest first; only
+        the studies left are checked against range filters. Equality-only
+        results are returned as the Bitmap, so callers can size them before
+        paying for a set.
+        """
+        filters = filters or {}
+        selected = [field for field in EQUALITY_FILTERS if filters.get(field)]
+        ranged = {
+            name: value for name, value in filters.items()
+            if name not in EQUALITY_FILTERS and value
+        }
+        if not selected and not ranged:
+            return None
+        with self._lock:
+            if selected:
+                bitmaps = sorted(
+                    (self._facets[field].get(filters[field], Bitmap()) for field in selected),
+                    key=len
+                )
+                ids = bitmaps[0]
+                for bitmap in bitmaps[1:]:
+                    ids = ids & bitmap
+            else:
+                ids = self._all
+            if ranged:
+                return self._matching(ids, ranged)
+            return ids
+
+    def _matching(self, doc_ids: Iterable[int], filters: Dict[str, Any]) -> Set[int]:
+        """The documents among doc_ids that pass ``StudyDocument.matches``"""
+        if isinstance(self._documents, SnapshotDocuments):
+            return self._documents.matching(doc_ids, filters)
+        return {doc_id for doc_id in doc_ids if self._documents[doc_id].matches(filters)}
+
+    def search(self, query: Optional[Node], filters: Optional[Dict[str, Any]] = None) -> Set[int]:
+        """Return ids of studies matching the query and filters.
+
+        Filters are applied first and the text match only runs over the
+        studies that pass them, unless the query is expected to match fewer
+        studies than that; then its matches are checked against the filters
+        instead. A None query matches every study.
+        """
+        with self._lock:
+            scope = self.filtered(filters)
+            if query is None:
+                return set(self._documents) if scope is None else set(scope)
+            if scope is None:
+                return self.match(query)
+            if self._estimate(query) < len(scope):
+                return self._matching(self.match(query), filters)
+            return self.match(query, set(scope))
+
+    def search_with_facets(
+        self,
+        query: Optional[Node],
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Set[int], Dict[str, Dict[Any, int]]]:
+        """Return the ids ``search`` would, plus facet counts for the sidebar.
+
+        Counts are disjunctive: those for a filter field take every other
+        selected filter into account but not the field's own selection, so
+        the sidebar shows what choosing another value would return. Values
+        with no matching studies are left out.
+        """
+        filters = filters or {}
+        range_filters = {
+            name: value for name, value in filters.items()
+            if name not in EQUALITY_FILTERS and value
+        }
+        with self._lock:
+            scope = self.filtered(range_filters)
+            if query is not None:
+                base = Bitmap(self.match(query, None if scope is None else set(scope)))
+            else:
+                base = self._all if scope is None else Bitmap(scope)
+            selected = {
+                field: self._facets[field].get(filters[field], Bitmap())
+                for field in EQUALITY_FILTERS if filters.get(field)
+            }
+
+            matched = base
+            for bitmap in selected.values():
+                matched = matched & bitmap
+
+            facets: Dict[str, Dict[Any, int]] = {}
+            for field in EQUALITY_FILTERS:
+                scope = base
+                for other, bitmap in selected.items():
+                    if other != field:
+                        scope = scope & bitmap
+                counts = {}
+                for value, bitmap in self._facets[field].items():
+                    count = scope.intersection_cardinality(bitmap)
+                    if count:
+                        counts[value] = count
+                facets[field] = rank_facet_counts(counts)
+        return set(matched), facets
+
+
+class IndexSnapshot:
+    """A mapped index snapshot and the lookups its views share"""
+
+    def __init__(self, file: MappedFile):
+        self.file = file
+        self.metadata = file.metadata
+        self.terms = file.strings("terms")
+        # Decoded term strings by number, filled in as documents are read
+        self._term_strings: List[Optional[str]] = [None] * len(self.terms)
+        self.ids = file.array("documents.id")
+        self._rows = file.array("documents.row")
+        self._token_index = file.array("tokens.index")
+        self._token_terms = file.array("tokens.terms")
+        self.title_lengths = file.array("documents.title_length")
+        self.description_lengths = file.array("documents.description_length")
+        self.relevance_scores = file.array("documents.relevance_score")
+        self.readers = self._column_readers()
+        self._codes = {
+            field: {value: code for code, value in enumerate(self.metadata["values"][field], 1)}
+            for field in EQUALITY_FILTERS
+        }
+
+    def _column_readers(self) -> Dict[str, Callable[[int], Any]]:
+        """Attribute name -> function of the row reading it, for ``MappedDocument``"""
+        file = self.file
+        readers: Dict[str, Callable[[int], Any]] = {
+            "title_length": self.title_lengths.__getitem__,
+            "description_length": self.description_lengths.__getitem__,
+            "relevance_score": self.relevance_scores.__getitem__,
+        }
+
+        def integer(column: memoryview) -> Callable[[int], Optional[int]]:
+            def read(row: int) -> Optional[int]:
+                value = column[row]
+                return None if value == NULL_INTEGER else value
+            return read
+
+        def timestamp(column: memoryview) -> Callable[[int], Optional[datetime]]:
+            def read(row: int) -> Optional[datetime]:
+                value = column[row]
+                return None if value == NULL_INTEGER else EPOCH + timedelta(microseconds=value)
+            return read
+
+        def coded(column: memoryview, values: List[Any]) -> Callable[[int], Any]:
+            values = [None, *values]
+            return lambda row: values[column[row]]
+
+        readers["duration"] = integer(file.array("documents.duration"))
+        for field in ("start_date", "end_date"):
+            readers[field] = timestamp(file.array(f"documents.{field}"))
+        for field in EQUALITY_FILTERS:
+            readers[field] = coded(file.array(f"documents.{field}"), self.metadata["values"][field])
+        return readers
+
+    def row_filter(self, filters: Dict[str, Any]) -> Callable[[int], bool]:
+        """``StudyDocument.matches`` as a check on a row, comparing column values as stored"""
+        file = self.file
+        checks: List[Callable[[int], bool]] = []
+
+        # NULL_INTEGER sorts below every bound, so missing values fail lower bounds
+        def at_least(column: memoryview, bound: Any) -> Callable[[int], bool]:
+            return lambda row: column[row] >= bound
+
+        def at_most(column: memoryview, bound: Any) -> Callable[[int], bool]:
+            return lambda row: NULL_INTEGER < column[row] <= bound
+
+        def equal(column: memoryview, code: int) -> Callable[[int], bool]:
+            return lambda row: column[row] == code
+
+        for field in EQUALITY_FILTERS:
+            value = filters.get(field)
+            if value:
+                code = self._codes[field].get(value)
+                if code is None:
+                    return lambda row: False
+                checks.append(equal(file.array(f"documents.{field}"), code))
+
+        start_date = _parse_datetime(filters.get("start_date"))
+        if start_date:
+            bound = (start_date - EPOCH) // timedelta(microseconds=1)
+            checks.append(at_least(file.array("documents.start_date"), bound))
+        end_date = _parse_datetime(filters.get("end_date"))
+        if end_date:
+            bound = (end_date - EPOCH) // timedelta(microseconds=1)
+            checks.append(at_most(file.array("documents.end_date"), bound))
+        if filters.get("min_duration"):
+            checks.append(at_least(file.array("documents.duration"), filters["min_duration"]))
+        if filters.get("max_duration"):
+            checks.append(at_most(file.array("documents.duration"), filters["max_duration"]))
+
+        if len(checks) == 1:
+            return checks[0]
+        return lambda row: all(check(row) for check in checks)
+
+    def term_number(self, term: str) -> Optional[int]:
+        position = bisect.bisect_left(self.terms, term)
+        if position < len(self.terms) and self.terms[position] == term:
+            return position
+        return None
+
+    def term(self, number: int) -> str:
+        term = self._term_strings[number]
+        if term is None:
+            term = self._term_strings[number] = sys.intern(self.terms[number])
+        return term
+
+    def row(self, doc_id: int) -> Optional[int]:
+        """Position of a document in the per-document arrays, None if not in the snapshot"""
+        if len(self._rows):
+            row = self._rows[doc_id] if 0 <= doc_id < len(self._rows) else -1
+            return row if row >= 0 else None
+        position = bisect.bisect_left(self.ids, doc_id)
+        if position < len(self.ids) and self.ids[position] == doc_id:
+            return position
+        return None
+
+    def tokens(self, row: int) -> Tuple[Tuple[str, ...], ...]:
+        """Token sequence per field of a document, as ``InvertedIndex`` keeps them"""
+        index = self._token_index
+        return tuple(
+            tuple(self.term(number) for number in self._token_terms[index[position]:index[position + 1]])
+            for position in range(row * len(FIELDS), (row + 1) * len(FIELDS))
+        )
+
+
+class SnapshotPostings:
+    """Term -> postings of a snapshot, with later changes held in memory.
+
+    Reading a term decodes its list from the file, through an LRU cache of
+    up to ``SNAPSHOT_POSTINGS_CACHE`` entries. Subscripting hands a term's
+    postings out to be changed in place, so the list is copied into
+    ``changed`` first and read from there afterwards. A snapshot term left
+    without postings stays in ``changed`` as an empty dict.
+    """
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self._snapshot = snapshot
+        file = snapshot.file
+        self._counts = file.array("postings.counts")
+        self._firsts = file.array("postings.first")
+        self._starts = file.array("postings.start")
+        self._widths = file.array("postings.width")
+        self._deltas = file.bytes("postings.deltas")
+        self._title_frequencies = file.array("postings.title_frequency")
+        self._description_frequencies = file.array("postings.description_frequency")
+        self.changed: Dict[str, Dict[int, Any]] = {}
+        self._cache: "OrderedDict[str, Dict[int, Any]]" = OrderedDict()
+        self._cached_entries = 0
+        self._lock = threading.Lock()
+
+    def _decode(self, number: int) -> Dict[int, Any]:
+        start, end = self._counts[number], self._counts[number + 1]
+        ids: Iterable[int] = (self._firsts[number],)
+        if end - start > 1:
+            offset, width = self._starts[number], self._widths[number]
+            gaps = self._deltas[offset:offset + (end - start - 1) * width].cast(WIDTH_TYPECODES[width])
+            ids = accumulate(gaps, initial=self._firsts[number])
+        return dict(zip(ids, zip(self._title_frequencies[start:end], self._description_frequencies[start:end])))
+
+    def _read(self, term: str) -> Optional[Dict[int, Any]]:
+        with self._lock:
+            postings = self._cache.get(term)
+            if postings is not None:
+                self._cache.move_to_end(term)
+                return postings
+        number = self._snapshot.term_number(term)
+        if number is None:
+            return None
+        postings = self._decode(number)
+        with self._lock:
+            self._cache[term] = postings
+            self._cached_entries += len(postings)
+            while self._cached_entries > SNAPSHOT_POSTINGS_CACHE and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_entries -= len(evicted)
+        return postings
+
+    def get(self, term: str, default: Any = None) -> Any:
+        """Postings of a term for reading; they must not be changed"""
+        postings = self.changed.get(term)
+        if postings is None:
+            postings = self._read(term)
+        return default if postings is None else postings
+
+    def __getitem__(self, term: str) -> Dict[int, Any]:
+        postings = self.changed.get(term)
+        if postings is None:
+            number = self._snapshot.term_number(term)
+            if number is None:
+                raise KeyError(term)
+            postings = self.changed[term] = self._decode(number)
+            with self._lock:
+                evicted = self._cache.pop(term, None)
+                if evicted is not None:
+                    self._cached_entries -= len(evicted)
+        return postings
+
+    def setdefault(self, term: str, default: Dict[int, Any]) -> Dict[int, Any]:
+        try:
+            return self[term]
+        except KeyError:
+            self.changed[term] = default
+            return default
+
+    def __delitem__(self, term: str) -> None:
+        if self._snapshot.term_number(term) is None:
+            del self.changed[term]
+        else:
+            self.changed[term] = {}
+
+    def __contains__(self, term: str) -> bool:
+        return bool(self.get(term))
+
+    def __len__(self) -> int:
+        count = len(self._snapshot.terms)
+        for term, postings in self.changed.items():
+            in_snapshot = self._snapshot.term_number(term) is not None
+            count += (not in_snapshot and bool(postings)) - (in_snapshot and not postings)
+        return count
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        """Terms with postings starting with prefix, in sorted order"""
+        terms = self._snapshot.terms
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + "\uffff", start)
+        found = {self._snapshot.term(number) for number in range(start, end)}
+        found.update(term for term in self.changed if term.startswith(prefix))
+        return sorted(term for term in found if self.changed.get(term, True))
+
+
+class MappedDocument:
+    """A ``StudyDocument`` whose attributes are read from snapshot columns"""
+
+    __slots__ = ("id", "_snapshot", "_row")
+
+    matches = StudyDocument.matches
+
+    def __init__(self, snapshot: IndexSnapshot, doc_id: int, row: int):
+        self.id = doc_id
+        self._snapshot = snapshot
+        self._row = row
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            reader = self._snapshot.readers[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return reader(self._row)
+
+
+class SnapshotDocuments:
+    """Doc id -> document of a snapshot, with later changes held in memory"""
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self._snapshot = snapshot
+        self.changed: Dict[int, StudyDocument] = {}
+        # Snapshot documents deleted or replaced since
+        self._removed: Set[int] = set()
+
+    def _row(self, doc_id: int) -> Optional[int]:
+        return None if doc_id in self._removed else self._snapshot.row(doc_id)
+
+    def get(self, doc_id: int, default: Any = None) -> Any:
+        document = self.changed.get(doc_id)
+        if document is not None:
+            return document
+        row = self._row(doc_id)
+        return default if row is None else MappedDocument(self._snapshot, doc_id, row)
+
+    def __getitem__(self, doc_id: int) -> Any:
+        document = self.get(doc_id)
+        if document is None:
+            raise KeyError(doc_id)
+        return document
+
+    def ranking_fields(self, doc_ids: Iterable[int]) -> Dict[int, Tuple[int, int, float]]:
+        """``InvertedIndex.ranking_fields``, reading the columns directly"""
+        snapshot, changed, removed = self._snapshot, self.changed, self._removed
+        title_lengths, description_lengths = snapshot.title_lengths, snapshot.description_lengths
+        relevance_scores = snapshot.relevance_scores
+        fields = {}
+        for doc_id in doc_ids:
+            document = changed.get(doc_id)
+            if document is not None:
+                fields[doc_id] = (document.title_length, document.description_length, document.relevance_score)
+                continue
+            row = None if doc_id in removed else snapshot.row(doc_id)
+            if row is None:
+                raise KeyError(doc_id)
+            fields[doc_id] = (title_lengths[row], description_lengths[row], relevance_scores[row])
+        return fields
+
+    def matching(self, doc_ids: Iterable[int], filters: Dict[str, Any]) -> Set[int]:
+        """``InvertedIndex._matching``, checking the columns directly"""
+        snapshot, changed, removed = self._snapshot, self.changed, self._removed
+        row_matches = snapshot.row_filter(filters)
+        found = set()
+        for doc_id in doc_ids:
+            document = changed.get(doc_id)
+            if document is not None:
+                if document.matches(filters):
+                    found.add(doc_id)
+                continue
+            row = None if doc_id in removed else snapshot.row(doc_id)
+            if row is None:
+                raise KeyError(doc_id)
+            if row_matches(row):
+                found.add(doc_id)
+        return found
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self.changed or self._row(doc_id) is not None
+
+    def __setitem__(self, doc_id: int, document: StudyDocument) -> None:
+        if self._snapshot.row(doc_id) is not None:
+            self._removed.add(doc_id)
+        self.changed[doc_id] = document
+
+    def pop(self, doc_id: int, default: Any = None) -> Any:
+        if doc_id in self.changed:
+            return self.changed.pop(doc_id)
+        document = self.get(doc_id)
+        if document is None:
+            return default
+        self._removed.add(doc_id)
+        return document
+
+    def __len__(self) -> int:
+        return len(self._snapshot.ids) - len(self._removed) + len(self.changed)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter((set(self._snapshot.ids) - self._removed) | self.changed.keys())
+
+
+class SnapshotDocumentTokens:
+    """Doc id -> token sequences of a snapshot, with later changes held in memory"""
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self._snapshot = snapshot
+        self.changed: Dict[int, Tuple[Tuple[str, ...], ...]] = {}
+        self._removed: Set[int] = set()
+
+    def __getitem__(self, doc_id: int) -> Tuple[Tuple[str, ...], ...]:
+        tokens = self.changed.get(doc_id)
+        if tokens is not None:
+            return tokens
+        row = None if doc_id in self._removed else self._snapshot.row(doc_id)
+        if row is None:
+            raise KeyError(doc_id)
+        return self._snapshot.tokens(row)
+
+    def __setitem__(self, doc_id: int, tokens: Tuple[Tuple[str, ...], ...]) -> None:
+        if self._snapshot.row(doc_id) is not None:
+            self._removed.add(doc_id)
+        self.changed[doc_id] = tokens
+
+    def pop(self, doc_id: int, default: Any = None) -> Any:
+        if doc_id in self.changed:
+            return self.changed.pop(doc_id)
+        try:
+            tokens = self[doc_id]
+        except KeyError:
+            return default
+        self._removed.add(doc_id)
+        return tokens
@@ -0,0 +1,128 @@
+"""Precomputed JSON for /api/search responses.
+
+A search result is a study's fields, its data products and the query's
+relevance score. Everything except the score depends on the study alone, so
+it is encoded once into a ``StudyFragment`` and kept in
+``study_fragment_cache`` (see ``services/cache.py``) until the study or one
+of its data products changes. A response is then put together by joining
+byte strings, with no per-request dicts, Pydantic validation or encoder
+passes over the results. The JSON matches what the ``SearchResponse`` model
+would produce.
+
+orjson encodes the fragments when it is installed; the standard library
+encoder is the fallback.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the standard library encoder is the fallback
+    orjson = None
+
+# Study columns projected for a result, in SearchResult field order
+RESULT_COLUMNS = (
+    "id",
+    "title",
+    "description",
+    "status",
+    "phase",
+    "indication_category",
+    "procedure_category",
+    "severity",
+    "risk_level",
+    "duration",
+)
+
+# Data product columns embedded in each result
+PRODUCT_COLUMNS = ("id", "title", "description", "type", "format", "study_id", "created_at")
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON bytes, with datetimes in ISO 8601"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+class StudyFragment(NamedTuple):
+    """Encoded result for one study (or entity), split where the relevance score goes"""
+    head: bytes
+    tail: bytes
+
+
+def encode_study(study: Dict[str, Any], products: List[Dict[str, Any]]) -> StudyFragment:
+    """Encode a study row and its data product rows as a search result fragment"""
+    head = dumps({
+        "id": study["id"],
+        "title": study["title"],
+        "type": "study",
+        "description": study["description"],
+        "category": None,
+        "status": study["status"],
+        "phase": study["phase"],
+        "indication_category": study["indication_category"],
+        "procedure_category": study["procedure_category"],
+        "severity": study["severity"],
+        "risk_level": study["risk_level"],
+        "duration": study["duration"],
+    })
+    tail = dumps(products)
+    return StudyFragment(head[:-1] + b',"relevance_score":', b',"data_products":' + tail + b"}")
+
+
+def encode_entity(entity_type: str, row: Mapping[str, Any]) -> StudyFragment:
+    """Encode an indication or procedure row as a search result fragment.
+
+    The row carries the table's category under the study filter name
+    (``indication_category`` or ``procedure_category``), which also fills
+    the result's ``category``.
+    """
+    head = dumps({
+        "id": row["id"],
+        "title": row["title"],
+        "type": entity_type,
+        "description": row["description"],
+        "category": row.get(f"{entity_type}_category"),
+        "status": None,
+        "phase": None,
+        "indication_category": row.get("indication_category"),
+        "procedure_category": row.get("procedure_category"),
+        "severity": row.get("severity"),
+        "risk_level": row.get("risk_level"),
+        "duration": row.get("duration"),
+    })
+    return StudyFragment(head[:-1] + b',"relevance_score":', b',"data_products":null}')
+
+
+def encode_result(fragment: StudyFragment, score: float) -> bytes:
+    """One result: the study's fragment with the query's score spliced in"""
+    return fragment.head + dumps(score) + fragment.tail
+
+
+def encode_search_response(
+    results: List[bytes],
+    total: int,
+    total_is_exact: bool,
+    page: int,
+    per_page: int,
+    next_cursor: Optional[str],
+    facets: Optional[Dict[str, Dict[str, int]]]
+) -> bytes:
+    """Assemble a SearchResponse body around already encoded results"""
+    rest = dumps({
+        "total": total,
+        "total_is_exact": total_is_exact,
+        "page": page,
+        "per_page": per_page,
+        "next_cursor": next_cursor,
+        "facets": facets,
+    })
+    return b'{"results":[' + b",".join(results) + b"]," + rest[1:]
@@ -0,0 +1,193 @@
+"""Memory-mapped snapshot files for the in-process indexes.
+
+A snapshot file is a sequence of named sections followed by a JSON
+header describing them:
+
+    magic (8 bytes) | header offset (uint64) | header length (uint64) |
+    sections ... | JSON header
+
+Each section is a flat array of one ``array`` typecode, or raw bytes, and
+starts on an 8-byte boundary. Readers ``mmap`` the file read-only and view
+sections in place through ``memoryview.cast``, so nothing is copied at
+open time and every process mapping the same file shares its pages in the
+OS page cache.
+
+Writers stream sections to a temporary file that is renamed into place
+once complete. A process that mapped the previous file keeps reading it
+after the rename.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+MAGIC = b"BMIDX\x00\x00\x01"
+PREAMBLE = struct.Struct("<8sQQ")
+ALIGNMENT = 8
+
+# Smallest unsigned typecode holding values up to the key, for delta lists
+UNSIGNED_TYPECODES = ((0xFF, "B"), (0xFFFF, "H"), (0xFFFFFFFF, "I"))
+
+
+class SnapshotError(ValueError):
+    """The file is missing, truncated or not a snapshot this code can read"""
+
+
+def unsigned_typecode(largest: int) -> str:
+    """Narrowest unsigned ``array`` typecode for values up to ``largest``"""
+    for limit, typecode in UNSIGNED_TYPECODES:
+        if largest <= limit:
+            return typecode
+    return "Q"
+
+
+class SnapshotWriter:
+    """Writes sections one at a time to a new snapshot file"""
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        handle, self._temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self._file = os.fdopen(handle, "wb")
+        self._file.write(PREAMBLE.pack(MAGIC, 0, 0))
+        self._sections: Dict[str, Tuple[int, int, str]] = {}
+
+    def _start_section(self, name: str) -> int:
+        if name in self._sections:
+            raise ValueError(f"Duplicate snapshot section: {name}")
+        offset = self._file.tell()
+        padding = -offset % ALIGNMENT
+        self._file.write(b"\0" * padding)
+        return offset + padding
+
+    def add_array(self, name: str, values: array) -> None:
+        offset = self._start_section(name)
+        values.tofile(self._file)
+        self._sections[name] = (offset, len(values) * values.itemsize, values.typecode)
+
+    def add_values(self, name: str, typecode: str, values: Iterable[Any]) -> None:
+        self.add_array(name, array(typecode, values))
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        offset = self._start_section(name)
+        self._file.write(data)
+        self._sections[name] = (offset, len(data), "B")
+
+    def add_strings(self, name: str, strings: Iterable[str]) -> None:
+        """Store strings as ``{name}.data`` UTF-8 bytes and ``{name}.offsets``"""
+        offsets = array("Q", [0])
+        data = bytearray()
+        for string in strings:
+            data += string.encode("utf-8")
+            offsets.append(len(data))
+        self.add_bytes(f"{name}.data", bytes(data))
+        self.add_array(f"{name}.offsets", offsets)
+
+    def close(self, metadata: Dict[str, Any]) -> None:
+        """Write the header and move the file into place"""
+        try:
+            header = json.dumps({
+                "kind": self.kind,
+                "byteorder": sys.byteorder,
+                "sections": self._sections,
+                "metadata": metadata,
+            }).encode("utf-8")
+            header_offset = self._file.tell()
+            self._file.write(header)
+            self._file.seek(0)
+            self._file.write(PREAMBLE.pack(MAGIC, header_offset, len(header)))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            # mkstemp creates files readable by their owner only
+            os.chmod(self._temporary_path, 0o644)
+            os.replace(self._temporary_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Drop the partly written file"""
+        self._file.close()
+        try:
+            os.unlink(self._temporary_path)
+        except FileNotFoundError:
+            pass
+
+
+def read_header(path: str, kind: Optional[str] = None) -> Dict[str, Any]:
+    """Header of a snapshot file, read without mapping the sections"""
+    try:
+        with open(path, "rb") as handle:
+            preamble = handle.read(PREAMBLE.size)
+            if len(preamble) < PREAMBLE.size:
+                raise SnapshotError(f"{path} is truncated")
+            magic, header_offset, header_length = PREAMBLE.unpack(preamble)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not an index snapshot of this version")
+            handle.seek(header_offset)
+            header = json.loads(handle.read(header_length))
+    except OSError as e:
+        raise SnapshotError(str(e)) from e
+    except ValueError as e:
+        raise SnapshotError(f"{path} has an unreadable header: {e}") from e
+    if kind is not None and header.get("kind") != kind:
+        raise SnapshotError(f"{path} holds a {header.get('kind')} snapshot, not {kind}")
+    if header.get("byteorder") != sys.byteorder:
+        raise SnapshotError(f"{path} was written on a {header.get('byteorder')}-endian machine")
+    return header
+
+
+class StringTable(Sequence[str]):
+    """Strings of a section written by ``SnapshotWriter.add_strings``, decoded on access"""
+
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+class MappedFile:
+    """A snapshot file mapped read-only, its sections viewed in place"""
+
+    def __init__(self, path: str, kind: str):
+        header = read_header(path, kind)
+        self.path = path
+        self.metadata: Dict[str, Any] = header["metadata"]
+        self._sections = header["sections"]
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def _section(self, name: str) -> Tuple[memoryview, str]:
+        try:
+            offset, length, typecode = self._sections[name]
+        except KeyError:
+            raise SnapshotError(f"{self.path} has no {name} section") from None
+        if offset + length > len(self._view):
+            raise SnapshotError(f"{self.path} is truncated")
+        return self._view[offset:offset + length], typecode
+
+    def array(self, name: str) -> memoryview:
+        """A section as a sequence of its typecode"""
+        view, typecode = self._section(name)
+        return view.cast(typecode)
+
+    def bytes(self, name: str) -> memoryview:
+        return self._section(name)[0]
+
+    def strings(self, name: str) -> StringTable:
+        return StringTable(self.bytes(f"{name}.data"), self.array(f"{name}.offsets"))
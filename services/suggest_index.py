@@ -0,0 +1,422 @@
+"""In-memory prefix index behind /api/suggest.
+
+Every title of a study, indication or procedure is stored under one key
+per word position ("cancer study 1 immunotherapy", "study 1 immunotherapy",
+...), so a prefix query matches the start of any word. Keys live in a
+sorted array searched with bisect, and the best entries found for each
+prefix are memoized so repeated keystrokes skip the range scan.
+
+The index can also be served from a memory-mapped snapshot file
+(``write_snapshot`` and ``load_snapshot``); titles changed afterwards go
+to the in-memory arrays, which then only hold those.
+"""
+import bisect
+import heapq
+import logging
+import math
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models.database_models import ClinicalStudy, Indication, Procedure, SearchHistory
+from services.change_feed import change_feed
+from services.index_snapshots import warm_start
+from services.search_index import tokenize
+from services.snapshot_file import MappedFile, SnapshotWriter
+
+logger = logging.getLogger(__name__)
+
+# How many ranked entries each memoized prefix keeps
+MEMOIZED_ENTRIES = 50
+
+# Memoized prefixes are dropped wholesale past this many
+MAX_MEMOIZED_PREFIXES = 100000
+
+# Weight of log(1 + searches) per title word, from search_history
+POPULARITY_WEIGHT = 0.5
+
+# Updates touching more rows than this merge into the key array in one pass
+# instead of inserting key by key
+BULK_UPDATE_ROWS = 256
+
+# Suggestion sources and the type reported for them
+SOURCES = (
+    (ClinicalStudy, "study"),
+    (Indication, "indication"),
+    (Procedure, "procedure"),
+)
+SOURCE_MODELS = {source_type: model for model, source_type in SOURCES}
+
+SNAPSHOT_KIND = "suggestions"
+
+
+def normalize(text: str) -> str:
+    """Lowercase text and collapse it to space-separated word tokens"""
+    return " ".join(tokenize(text))
+
+
+class Suggestion:
+    """A suggestable title and its ranking weight"""
+
+    __slots__ = ("type", "id", "text", "weight")
+
+    def __init__(self, source_type: str, source_id: int, text: str, weight: float):
+        self.type = source_type
+        self.id = source_id
+        self.text = text
+        self.weight = weight
+
+
+class SuggestionIndex:
+    """Sorted array of word-position keys mapping to weighted titles"""
+
+    def __init__(self):
+        self._keys: List[str] = []
+        self._suggestions: List[Suggestion] = []
+        self._by_source: Dict[Tuple[str, int], Suggestion] = {}
+        self._top_by_prefix: Dict[str, List[Suggestion]] = {}
+        self._popularity: Counter = Counter()
+        # Titles read from a snapshot, under those in the arrays above
+        self._base: Optional[SnapshotSuggestions] = None
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._by_source) + (len(self._base) if self._base is not None else 0)
+
+    def weight(self, text: str, base_weight: float) -> float:
+        """Base weight plus a boost for words users search for"""
+        boost = sum(math.log1p(self._popularity[token]) for token in set(tokenize(text)))
+        return (base_weight or 1.0) + POPULARITY_WEIGHT * boost
+
+    @staticmethod
+    def _keys_for(text: str) -> List[str]:
+        tokens = tokenize(text)
+        return [" ".join(tokens[start:]) for start in range(len(tokens))]
+
+    def rebuild(self, rows: Iterable[Tuple[str, int, str, float]], popularity: Counter) -> None:
+        """Replace the index with (type, id, title, base_weight) rows"""
+        with self._lock:
+            self._popularity = popularity
+            pairs = []
+            by_source = {}
+            for source_type, source_id, text, base_weight in rows:
+                if not text:
+                    continue
+                suggestion = Suggestion(source_type, source_id, text, self.weight(text, base_weight))
+                by_source[(source_type, source_id)] = suggestion
+                pairs.extend((key, suggestion) for key in self._keys_for(text))
+
+            pairs.sort(key=lambda pair: pair[0])
+            self._keys = [key for key, _ in pairs]
+            self._suggestions = [suggestion for _, suggestion in pairs]
+            self._by_source = by_source
+            self._top_by_prefix = {}
+            self._base = None
+            self.ready = True
+        logger.info("Suggestion index built with %s titles and %s keys", len(by_source), len(pairs))
+
+    def write_snapshot(self, path: str, metadata: Dict[str, Any]) -> None:
+        """Write the index to a snapshot file that ``load_snapshot`` maps.
+
+        Titles are stored as columns of type, id, weight and text, and keys
+        as a sorted string table pointing at their title. Only a rebuilt
+        index can be written, not one served from a snapshot.
+        """
+        with self._lock:
+            if self._base is not None:
+                raise ValueError("A suggestion index served from a snapshot cannot be written to one")
+            suggestions = list(self._by_source.values())
+            rows = {suggestion: row for row, suggestion in enumerate(suggestions)}
+            types = sorted({suggestion.type for suggestion in suggestions})
+            codes = {source_type: code for code, source_type in enumerate(types)}
+            sources = sorted(
+                (codes[suggestion.type] << 32 | suggestion.id, row)
+                for row, suggestion in enumerate(suggestions)
+            )
+            popular = sorted(self._popularity.items())
+
+            writer = SnapshotWriter(path, SNAPSHOT_KIND)
+            try:
+                writer.add_values("suggestions.type", "B", (codes[suggestion.type] for suggestion in suggestions))
+                writer.add_values("suggestions.id", "I", (suggestion.id for suggestion in suggestions))
+                writer.add_values("suggestions.weight", "d", (suggestion.weight for suggestion in suggestions))
+                writer.add_strings("suggestions.text", (suggestion.text for suggestion in suggestions))
+                writer.add_values("sources", "Q", (source for source, _ in sources))
+                writer.add_values("sources.row", "I", (row for _, row in sources))
+                writer.add_strings("keys", self._keys)
+                writer.add_values("keys.row", "I", (rows[suggestion] for suggestion in self._suggestions))
+                writer.add_strings("popularity.terms", (token for token, _ in popular))
+                writer.add_values("popularity.count", "Q", (count for _, count in popular))
+                writer.close({**metadata, "types": types, "titles": len(suggestions), "keys": len(self._keys)})
+            except BaseException:
+                writer.abort()
+                raise
+        logger.info("Suggestion index snapshot written to %s", path)
+
+    def load_snapshot(self, path: str) -> Dict[str, Any]:
+        """Serve the index from a file written by ``write_snapshot``; returns its metadata"""
+        base = SnapshotSuggestions(MappedFile(path, SNAPSHOT_KIND))
+        popularity = Counter(dict(zip(base.file.strings("popularity.terms"), base.file.array("popularity.count"))))
+        with self._lock:
+            self._popularity = popularity
+            self._keys = []
+            self._suggestions = []
+            self._by_source = {}
+            self._top_by_prefix = {}
+            self._base = base
+            self.ready = True
+        logger.info("Suggestion index mapped from %s with %s titles", path, len(base))
+        return base.file.metadata
+
+    def upsert(self, source_type: str, source_id: int, text: Optional[str], base_weight: float = 1.0) -> None:
+        """Add or replace the title of one source row"""
+        with self._lock:
+            self._remove(source_type, source_id)
+            if not text:
+                return
+            suggestion = Suggestion(source_type, source_id, text, self.weight(text, base_weight))
+            self._by_source[(source_type, source_id)] = suggestion
+            for key in self._keys_for(text):
+                position = bisect.bisect_right(self._keys, key)
+                self._keys.insert(position, key)
+                self._suggestions.insert(position, suggestion)
+                self._forget_prefixes(key)
+
+    def update(
+        self,
+        rows: List[Tuple[str, int, Optional[str], float]],
+        removed: Iterable[Tuple[str, int]] = ()
+    ) -> None:
+        """Upsert (type, id, title, base_weight) rows and drop removed (type, id) sources"""
+        removed = list(removed)
+        with self._lock:
+            if len(rows) + len(removed) <= BULK_UPDATE_ROWS:
+                for source_type, source_id, text, base_weight in rows:
+                    self.upsert(source_type, source_id, text, base_weight)
+                for source_type, source_id in removed:
+                    self._remove(source_type, source_id)
+                return
+
+            # Positions of the old entries, found as _remove finds them
+            dropped = []
+            for source in [*removed, *((source_type, source_id) for source_type, source_id, _, _ in rows)]:
+                if self._base is not None:
+                    self._base.shadow(*source)
+                suggestion = self._by_source.pop(source, None)
+                if suggestion is None:
+                    continue
+                for key in self._keys_for(suggestion.text):
+                    position = bisect.bisect_left(self._keys, key)
+                    while position < len(self._keys) and self._keys[position] == key:
+                        if self._suggestions[position] is suggestion:
+                            dropped.append(position)
+                            break
+                        position += 1
+            added = []
+            for source_type, source_id, text, base_weight in rows:
+                if not text:
+                    continue
+                suggestion = Suggestion(source_type, source_id, text, self.weight(text, base_weight))
+                self._by_source[(source_type, source_id)] = suggestion
+                added.extend((key, suggestion) for key in self._keys_for(text))
+            added.sort(key=lambda pair: pair[0])
+
+            # Splice slices of the old arrays around the changes, so the
+            # unchanged entries are copied in bulk
+            keys, suggestions = [], []
+            start = 0
+            for position in sorted(set(dropped)):
+                keys.extend(self._keys[start:position])
+                suggestions.extend(self._suggestions[start:position])
+                start = position + 1
+            keys.extend(self._keys[start:])
+            suggestions.extend(self._suggestions[start:])
+
+            self._keys, self._suggestions = [], []
+            start = 0
+            for key, suggestion in added:
+                position = bisect.bisect_right(keys, key, start)
+                self._keys.extend(keys[start:position])
+                self._suggestions.extend(suggestions[start:position])
+                self._keys.append(key)
+                self._suggestions.append(suggestion)
+                start = position
+            self._keys.extend(keys[start:])
+            self._suggestions.extend(suggestions[start:])
+            self._top_by_prefix = {}
+
+    def remove(self, source_type: str, source_id: int) -> None:
+        """Drop the title of one source row"""
+        with self._lock:
+            self._remove(source_type, source_id)
+
+    def _remove(self, source_type: str, source_id: int) -> None:
+        if self._base is not None:
+            text = self._base.shadow(source_type, source_id)
+            if text is not None:
+                for key in self._keys_for(text):
+                    self._forget_prefixes(key)
+        suggestion = self._by_source.pop((source_type, source_id), None)
+        if suggestion is None:
+            return
+        for key in self._keys_for(suggestion.text):
+            position = bisect.bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._suggestions[position] is suggestion:
+                    del self._keys[position]
+                    del self._suggestions[position]
+                    break
+                position += 1
+            self._forget_prefixes(key)
+
+    def _forget_prefixes(self, key: str) -> None:
+        for length in range(1, len(key) + 1):
+            self._top_by_prefix.pop(key[:length], None)
+
+    def _ranked(self, prefix: str, limit: int) -> List[Suggestion]:
+        start = bisect.bisect_left(self._keys, prefix)
+        # Every key starting with the prefix sorts before prefix + U+FFFF
+        end = bisect.bisect_left(self._keys, prefix + "\uffff", start)
+        unique = {
+            (suggestion.type, suggestion.id): suggestion
+            for suggestion in self._suggestions[start:end]
+        }
+        ranked = heapq.nlargest(limit, unique.values(), key=lambda suggestion: suggestion.weight)
+        if self._base is not None:
+            ranked = heapq.nlargest(
+                limit, [*self._base.ranked(prefix, limit), *ranked], key=lambda suggestion: suggestion.weight
+            )
+        return ranked
+
+    def suggest(self, query: str, limit: int = 5) -> List[Suggestion]:
+        """Return the highest weighted titles with a word starting with query"""
+        prefix = normalize(query)
+        # Keep a trailing space so "cancer " only completes the next word
+        if prefix and query[-1:].isspace():
+            prefix += " "
+        if not prefix:
+            return []
+
+        with self._lock:
+            if limit > MEMOIZED_ENTRIES:
+                candidates = self._ranked(prefix, limit * 2)
+            else:
+                candidates = self._top_by_prefix.get(prefix)
+                if candidates is None:
+                    candidates = self._ranked(prefix, MEMOIZED_ENTRIES)
+                    if len(self._top_by_prefix) >= MAX_MEMOIZED_PREFIXES:
+                        self._top_by_prefix.clear()
+                    self._top_by_prefix[prefix] = candidates
+
+        # The same title can match at several word positions or appear under
+        # several ids; report it once
+        results = []
+        seen = set()
+        for suggestion in candidates:
+            if (suggestion.type, suggestion.text) in seen:
+                continue
+            seen.add((suggestion.type, suggestion.text))
+            results.append(suggestion)
+            if len(results) == limit:
+                break
+        return results
+
+
+class SnapshotSuggestions:
+    """Titles and keys of a mapped suggestion snapshot, minus those replaced since"""
+
+    def __init__(self, file: MappedFile):
+        self.file = file
+        self._types = file.metadata["types"]
+        self._type_codes = {source_type: code for code, source_type in enumerate(self._types)}
+        self._type = file.array("suggestions.type")
+        self._id = file.array("suggestions.id")
+        self._weight = file.array("suggestions.weight")
+        self._text = file.strings("suggestions.text")
+        self._sources = file.array("sources")
+        self._source_rows = file.array("sources.row")
+        self._keys = file.strings("keys")
+        self._key_rows = file.array("keys.row")
+        # Rows of titles changed or deleted since the snapshot
+        self._shadowed: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._id) - len(self._shadowed)
+
+    def shadow(self, source_type: str, source_id: int) -> Optional[str]:
+        """Hide the title of a source row; returns its text if it was shown"""
+        code = self._type_codes.get(source_type)
+        if code is None:
+            return None
+        source = code << 32 | source_id
+        position = bisect.bisect_left(self._sources, source)
+        if position == len(self._sources) or self._sources[position] != source:
+            return None
+        row = self._source_rows[position]
+        if row in self._shadowed:
+            return None
+        self._shadowed.add(row)
+        return self._text[row]
+
+    def ranked(self, prefix: str, limit: int) -> List[Suggestion]:
+        """The best weighted titles with a key starting with prefix"""
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + "\uffff", start)
+        # In key order, like the in-memory arrays, so ties rank the same
+        rows = [row for row in dict.fromkeys(self._key_rows[start:end]) if row not in self._shadowed]
+        return [
+            Suggestion(self._types[self._type[row]], self._id[row], self._text[row], self._weight[row])
+            for row in heapq.nlargest(limit, rows, key=self._weight.__getitem__)
+        ]
+
+
+suggestion_index = SuggestionIndex()
+
+
+async def load_popularity(db: AsyncSession) -> Counter:
+    """Count how often each word appears in logged searches"""
+    popularity = Counter()
+    result = await db.stream(select(SearchHistory.query, SearchHistory.use_count))
+    async for query, use_count in result:
+        for token in set(tokenize(query)):
+            popularity[token] += max(use_count or 0, 1)
+    return popularity
+
+
+async def rebuild_suggestions(db: AsyncSession) -> None:
+    """Rebuild the suggestion index from the source tables"""
+    rows = []
+    for model, source_type in SOURCES:
+        result = await db.stream(select(model.id, model.title, model.relevance_score))
+        async for source_id, title, relevance_score in result:
+            rows.append((source_type, source_id, title, relevance_score))
+    suggestion_index.rebuild(rows, await load_popularity(db))
+
+
+async def warm_up_suggestions() -> None:
+    """Build the suggestion index at application startup"""
+    async with AsyncSessionLocal() as db:
+        await warm_start(db, "suggestions", suggestion_index, lambda: rebuild_suggestions(db))
+
+
+async def apply_suggestion_changes(db: AsyncSession, source_type: str, ids: Set[int]) -> None:
+    """Reload the titles of changed rows; rows that are gone were deleted"""
+    model = SOURCE_MODELS.get(source_type)
+    if model is None or not suggestion_index.ready:
+        return
+    rows = (await db.execute(
+        select(model.id, model.title, model.relevance_score).filter(model.id.in_(ids))
+    )).all()
+    suggestion_index.update(
+        [(source_type, source_id, title, relevance_score) for source_id, title, relevance_score in rows],
+        ((source_type, source_id) for source_id in ids - {row.id for row in rows})
+    )
+
+
+# Keep the index current as rows are written, see services/change_feed.py
+change_feed.subscribe(apply_suggestion_changes)
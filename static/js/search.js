@@ -18,11 +18,6 @@ document.addEventListener('DOMContentLoaded', function() {
         const trimmedTerm = term.trim();
         if (!trimmedTerm || searchTerms.includes(trimmedTerm)) return;
 
-        if (searchTerms.length >= 3) {
-            alert('Maximum 3 search terms allowed');
-            return;
-        }
-
         searchTerms.push(trimmedTerm);
         searchInput.value = '';
         updateSearchPills();
@@ -32,18 +27,19 @@ document.addEventListener('DOMContentLoaded', function() {
     // Update the search pills display
     function updateSearchPills() {
         if (!searchPills) return;
-        searchPills.innerHTML = searchTerms.map(term => `
+        // Terms may contain quotes, so the button refers to its term by position
+        searchPills.innerHTML = searchTerms.map((term, index) => `
             <div class="search-pill">
-                ${term}
+                ${term.replace(/&/g, '&amp;').replace(/</g, '&lt;')}
                 <button type="button" class="btn-close btn-close-white" 
-                        aria-label="Remove" onclick="removeSearchTerm('${term}')"></button>
+                        aria-label="Remove" onclick="removeSearchTerm(${index})"></button>
             </div>
         `).join('');
     }
 
     // Remove a search term
-    window.removeSearchTerm = function(term) {
-        searchTerms = searchTerms.filter(t => t !== term);
+    window.removeSearchTerm = function(index) {
+        searchTerms = searchTerms.filter((_, position) => position !== index);
         updateSearchPills();
         if (searchTerms.length > 0) {
             performSearch();
@@ -61,6 +57,28 @@ document.addEventListener('DOMContentLoaded', function() {
         if (paginationContainer) paginationContainer.innerHTML = '';
     }
 
+    // Current filter values keyed by their /api/search parameter, empty ones left out
+    function getFilters() {
+        const filterInputs = {
+            status: 'statusFilter',
+            phase: 'phaseFilter',
+            start_date: 'startDateFilter',
+            end_date: 'endDateFilter',
+            indication_category: 'indicationCategoryFilter',
+            severity: 'severityFilter',
+            procedure_category: 'procedureCategoryFilter',
+            risk_level: 'riskLevelFilter',
+            min_duration: 'minDurationFilter',
+            max_duration: 'maxDurationFilter'
+        };
+        const filters = {};
+        for (const [param, inputId] of Object.entries(filterInputs)) {
+            const value = document.getElementById(inputId)?.value;
+            if (value) filters[param] = value;
+        }
+        return filters;
+    }
+
     // Perform search
     async function performSearch() {
         if (searchTerms.length === 0 || isLoading) return;
@@ -69,37 +87,24 @@ document.addEventListener('DOMContentLoaded', function() {
             isLoading = true;
             showLoading();
 
-            // Get filter values
-            const status = document.getElementById('statusFilter')?.value;
-            const phase = document.getElementById('phaseFilter')?.value;
-            const startDate = document.getElementById('startDateFilter')?.value;
-            const endDate = document.getElementById('endDateFilter')?.value;
-            const indicationCategory = document.getElementById('indicationCategoryFilter')?.value;
-            const severity = document.getElementById('severityFilter')?.value;
-            const procedureCategory = document.getElementById('procedureCategoryFilter')?.value;
-            const riskLevel = document.getElementById('riskLevelFilter')?.value;
-            const minDuration = document.getElementById('minDurationFilter')?.value;
-            const maxDuration = document.getElementById('maxDurationFilter')?.value;
-
             // Build URL parameters
             const params = new URLSearchParams({
-                q: searchTerms.join(' OR '),
+                // Each pill may hold its own query syntax, so keep it grouped
+                q: searchTerms.map(term => `(${term})`).join(' OR '),
                 page: currentPage.toString(),
                 per_page: '10',
                 category: currentCategory
             });
 
             // Add filters if they have values
-            if (status) params.append('status', status);
-            if (phase) params.append('phase', phase);
-            if (startDate) params.append('start_date', startDate);
-            if (endDate) params.append('end_date', endDate);
-            if (indicationCategory) params.append('indication_category', indicationCategory);
-            if (severity) params.append('severity', severity);
-            if (procedureCategory) params.append('procedure_category', procedureCategory);
-            if (riskLevel) params.append('risk_level', riskLevel);
-            if (minDuration) params.append('min_duration', minDuration);
-            if (maxDuration) params.append('max_duration', maxDuration);
+            for (const [param, value] of Object.entries(getFilters())) {
+                params.append(param, value);
+            }
+
+            // Facet counts are the same on every page, so only ask on the first
+            if (currentPage === 1) {
+                params.append('facets', 'true');
+            }
 
             const response = await fetch(`/api/search?${params.toString()}`);
 
@@ -110,6 +115,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await response.json();
             displayResults(data);
             displayPagination(data);
+            if (data.facets) displayFacetCounts(data.facets);
         } catch (error) {
             console.error('Search error:', error);
             searchResults.innerHTML = '<p class="text-danger">Search failed. Please try again.</p>';
@@ -151,6 +157,28 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Show how many results each filter option would give, e.g. "Completed (42)"
+    function displayFacetCounts(facets) {
+        const facetSelects = {
+            status: 'statusFilter',
+            phase: 'phaseFilter',
+            indication_category: 'indicationCategoryFilter',
+            severity: 'severityFilter',
+            procedure_category: 'procedureCategoryFilter',
+            risk_level: 'riskLevelFilter'
+        };
+        for (const [field, selectId] of Object.entries(facetSelects)) {
+            const select = document.getElementById(selectId);
+            if (!select) continue;
+            const counts = facets[field] || {};
+            for (const option of select.options) {
+                if (!option.value) continue;
+                if (!option.dataset.label) option.dataset.label = option.textContent;
+                option.textContent = `${option.dataset.label} (${counts[option.value] || 0})`;
+            }
+        }
+    }
+
     // Loading spinner
     const loadingSpinner = document.createElement('div');
     loadingSpinner.className = 'spinner-border text-primary';
@@ -522,6 +550,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({
                     query: query,
                     category: currentCategory,
+                    filters: getFilters(),
                     results_count: document.querySelectorAll('.search-result-item').length,
                     is_saved: true
                 })
@@ -0,0 +1,130 @@
+"""Point the application at a throwaway SQLite database.
+
+``database`` reads DATABASE_URL when it is imported, so the environment is
+set here, before any test module imports the application.
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+DATA_DIR = tempfile.mkdtemp(prefix="biomed-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DATA_DIR, 'test.db')}"
+os.environ.setdefault("SEARCH_BACKEND", "memory")
+# Cached responses and fragments would hide the statements being counted
+os.environ["SEARCH_CACHE_TTL"] = "0"
+os.environ["SEARCH_FRAGMENT_CACHE_TTL"] = "0"
+os.environ.pop("REDIS_URL", None)
+
+import pytest  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import update  # noqa: E402
+
+from database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine  # noqa: E402
+from models.database_models import ClinicalStudy, DataProduct, User  # noqa: E402
+from routes import collections, history, search  # noqa: E402
+from services.auth import Principal, get_current_user  # noqa: E402
+from services.metrics import MetricsMiddleware, instrument_engine  # noqa: E402
+from services.search_backend import DuckDBSearchBackend, InMemorySearchBackend  # noqa: E402
+
+STUDIES = 30
+PRODUCTS_PER_STUDY = 3
+STATUSES = ("Recruiting", "Completed", "Active")
+PHASES = ("Phase 1", "Phase 2", "Phase 3")
+# The user every request is authenticated as
+USER = Principal(1, "tester@example.com", "tester", True)
+
+
+def study(number: int) -> ClinicalStudy:
+    """Study ``number`` of the corpus; text, filters and scores vary with it"""
+    title = f"Cardiac study {number}"
+    if number % 3 == 0:
+        title += " of heart failure"
+    if number % 5 == 0:
+        title += " with stent"
+    description = "Heart failure outcomes" + " heart" * (number % 4)
+    description += " in adults" if number % 2 else " in children"
+    if number % 7 == 0:
+        # Stored as NULL by ``corpus``; the column default replaces None
+        relevance_score = None
+    elif number % 11 == 0:
+        relevance_score = 0.0
+    else:
+        relevance_score = 1.0 + number / STUDIES
+    return ClinicalStudy(
+        title=title,
+        description=description,
+        status=STATUSES[number % 3],
+        phase=PHASES[(number // 3) % 3],
+        indication_category="Cardiology" if number % 2 else None,
+        start_date=datetime(2020, 1, 1) + timedelta(days=40 * number),
+        duration=30 + number,
+        relevance_score=relevance_score,
+    )
+
+
+@pytest.fixture(scope="session")
+def corpus() -> None:
+    """``STUDIES`` studies whose titles all contain "cardiac", each with several data products"""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(User(id=USER.id, email=USER.email, username=USER.username, hashed_password="x"))
+        rows = [study(number) for number in range(STUDIES)]
+        for row in rows:
+            row.data_products = [
+                DataProduct(title=f"Dataset {product}", type="dataset", format="csv")
+                for product in range(PRODUCTS_PER_STUDY)
+            ]
+        unscored = [row for row in rows if row.relevance_score is None]
+        db.add_all(rows)
+        db.flush()
+        db.execute(
+            update(ClinicalStudy)
+            .where(ClinicalStudy.id.in_([row.id for row in unscored]))
+            .values(relevance_score=None)
+        )
+        db.commit()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="session")
+def client(corpus) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(async_engine)
+    app.include_router(search.router, prefix="/api")
+    app.include_router(history.router, prefix="/api")
+    app.include_router(collections.router, prefix="/api")
+    app.dependency_overrides[get_current_user] = lambda: USER
+    # Entered, so every request runs on the same event loop and pool
+    with TestClient(app) as client:
+        # Builds the in-memory indexes, so later requests only load results
+        client.get("/api/search", params={"q": "cardiac"}).raise_for_status()
+        yield client
+
+
+def run(backend, method: str, *args, **kwargs):
+    """Call an async backend method on its own session, warming the backend up first"""
+    async def call():
+        async with AsyncSessionLocal() as db:
+            await backend.warm_up(db)
+            return await getattr(backend, method)(db, *args, **kwargs)
+    return asyncio.run(call())
+
+
+@pytest.fixture(scope="session")
+def memory_backend(corpus) -> InMemorySearchBackend:
+    return InMemorySearchBackend()
+
+
+@pytest.fixture(scope="session")
+def duckdb_backend(corpus, tmp_path_factory) -> DuckDBSearchBackend:
+    pytest.importorskip("duckdb")
+    from services.columnar import ColumnarStore
+
+    backend = DuckDBSearchBackend(ColumnarStore(str(tmp_path_factory.mktemp("columnar"))))
+    backend.store.open(engine)
+    return backend
@@ -0,0 +1,45 @@
+"""Cached principals follow committed changes to their user"""
+import pytest
+
+from database import Base, SessionLocal, engine
+from models.database_models import User
+from services.auth import Principal, principal_cache
+
+EMAIL = "cached@example.com"
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = User(email=EMAIL, username="cached", hashed_password="x", is_active=True)
+        db.add(user)
+        db.commit()
+        principal_cache.set(EMAIL, Principal(user.id, EMAIL, "cached", True))
+        yield db
+        db.rollback()
+        db.query(User).filter(User.username == "cached").delete()
+        db.commit()
+    principal_cache.discard(EMAIL)
+
+
+def test_principal_is_evicted_after_commit(db):
+    user = db.query(User).filter(User.email == EMAIL).one()
+    user.is_active = False
+    db.flush()
+    assert principal_cache.get(EMAIL) is not None
+
+    db.commit()
+    assert principal_cache.get(EMAIL) is None
+
+
+def test_principal_is_kept_when_the_change_rolls_back(db):
+    user = db.query(User).filter(User.email == EMAIL).one()
+    user.is_active = False
+    db.flush()
+    db.rollback()
+    assert principal_cache.get(EMAIL) is not None
+
+    # A later commit does not evict for the rolled back change
+    db.commit()
+    assert principal_cache.get(EMAIL) is not None
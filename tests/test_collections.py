@@ -0,0 +1,99 @@
+"""Bulk add, remove and move of collection items"""
+import pytest
+
+from conftest import USER
+from database import SessionLocal
+from models.database_models import Collection, CollectionItem
+
+
+@pytest.fixture
+def collection(client):
+    """Create a collection for the test user; returns a function making more"""
+    created = []
+
+    def create(title="Reading list"):
+        body = client.post("/api/collections", json={"title": title}).json()
+        created.append(body["id"])
+        return body["id"]
+
+    yield create
+    with SessionLocal() as db:
+        db.query(CollectionItem).filter(CollectionItem.collection_id.in_(created)).delete()
+        db.query(Collection).filter(Collection.id.in_(created)).delete()
+        db.commit()
+
+
+def item_ids(client, collection_id):
+    items = client.get(f"/api/collections/{collection_id}/items", params={"limit": 200}).json()
+    return [item["data_product"]["id"] for item in items]
+
+
+def test_add_skips_products_already_present(client, collection):
+    collection_id = collection()
+    response = client.post(f"/api/collections/{collection_id}/items", json={"data_product_ids": [1, 2, 2, 3]})
+    assert response.json()["added"] == 3
+
+    response = client.post(f"/api/collections/{collection_id}/items", json={"data_product_ids": [3, 4, 1]})
+    assert response.json()["added"] == 1
+    assert item_ids(client, collection_id) == [1, 2, 3, 4]
+
+
+def test_add_rejects_unknown_products(client, collection):
+    collection_id = collection()
+    response = client.post(f"/api/collections/{collection_id}/items", json={"data_product_ids": [1, 10 ** 6]})
+    assert response.status_code == 400
+    assert item_ids(client, collection_id) == []
+
+
+def test_remove_ignores_products_not_present(client, collection):
+    collection_id = collection()
+    client.post(f"/api/collections/{collection_id}/items", json={"data_product_ids": [1, 2, 3]})
+
+    response = client.post(f"/api/collections/{collection_id}/items/remove", json={"data_product_ids": [2, 3, 9]})
+    assert response.json()["removed"] == 2
+    assert item_ids(client, collection_id) == [1]
+
+
+def test_move_drops_products_the_target_already_holds(client, collection):
+    source, target = collection("Source"), collection("Target")
+    client.post(f"/api/collections/{source}/items", json={"data_product_ids": [1, 2, 3]})
+    client.post(f"/api/collections/{target}/items", json={"data_product_ids": [2]})
+
+    response = client.post(
+        f"/api/collections/{source}/items/move",
+        json={"data_product_ids": [1, 2, 7], "target_collection_id": target},
+    )
+    assert response.json()["moved"] == 2
+    assert item_ids(client, source) == [3]
+    assert item_ids(client, target) == [1, 2]
+
+
+def test_move_to_the_same_collection_is_rejected(client, collection):
+    collection_id = collection()
+    response = client.post(
+        f"/api/collections/{collection_id}/items/move",
+        json={"data_product_ids": [1], "target_collection_id": collection_id},
+    )
+    assert response.status_code == 400
+
+
+def test_other_users_collections_are_not_found(client, collection):
+    collection_id = collection()
+    with SessionLocal() as db:
+        other = Collection(title="Someone else's", user_id=USER.id + 1)
+        db.add(other)
+        db.commit()
+        other_id = other.id
+    try:
+        payload = {"data_product_ids": [1]}
+        assert client.post(f"/api/collections/{other_id}/items", json=payload).status_code == 404
+        assert client.post(f"/api/collections/{other_id}/items/remove", json=payload).status_code == 404
+        response = client.post(
+            f"/api/collections/{collection_id}/items/move",
+            json={**payload, "target_collection_id": other_id},
+        )
+        assert response.status_code == 404
+    finally:
+        with SessionLocal() as db:
+            db.query(Collection).filter(Collection.id == other_id).delete()
+            db.commit()
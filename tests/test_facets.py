@@ -0,0 +1,62 @@
+"""Facet counts, where each field ignores its own selection"""
+from collections import Counter
+
+import pytest
+
+from conftest import STUDIES, run, study
+from services.query_parser import parse_query
+from services.search_index import EQUALITY_FILTERS
+
+CASES = [
+    ("", {}),
+    ("", {"phase": "Phase 1"}),
+    ("", {"phase": "Phase 2", "status": "Completed"}),
+    ("stent", {"status": "Recruiting"}),
+    ("heart", {"indication_category": "Cardiology", "min_duration": 40}),
+]
+
+
+def expected_facets(text, filters):
+    """Counts computed directly from the corpus definition"""
+    studies = [study(number) for number in range(STUDIES)]
+    if text == "stent":
+        studies = [row for row in studies if "stent" in row.title]
+    if "min_duration" in filters:
+        studies = [row for row in studies if row.duration >= filters["min_duration"]]
+    facets = {}
+    for field in EQUALITY_FILTERS:
+        others = {key: value for key, value in filters.items() if key in EQUALITY_FILTERS and key != field}
+        counts = Counter(
+            getattr(row, field) for row in studies
+            if all(getattr(row, key) == value for key, value in others.items())
+        )
+        counts.pop(None, None)
+        facets[field] = dict(counts)
+    return facets
+
+
+@pytest.mark.parametrize("text, filters", CASES)
+def test_facets_ignore_their_own_selection(memory_backend, text, filters):
+    page = run(memory_backend, "search", parse_query(text), filters, 1, 5, facets=True)
+    assert page.facets == expected_facets(text, filters)
+
+
+@pytest.mark.parametrize("text, filters", CASES)
+def test_facets_are_ranked_by_count(memory_backend, text, filters):
+    page = run(memory_backend, "search", parse_query(text), filters, 1, 5, facets=True)
+    for counts in page.facets.values():
+        assert list(counts.values()) == sorted(counts.values(), reverse=True)
+
+
+@pytest.mark.parametrize("text, filters", CASES)
+def test_backends_count_facets_alike(memory_backend, duckdb_backend, text, filters):
+    expected = run(memory_backend, "search", parse_query(text), filters, 1, 5, facets=True).facets
+    actual = run(duckdb_backend, "search", parse_query(text), filters, 1, 5, facets=True).facets
+    assert actual == expected
+    assert [list(counts) for counts in actual.values()] == [list(counts) for counts in expected.values()]
+
+
+def test_facets_in_search_response(client):
+    response = client.get("/api/search", params={"q": "cardiac", "phase": "Phase 3", "facets": "true"})
+    response.raise_for_status()
+    assert response.json()["facets"]["phase"] == expected_facets("", {"phase": "Phase 3"})["phase"]
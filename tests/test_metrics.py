@@ -0,0 +1,12 @@
+"""Request metrics reported in Server-Timing"""
+import re
+
+
+def test_server_timing_counts_fetched_rows(client):
+    response = client.get("/api/search", params={"q": "cardiac", "per_page": 5})
+    response.raise_for_status()
+
+    queries, rows = re.search(r'desc="(\d+) queries, (\d+) rows"', response.headers["server-timing"]).groups()
+    assert int(queries) >= 1
+    # Five studies, each joined with its data products
+    assert int(rows) >= 5
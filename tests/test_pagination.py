@@ -0,0 +1,100 @@
+"""Cursor pages are the same rows as the matching offset pages"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import USER, run
+from database import SessionLocal
+from models.database_models import SearchHistory
+from services.query_parser import parse_query
+
+PER_PAGE = 7
+
+
+def walk_offsets(backend, query, filters):
+    hits, page = [], 1
+    while True:
+        result = run(backend, "search", query, filters, page, PER_PAGE)
+        hits.extend(result.hits)
+        if not result.has_more:
+            return hits
+        page += 1
+
+
+def walk_cursors(backend, query, filters):
+    hits, after = [], None
+    while True:
+        result = run(backend, "search", query, filters, 1, PER_PAGE, after)
+        hits.extend(result.hits)
+        if not result.has_more:
+            return hits
+        last_id, last_score = result.hits[-1]
+        after = (last_score, last_id)
+
+
+@pytest.mark.parametrize("backend", ["memory_backend", "duckdb_backend"])
+# A blank query ranks by the prior alone, so many studies tie on score
+@pytest.mark.parametrize("text, filters", [
+    ("heart failure", {}),
+    ("", {}),
+    ("cardiac", {"status": "Completed"}),
+])
+def test_cursor_pages_match_offset_pages(request, backend, text, filters):
+    backend = request.getfixturevalue(backend)
+    query = parse_query(text)
+    by_offset = walk_offsets(backend, query, filters)
+    assert walk_cursors(backend, query, filters) == by_offset
+    assert len({doc_id for doc_id, _ in by_offset}) == len(by_offset)
+
+
+def test_search_cursor_pages_match_offset_pages(client):
+    params = {"q": "heart OR stent", "per_page": PER_PAGE}
+    by_offset, page = [], 1
+    while True:
+        body = client.get("/api/search", params={**params, "page": page}).json()
+        by_offset.extend((result["id"], result["relevance_score"]) for result in body["results"])
+        if len(by_offset) >= body["total"]:
+            break
+        page += 1
+
+    by_cursor, cursor = [], None
+    while True:
+        body = client.get("/api/search", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        by_cursor.extend((result["id"], result["relevance_score"]) for result in body["results"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert by_cursor == by_offset
+    assert len(by_offset) == body["total"]
+
+
+@pytest.fixture
+def history(corpus):
+    created_at = datetime(2024, 1, 1)
+    with SessionLocal() as db:
+        # Pairs of entries share a timestamp, so the id breaks the tie
+        db.add_all(
+            SearchHistory(user_id=USER.id, query=f"query {number}", results_count=number,
+                          created_at=created_at + timedelta(minutes=number // 2))
+            for number in range(11)
+        )
+        db.commit()
+    yield
+    with SessionLocal() as db:
+        db.query(SearchHistory).filter(SearchHistory.user_id == USER.id).delete()
+        db.commit()
+
+
+def test_history_cursor_pages_cover_every_entry_once(client, history):
+    everything = [entry["id"] for entry in client.get("/api/search-history", params={"limit": 200}).json()]
+    assert len(everything) == 11
+
+    paged, cursor = [], None
+    while True:
+        response = client.get("/api/search-history", params={"limit": 3, **({"cursor": cursor} if cursor else {})})
+        paged.extend(entry["id"] for entry in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert paged == everything
@@ -0,0 +1,114 @@
+"""The /api/search query language and its compilation per backend"""
+from types import SimpleNamespace
+
+import pytest
+
+from services.query_parser import And, Not, Or, QueryError, Term, parse_query
+from services.search_backend import PostgresSearchBackend
+from services.search_index import InvertedIndex
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("heart", Term(("heart",))),
+    ("Heart-Failure", Term(("heart", "failure"))),
+    ("heart failure", And((Term(("heart",)), Term(("failure",))))),
+    ("heart AND failure", And((Term(("heart",)), Term(("failure",))))),
+    ('"heart failure"', Term(("heart", "failure"), phrase=True)),
+    ('"heart"', Term(("heart",))),
+    ("card*", Term(("card",), prefix=True)),
+    ('"heart fail"*', Term(("heart", "fail"), phrase=True, prefix=True)),
+    ('"heart fail*"', Term(("heart", "fail"), phrase=True, prefix=True)),
+    ("title:heart", Term(("heart",), field="title")),
+    ('description:"heart failure"', Term(("heart", "failure"), field="description", phrase=True)),
+    ("title:(heart OR description:lung)", Or((Term(("heart",), field="title"), Term(("lung",), field="description")))),
+    ("heart NOT failure", And((Term(("heart",)), Not(Term(("failure",)))))),
+    ("NOT NOT heart", Term(("heart",))),
+    ("and or not", And((Term(("and",)), Term(("or",)), Term(("not",))))),
+])
+def test_parse(text, expected):
+    assert parse_query(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # AND binds tighter than OR
+    ("a b OR c", "((a AND b) OR c)"),
+    ("a OR b c", "((b AND c) OR a)"),
+    ("a AND (b OR c)", "((b OR c) AND a)"),
+    ("NOT a OR b", "(NOT a OR b)"),
+    ("NOT (a OR b) c", "(NOT (a OR b) AND c)"),
+])
+def test_precedence(text, expected):
+    assert str(parse_query(text)) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("(heart failure", "(failure AND heart)"),
+    ('"heart failure', '"heart failure"'),
+    ("heart) lung", "(heart AND lung)"),
+    ("heart OR", "heart"),
+    ("AND heart NOT", "heart"),
+    # Without a term right after it, a field name is an ordinary word
+    ("title: heart", "(heart AND title)"),
+])
+def test_lenient_input(text, expected):
+    assert str(parse_query(text)) == expected
+
+
+@pytest.mark.parametrize("text", ["", "   "])
+def test_blank_query_matches_everything(text):
+    assert parse_query(text) is None
+
+
+@pytest.mark.parametrize("text", ["(((", '"', "AND OR NOT", "!!", "NOT ()"])
+def test_query_without_terms_is_rejected(text):
+    with pytest.raises(QueryError):
+        parse_query(text)
+
+
+def test_query_without_terms_is_a_bad_request(client):
+    response = client.get("/api/search", params={"q": "((("})
+    assert response.status_code == 400
+
+
+STUDIES = [
+    SimpleNamespace(id=1, title="Heart failure outcomes", description="A study of cardiac function"),
+    SimpleNamespace(id=2, title="Failure of the heart valve", description="Surgical repair"),
+    SimpleNamespace(id=3, title="Lung cancer screening", description="Heart rate monitored"),
+    SimpleNamespace(id=4, title="Cardiology registry", description="Heart failure in adults"),
+]
+
+
+@pytest.fixture(scope="module")
+def index() -> InvertedIndex:
+    index = InvertedIndex()
+    index.rebuild(STUDIES)
+    return index
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("heart failure", {1, 2, 4}),
+    ('"heart failure"', {1, 4}),
+    ("title:heart", {1, 2}),
+    ('title:"heart failure"', {1}),
+    ("description:heart", {3, 4}),
+    ("cardi*", {1, 4}),
+    ("heart NOT failure", {3}),
+    ("lung OR valve", {2, 3}),
+    ("heart (lung OR valve)", {2, 3}),
+    ("NOT heart", set()),
+])
+def test_in_memory_matching(index, text, expected):
+    assert index.search(parse_query(text)) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("heart failure", "(('heart') & ('failure'))"),
+    ('"heart failure"', "('heart' <-> 'failure')"),
+    ("card*", "('card':*)"),
+    ("title:heart", "('heart':A)"),
+    ("description:card*", "('card':*B)"),
+    ("heart NOT failure", "(('heart') & !('failure'))"),
+    ("heart OR lung", "(('heart') | ('lung'))"),
+])
+def test_tsquery_text(text, expected):
+    assert PostgresSearchBackend.tsquery_text(parse_query(text)) == expected
@@ -0,0 +1,44 @@
+"""BM25F ranking is the same on every in-process backend"""
+import pytest
+
+from conftest import run
+from services.query_parser import parse_query
+
+QUERIES = [
+    "heart failure",
+    '"heart failure"',
+    "cardi*",
+    "title:heart",
+    "description:heart OR stent",
+    "heart NOT stent",
+    "",
+]
+
+FILTERS = [
+    {},
+    {"phase": "Phase 2"},
+    {"status": "Completed", "indication_category": "Cardiology"},
+    {"min_duration": 40, "max_duration": 50},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("text", QUERIES)
+def test_backends_rank_alike(memory_backend, duckdb_backend, text, filters):
+    query = parse_query(text)
+    for page in (1, 2):
+        expected = run(memory_backend, "search", query, filters, page, 5)
+        actual = run(duckdb_backend, "search", query, filters, page, 5)
+        assert actual.total == expected.total
+        assert [doc_id for doc_id, _ in actual.hits] == [doc_id for doc_id, _ in expected.hits]
+        assert [score for _, score in actual.hits] == pytest.approx([score for _, score in expected.hits])
+        assert actual.has_more == expected.has_more
+
+
+def test_missing_relevance_score_adds_nothing(memory_backend, duckdb_backend):
+    # Studies 0 and 7 have no relevance_score and 11 has 0; with no query
+    # the score is the prior alone
+    for backend in (memory_backend, duckdb_backend):
+        scores = dict(run(backend, "search", None, {}, 1, 100).hits)
+        assert scores[1] == scores[8] == scores[12] == 0.0
+
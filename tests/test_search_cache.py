@@ -0,0 +1,94 @@
+"""Search caches are invalidated by committed writes only"""
+import asyncio
+
+import pytest
+
+from database import Base, SessionLocal, engine
+from models.database_models import ClinicalStudy
+from services.cache import ResultCache, search_cache
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        yield db
+        db.rollback()
+        db.query(ClinicalStudy).filter(ClinicalStudy.title == "Cached study").delete()
+        db.commit()
+
+
+def test_commit_invalidates_search_cache(db):
+    generation = search_cache.generation
+    db.add(ClinicalStudy(title="Cached study", description="Pending write"))
+    db.flush()
+    # Other sessions cannot see the row yet, so cached responses still hold
+    assert search_cache.generation == generation
+
+    db.commit()
+    assert search_cache.generation == generation + 1
+
+
+def test_rolled_back_write_keeps_search_cache(db):
+    generation = search_cache.generation
+    db.add(ClinicalStudy(title="Cached study", description="Rolled back write"))
+    db.flush()
+    db.rollback()
+    db.commit()
+    assert search_cache.generation == generation
+
+
+class FakeRedis:
+    """The commands RedisTier sends, against a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def mget(self, *keys):
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def incr(self, key):
+        self.values[key] = int(self.values.get(key) or 0) + 1
+        return self.values[key]
+
+
+def shared_cache() -> ResultCache:
+    pytest.importorskip("redis")
+    # Clients connect lazily, so nothing is sent to this URL
+    cache = ResultCache(namespace="test", max_size=10, ttl=60, redis_url="redis://localhost")
+    cache.remote._client = FakeRedis()
+    return cache
+
+
+def test_value_computed_across_a_remote_bump_is_not_served():
+    async def scenario():
+        cache = shared_cache()
+        value, generation = await cache.get("query")
+        assert value is None
+        # Another worker commits a write while this one computes the response
+        await cache.remote._client.incr(cache.remote.generation_key)
+        await cache.set("query", "stale response", generation)
+
+        other_worker = shared_cache()
+        other_worker.remote._client = cache.remote._client
+        value, _ = await other_worker.get("query")
+        assert value is None
+
+    asyncio.run(scenario())
+
+
+def test_value_is_shared_between_workers():
+    async def scenario():
+        cache = shared_cache()
+        _, generation = await cache.get("query")
+        await cache.set("query", "response", generation)
+
+        other_worker = shared_cache()
+        other_worker.remote._client = cache.remote._client
+        value, _ = await other_worker.get("query")
+        assert value == "response"
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+"""Statements issued by /api/search for a page of results"""
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import pytest
+from sqlalchemy import event
+
+from conftest import PRODUCTS_PER_STUDY, STUDIES
+from database import async_engine
+from services.pagination import encode_cursor
+
+@contextmanager
+def count_statements() -> Iterator[List[str]]:
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+def test_search_page_loads_products_in_one_query(client):
+    with count_statements() as statements:
+        response = client.get("/api/search", params={"q": "cardiac", "per_page": 10})
+    response.raise_for_status()
+
+    results = response.json()["results"]
+    assert len(results) == 10
+    assert all(len(result["data_products"]) == PRODUCTS_PER_STUDY for result in results)
+    # Products are loaded for the whole page, never once per study
+    assert len(statements) <= 2, statements
+
+
+def test_studies_with_several_products_are_counted_once(client):
+    response = client.get("/api/search", params={"q": "cardiac", "per_page": 100})
+    response.raise_for_status()
+
+    body = response.json()
+    assert body["total"] == STUDIES
+    ids = [result["id"] for result in body["results"]]
+    assert len(ids) == len(set(ids)) == STUDIES
+
+
+@pytest.mark.parametrize("position", [
+    {"score": "x", "id": 1},
+    {"score": 1, "id": None},
+    {"score": 1, "type": "unknown", "id": 1},
+])
+def test_malformed_cursor_is_rejected(client, position):
+    response = client.get("/api/search", params={"q": "cardiac", "cursor": encode_cursor(position)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid pagination cursor"
+
+
+@pytest.mark.parametrize("position", [
+    {"created_at": 1, "id": 1},
+    {"created_at": "yesterday", "id": 1},
+    {"created_at": "2024-01-01T00:00:00", "id": "1"},
+    {"created_at": "2024-01-01T00:00:00", "id": None},
+])
+def test_malformed_history_cursor_is_rejected(client, position):
+    response = client.get("/api/search-history", params={"cursor": encode_cursor(position)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid pagination cursor"
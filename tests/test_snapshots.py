@@ -0,0 +1,91 @@
+"""An index mapped from a snapshot answers like the index that wrote it"""
+from collections import Counter
+
+import pytest
+
+from conftest import STUDIES, study
+from database import SessionLocal
+from models.database_models import ClinicalStudy
+from services.query_parser import parse_query
+from services.search_backend import InMemorySearchBackend
+from services.search_index import InvertedIndex
+from services.suggest_index import SuggestionIndex
+from test_ranking import FILTERS, QUERIES
+
+
+@pytest.fixture(scope="module")
+def rows(corpus):
+    with SessionLocal() as db:
+        return db.query(ClinicalStudy).order_by(ClinicalStudy.id).all()
+
+
+def rebuilt(rows):
+    index = InvertedIndex()
+    index.rebuild(rows)
+    return index
+
+
+def mapped(rows, path):
+    rebuilt(rows).write_snapshot(str(path), {"built_for": "test"})
+    index = InvertedIndex()
+    assert index.load_snapshot(str(path))["built_for"] == "test"
+    return index
+
+
+def assert_same_answers(actual, expected):
+    for text in QUERIES:
+        query = parse_query(text)
+        for filters in FILTERS:
+            want = InMemorySearchBackend(expected).search_page(query, filters, 1, STUDIES, facets=True)
+            got = InMemorySearchBackend(actual).search_page(query, filters, 1, STUDIES, facets=True)
+            assert got.total == want.total
+            assert [doc_id for doc_id, _ in got.hits] == [doc_id for doc_id, _ in want.hits]
+            assert [score for _, score in got.hits] == pytest.approx([score for _, score in want.hits])
+            assert got.facets == want.facets
+
+
+def test_snapshot_round_trip(rows, tmp_path):
+    index = mapped(rows, tmp_path / "studies.snapshot")
+    assert len(index) == len(rows)
+    assert_same_answers(index, rebuilt(rows))
+
+
+def test_changes_on_top_of_a_snapshot(rows, tmp_path):
+    index = mapped(rows, tmp_path / "studies.snapshot")
+
+    added = study(STUDIES)
+    added.id = STUDIES + 1
+    changed = study(4)
+    changed.id = 5
+    changed.title = "Stent registry"
+    changed.status = "Completed"
+    removed = 9
+    for row in (added, changed):
+        index.add(row)
+    index.remove(removed)
+
+    expected = [row for row in rows if row.id not in (changed.id, removed)] + [changed, added]
+    assert len(index) == len(expected)
+    assert_same_answers(index, rebuilt(expected))
+
+
+def test_snapshot_cannot_be_rewritten(rows, tmp_path):
+    index = mapped(rows, tmp_path / "studies.snapshot")
+    with pytest.raises(ValueError):
+        index.write_snapshot(str(tmp_path / "again.snapshot"), {})
+
+
+def test_suggestion_snapshot_round_trip(rows, tmp_path):
+    titles = [("study", row.id, row.title, row.relevance_score or 1.0) for row in rows]
+    popularity = Counter({"heart": 5, "stent": 2})
+    expected = SuggestionIndex()
+    expected.rebuild(titles, popularity)
+    expected.write_snapshot(str(tmp_path / "suggestions.snapshot"), {})
+
+    index = SuggestionIndex()
+    index.load_snapshot(str(tmp_path / "suggestions.snapshot"))
+    assert len(index) == len(expected)
+    for prefix in ("card", "heart", "cardiac study 1", "with ", "stent", "x"):
+        got = [(suggestion.id, suggestion.text, suggestion.weight) for suggestion in index.suggest(prefix, 10)]
+        want = [(suggestion.id, suggestion.text, suggestion.weight) for suggestion in expected.suggest(prefix, 10)]
+        assert got == want